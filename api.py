@@ -1,10 +1,56 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import date, datetime, time, timedelta
+from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+import asyncio
+import base64
+import hashlib
+import json
 import os
-from db import get_conn
+import secrets
+import archive_jobs
+import availability
+import db
+import events
+import export
+import idempotency
+import metrics
+import recurrence
+import reflow_jobs
+import responses
+import store
+import users
+from cache import ALL_USERS, schedule_cache
+from migrations import migrate, migrate_on_start
+from shared import bus
+from store import StoreError
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Apply pending schema migrations when the server starts (set AUTO_MIGRATE=0 to skip)
+    migrate_on_start()
+    # Per worker, once it has started (see serve.py)
+    await db.start()
+    await bus.start()
+    reflow_jobs.queue.start()
+    await archive_jobs.archiver.start()
+    replica_checks = asyncio.create_task(db.monitor_replicas()) if db.router.replicas else None
+    yield
+    if replica_checks is not None:
+        replica_checks.cancel()
+    await reflow_jobs.queue.stop()
+    await archive_jobs.archiver.stop()
+    await bus.stop()
+    await db.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+# Run POST /tasks and POST /schedule once per Idempotency-Key (see idempotency.py); innermost, so CORS
+# headers are added to replayed responses like any other
+app.add_middleware(idempotency.IdempotencyMiddleware)
 
 # Add CORS middleware
 allowed_origins_env = os.getenv("ALLOWED_ORIGINS", "*")
@@ -19,594 +65,1093 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Content-Disposition", "Idempotent-Replayed"],
 )
 
+# Which user the request is for, from its Authorization / X-User-Id headers (see users.py)
+app.add_middleware(users.UserContextMiddleware)
+
+# Latency per route and status, DB statements per request (see metrics.py)
+app.add_middleware(metrics.MetricsMiddleware)
+
+class Message(BaseModel):
+    message: str
+
+# Counters and gauges, whose keys depend on the driver or backend
+Stats = Dict[str, Any]
+
+class Health(BaseModel):
+    status: str
+    message: str
+
 # Health check endpoint
-@app.get("/")
-def health_check():
+@app.get("/", response_model=Health)
+async def health_check():
     return {"status": "ok", "message": "API is running"}
 
-# Initialize database endpoint - creates tables if they don't exist
-@app.get("/init-db")
-@app.post("/init-db")
+# Connection pool stats (size, in use, waits, exhaustion count)
+@app.get("/db/pool", response_model=Stats)
+async def get_pool_stats():
+    return await db.driver_pool_stats()
+
+# Read replicas: health, lag, reads routed to each and to the primary, failovers
+@app.get("/db/replicas", response_model=Stats)
+async def get_replica_stats():
+    return db.replica_stats()
+
+# Prometheus metrics: request latency, DB queries/rows/time per route, pool and cache gauges
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    pool = await db.driver_pool_stats()
+    cache = schedule_cache.stats()
+    return PlainTextResponse(metrics.render([
+        ("smartplanner_db_pool", "Connection pool counters and gauges.", "stat", pool),
+        ("smartplanner_schedule_cache", "Schedule cache counters and gauges.", "stat", cache),
+        ("smartplanner_events", "Change feed counters and gauges.", "stat", events.hub.stats()),
+        ("smartplanner_user_cache", "User resolution cache counters and gauges.", "stat", users.user_cache.stats()),
+    ]), media_type="text/plain; version=0.0.4")
+
+# Schedule cache stats (backend, entries, hits, misses, evictions), plus the user cache's
+@app.get("/cache/stats", response_model=Stats)
+async def get_cache_stats():
+    return {**schedule_cache.stats(), "users": users.user_cache.stats(), "state": bus.stats(),
+            "idempotency": idempotency.store.stats()}
+
+class InitDbResult(BaseModel):
+    message: str
+    tables_created: bool
+    schema_version: Optional[int] = None
+
+# Initialize database endpoint - applies any pending migrations
+@app.get("/init-db", response_model=InitDbResult)
+@app.post("/init-db", response_model=InitDbResult)
 def init_database():
-    """Initialize database tables - run this once after deployment"""
+    """Initialize database tables - safe to run more than once"""
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        # Create users table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                username VARCHAR(50) NOT NULL UNIQUE,
-                password_hash VARCHAR(255) NOT NULL,
-                role VARCHAR(20) DEFAULT 'user',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Create tasks table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                title TEXT,
-                deadline DATE,
-                duration_minutes INT,
-                priority INT,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                category VARCHAR(50) DEFAULT 'General',
-                completed_at TIMESTAMP NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        """)
-        
-        # Create daily_plan table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS daily_plan (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                task_id INT,
-                plan_date DATE,
-                scheduled_time TIME,
-                task_order INT,
-                FOREIGN KEY (task_id) REFERENCES tasks(id) ON DELETE CASCADE,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        """)
-        
-        # Create default user
-        cur.execute("""
-            INSERT INTO users (id, username, password_hash) 
-            VALUES (1, 'default', 'default_hash')
-            ON DUPLICATE KEY UPDATE username=username
-        """)
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        return {"message": "Database initialized successfully", "tables_created": True}
+        version = migrate()
+        return {"message": "Database initialized successfully", "tables_created": True, "schema_version": version}
     except Exception as e:
         return {"message": f"Error initializing database: {str(e)}", "tables_created": False}
 
-# Helper function to get first available user_id
-def get_default_user_id():
+# Helper function to get the user a request is for: API token, user_id, X-User-Id header,
+# or the default user, resolved once per request and cached (see users.py)
+async def current_user_id(user_id: int = None) -> int:
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT MIN(id) FROM users")
-        user_id = cur.fetchone()[0]
-        cur.close()
-        conn.close()
-        return user_id if user_id else 1
-    except:
-        return 1
-
-# Helper function to check if time is during school hours
-def is_school_hours(date_obj: date, time_obj: time) -> bool:
-    # School is Monday-Friday, 8 AM - 4 PM
-    weekday = date_obj.weekday()  # 0 = Monday, 6 = Sunday
-    if weekday >= 5:  # Saturday or Sunday
-        return False
-    
-    hour = time_obj.hour
-    return hour >= 8 and hour < 16
-
-# Helper function to find next available time slot
-def find_available_slot(cur, date_obj: date, duration: int, start_hour: int = 5):
-    """
-    Find next available time slot for a task.
-    Avoids school hours (Mon-Fri, 8 AM - 4 PM) and existing scheduled tasks.
-    """
-    # Available hours: 5 AM - 8 AM, 4 PM - 11 PM (avoiding school hours 8 AM - 4 PM)
-    available_hours = list(range(5, 8)) + list(range(16, 24))
-    
-    # Try today first, then next 7 days
-    for day_offset in range(8):
-        check_date = date_obj + timedelta(days=day_offset)
-        weekday = check_date.weekday()
-        is_weekend = weekday >= 5
-        
-        # On weekends, all hours are available (except scheduled tasks)
-        if is_weekend:
-            hours_to_check = list(range(5, 24))
-        else:
-            # Weekdays: avoid school hours (8 AM - 4 PM)
-            hours_to_check = available_hours
-        
-        for hour in hours_to_check:
-            for minute in [0, 30]:  # Try :00 and :30
-                start_time = time(hour, minute)
-                start_datetime = datetime.combine(check_date, start_time)
-                end_datetime = start_datetime + timedelta(minutes=duration)
-                end_time = end_datetime.time()
-                
-                # Check if this time conflicts with school hours
-                if not is_weekend and is_school_hours(check_date, start_time):
-                    continue
-                
-                # Check if end time goes into school hours
-                if not is_weekend and is_school_hours(check_date, end_time):
-                    continue
-                
-                # Check if this time conflicts with existing scheduled tasks
-                cur.execute("""
-                    SELECT d.scheduled_time, t.duration_minutes 
-                    FROM daily_plan d
-                    JOIN tasks t ON t.id = d.task_id
-                    WHERE d.plan_date = %s AND d.scheduled_time IS NOT NULL
-                """, (check_date,))
-                
-                conflicts = False
-                for existing_start, existing_duration in cur.fetchall():
-                    existing_start_time = existing_start if isinstance(existing_start, time) else datetime.strptime(str(existing_start), '%H:%M:%S').time()
-                    existing_start_dt = datetime.combine(check_date, existing_start_time)
-                    existing_end_dt = existing_start_dt + timedelta(minutes=existing_duration)
-                    
-                    # Check for overlap
-                    if (start_datetime < existing_end_dt and end_datetime > existing_start_dt):
-                        conflicts = True
-                        break
-                
-                if not conflicts:
-                    return check_date, start_time
-        
-        # If we've checked today and it's a weekday, start from 4 PM tomorrow
-        if day_offset == 0 and weekday < 5:
-            continue
-    
-    return None, None
-
-# Auto-schedule a task
-def auto_schedule_task(cur, conn, task_id: int, user_id: int, due_date_str: str, duration: int, target_date: str = None):
-    """Automatically schedule a task in the next available time slot"""
+        return await users.resolve(user_id)
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+# Helper function to get the user named by the request's credentials; None for an anonymous
+# request, which may still reach anyone's tasks by id, as before
+async def caller_user_id():
     try:
-        due_date = datetime.strptime(due_date_str, '%Y-%m-%d').date()
-        today = date.today()
-        
-        # If target_date is provided, try to schedule on that specific date
-        if target_date:
-            try:
-                target_date_obj = datetime.strptime(target_date, '%Y-%m-%d').date()
-                schedule_date, schedule_time = find_available_slot(cur, target_date_obj, duration)
-                if schedule_date and schedule_time:
-                    # Successfully scheduled on target date
-                    cur.execute("DELETE FROM daily_plan WHERE task_id = %s", (task_id,))
-                    cur.execute("""
-                        INSERT INTO daily_plan (user_id, task_id, plan_date, scheduled_time, task_order) 
-                        VALUES (%s, %s, %s, %s, 1)
-                    """, (user_id, task_id, schedule_date, schedule_time))
-                    conn.commit()
-                    return {
-                        "scheduled": True,
-                        "schedule_date": str(schedule_date),
-                        "schedule_time": schedule_time.strftime('%H:%M')
-                    }
-                else:
-                    # Couldn't schedule on target date, fall through to auto-schedule
-                    pass
-            except:
-                # Invalid target date, fall through to auto-schedule
-                pass
-        
-        # Auto-schedule: Start looking from today, but prefer scheduling before due date
-        start_date = max(today, due_date - timedelta(days=7)) if due_date > today else today
-        
-        schedule_date, schedule_time = find_available_slot(cur, start_date, duration)
-        
-        if schedule_date and schedule_time:
-            # Delete any existing schedule for this task
-            cur.execute("DELETE FROM daily_plan WHERE task_id = %s", (task_id,))
-            
-            # Insert new schedule
-            cur.execute("""
-                INSERT INTO daily_plan (user_id, task_id, plan_date, scheduled_time, task_order) 
-                VALUES (%s, %s, %s, %s, 1)
-            """, (user_id, task_id, schedule_date, schedule_time))
-            
-            conn.commit()
-            return {
-                "scheduled": True,
-                "schedule_date": str(schedule_date),
-                "schedule_time": schedule_time.strftime('%H:%M')
-            }
+        return await users.owner()
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+# Helper function to turn M/D/YY, M/D/YYYY or YYYY-MM-DD into YYYY-MM-DD
+def parse_date_str(value: str) -> str:
+    if '/' in value:
+        parts = value.split('/')
+        if len(parts) == 3:
+            month, day, year = parts
+            if len(year) == 2:
+                year = '20' + year if int(year) < 50 else '19' + year
+            date_str = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
         else:
-            return {"scheduled": False, "message": "No available time slot found"}
-    except Exception as e:
-        return {"scheduled": False, "message": f"Error scheduling: {str(e)}"}
+            raise ValueError("Invalid date format")
+    else:
+        date_str = value
+
+    datetime.strptime(date_str, '%Y-%m-%d')
+    return date_str
+
+# Same as parse_date_str, but a missing or invalid date just means "auto-schedule"
+def parse_optional_date_str(value: str = None):
+    if not value:
+        return None
+    try:
+        return parse_date_str(value)
+    except:
+        return None
+
+# Helper function to serve a schedule read from the cache, loading it with op on a miss
+async def cached_read(kind: str, user_id: int, day: date, op):
+    key = (user_id, kind, day)
+    value = schedule_cache.get(key)
+    if value is None:
+        generation = schedule_cache.generation(user_id)
+        value = await db.read(op, user_id, day)
+        schedule_cache.set(key, value, generation)
+    return value
+
+# Helper functions for conditional GETs: a strong ETag from the user's data version
+# (bumped by every write) and the request URL, and the 304 answer when the client has it
+def make_etag(request: Request, user_id, *parts) -> str:
+    version = schedule_cache.version(ALL_USERS if user_id is None else user_id)
+    digest = hashlib.sha1(f"{user_id}|{version}|{request.url.path}?{request.url.query}|{parts}".encode()).hexdigest()
+    return f'"{digest[:24]}"'
+
+def not_modified(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+    if header:
+        tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+        if "*" in tags or etag in tags:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    return None
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+# Helper function for the list endpoints: with JSON_FAST_PATH=1 the content is encoded as is,
+# without checking it against the response model (see responses.py)
+def list_response(response: Response, content):
+    if responses.FAST_JSON:
+        # A returned response doesn't pick up headers set on the injected one
+        return responses.FastJSONResponse(content, headers=dict(response.headers))
+    return content
+
+class TaskAdded(BaseModel):
+    message: str
+    task_id: int
+    title: str
+    duration: int
+    due_date: str
+    scheduled: bool
+    schedule_date: Optional[str] = None
+    schedule_time: Optional[str] = None
 
 # Add task (just task name, duration, due date - no scheduling yet)
-@app.post("/tasks")
-def add_task(title: str, duration: int, due_date: str, schedule_date: str = None, user_id: int = None):
+@app.post("/tasks", response_model=TaskAdded)
+async def add_task(title: str, duration: int, due_date: str, schedule_date: str = None, user_id: int = None):
     try:
-        if user_id is None:
-            user_id = get_default_user_id()
-        
+        user_id = await current_user_id(user_id)
+
         # Parse due date
         try:
-            if '/' in due_date:
-                parts = due_date.split('/')
-                if len(parts) == 3:
-                    month, day, year = parts
-                    if len(year) == 2:
-                        year = '20' + year if int(year) < 50 else '19' + year
-                    due_date_str = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-                else:
-                    raise ValueError("Invalid date format")
-            else:
-                due_date_str = due_date
-            
-            datetime.strptime(due_date_str, '%Y-%m-%d')
+            due_date_str = parse_date_str(due_date)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid date format: {due_date}. Use M/D/YY or YYYY-MM-DD")
-        
-        conn = get_conn()
-        cur = conn.cursor()
-
-        cur.execute("SELECT id FROM users WHERE id = %s", (user_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=400, detail=f"User with id {user_id} does not exist")
 
-        cur.execute(
-            "INSERT INTO tasks (user_id, title, deadline, duration_minutes, priority, status) VALUES (%s,%s,%s,%s,%s,%s)",
-            (user_id, title, due_date_str, duration, 1, 'pending')
-        )
-
-        conn.commit()
-        task_id = cur.lastrowid
-        
         # Parse schedule_date if provided
-        target_schedule_date = None
-        if schedule_date:
-            try:
-                if '/' in schedule_date:
-                    parts = schedule_date.split('/')
-                    if len(parts) == 3:
-                        month, day, year = parts
-                        if len(year) == 2:
-                            year = '20' + year if int(year) < 50 else '19' + year
-                        target_schedule_date = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-                    else:
-                        target_schedule_date = schedule_date
-                else:
-                    target_schedule_date = schedule_date
-                datetime.strptime(target_schedule_date, '%Y-%m-%d')
-            except:
-                target_schedule_date = None  # Invalid date, use auto-schedule
-        
-        # Automatically schedule the task (to specific date if provided)
-        schedule_result = auto_schedule_task(cur, conn, task_id, user_id, due_date_str, duration, target_schedule_date)
-        
-        cur.close()
-        conn.close()
+        target_schedule_date = parse_optional_date_str(schedule_date)
+
+        task_id, schedule_result = await db.run(store.add_task, user_id, title, due_date_str, duration, target_schedule_date)
+        changed_days = [schedule_result["schedule_date"]] if schedule_result.get("schedule_date") else []
+        schedule_cache.invalidate_days(user_id, changed_days)
+        events.hub.publish(user_id, "task.created", task_id, changed_days)
 
         return {
-            "message": "Task added and scheduled successfully", 
-            "task_id": task_id, 
-            "title": title, 
-            "duration": duration, 
+            "message": "Task added and scheduled successfully",
+            "task_id": task_id,
+            "title": title,
+            "duration": duration,
             "due_date": due_date_str,
             "scheduled": schedule_result["scheduled"],
             "schedule_date": schedule_result.get("schedule_date"),
             "schedule_time": schedule_result.get("schedule_time")
         }
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding task: {str(e)}")
 
-# Get all tasks
-@app.get("/tasks")
-def get_tasks():
+class NewTask(BaseModel):
+    title: str
+    duration: int
+    due_date: str
+    schedule_date: Optional[str] = None
+
+class BulkTaskResult(BaseModel):
+    index: int
+    task_id: Optional[int] = None
+    title: str
+    duration: Optional[int] = None
+    due_date: Optional[str] = None
+    scheduled: bool
+    schedule_date: Optional[str] = None
+    schedule_time: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkTasksAdded(BaseModel):
+    message: str
+    added: int
+    scheduled: int
+    results: List[BulkTaskResult]
+
+# Add many tasks at once (JSON array) and schedule them in one pass
+@app.post("/tasks/bulk", response_model=BulkTasksAdded, response_model_exclude_unset=True)
+async def add_tasks_bulk(tasks: List[NewTask], user_id: int = None):
     try:
-        conn = get_conn()
-        cur = conn.cursor()
+        user_id = await current_user_id(user_id)
+        if len(tasks) > store.MAX_BULK_TASKS:
+            raise HTTPException(status_code=400, detail=f"At most {store.MAX_BULK_TASKS} tasks per request")
+
+        # Same date rules as POST /tasks; items with a bad due date or too long a title are reported, not inserted
+        results = [None] * len(tasks)
+        valid = []
+        for index, task in enumerate(tasks):
+            if len(task.title) > store.MAX_TITLE_LENGTH:
+                results[index] = {
+                    "index": index,
+                    "title": task.title[:store.MAX_TITLE_LENGTH],
+                    "scheduled": False,
+                    "error": f"Title is longer than {store.MAX_TITLE_LENGTH} characters"
+                }
+                continue
+            try:
+                due_date_str = parse_date_str(task.due_date)
+            except Exception:
+                results[index] = {
+                    "index": index,
+                    "title": task.title,
+                    "scheduled": False,
+                    "error": f"Invalid date format: {task.due_date}. Use M/D/YY or YYYY-MM-DD"
+                }
+                continue
+            valid.append((index, task, due_date_str, parse_optional_date_str(task.schedule_date)))
+
+        added = await db.run(store.add_tasks, user_id, [
+            (task.title, task.duration, due_date_str, target_date) for _, task, due_date_str, target_date in valid
+        ])
+        changed_days = {schedule_result["schedule_date"] for _, schedule_result in added if schedule_result.get("schedule_date")}
+        schedule_cache.invalidate_days(user_id, changed_days)
+        if added:
+            events.hub.publish(user_id, "task.created", None, changed_days)
+
+        for (index, task, due_date_str, _), (task_id, schedule_result) in zip(valid, added):
+            results[index] = {
+                "index": index,
+                "task_id": task_id,
+                "title": task.title,
+                "duration": task.duration,
+                "due_date": due_date_str,
+                "scheduled": schedule_result["scheduled"],
+                "schedule_date": schedule_result.get("schedule_date"),
+                "schedule_time": schedule_result.get("schedule_time"),
+                "error": schedule_result.get("message")
+            }
+
+        return {
+            "message": f"{len(valid)} of {len(tasks)} tasks added",
+            "added": len(valid),
+            "scheduled": sum(1 for result in results if result["scheduled"]),
+            "results": results
+        }
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error adding tasks: {str(e)}")
+
+# Helper functions for the opaque GET /tasks page cursor: the (deadline, id) of the last row
+def encode_cursor(deadline, task_id: int) -> str:
+    payload = json.dumps({"d": str(deadline) if deadline is not None else None, "i": task_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    deadline = datetime.strptime(payload["d"], '%Y-%m-%d').date() if payload["d"] else None
+    return deadline, int(payload["i"])
+
+class TaskSummary(BaseModel):
+    id: int
+    title: str
+    due_date: Optional[str] = None
+    duration: Optional[int] = None
+    status: Optional[str] = None
+
+# Get tasks, one page at a time ordered by (deadline, id); the next page's cursor is in X-Next-Cursor
+@app.get("/tasks", response_model=List[TaskSummary])
+async def get_tasks(
+    request: Request,
+    response: Response,
+    user_id: int = None,
+    status: str = None,
+    category: str = None,
+    deadline_from: str = None,
+    deadline_to: str = None,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: str = None
+):
+    try:
+        try:
+            deadline_from = parse_date_str(deadline_from) if deadline_from else None
+            deadline_to = parse_date_str(deadline_to) if deadline_to else None
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use M/D/YY or YYYY-MM-DD")
+
+        # Without user_id an anonymous request still lists every user's tasks
+        user_id = await current_user_id(user_id) if user_id is not None else await caller_user_id()
+
+        after = None
+        if cursor:
+            try:
+                after = decode_cursor(cursor)
+            except Exception:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        etag = make_etag(request, user_id)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+
+        tasks = await db.read(store.list_tasks, user_id, status, category, deadline_from, deadline_to, after, limit)
 
-        cur.execute("SELECT id, title, deadline, duration_minutes, status FROM tasks ORDER BY deadline ASC")
-        tasks = cur.fetchall()
+        if len(tasks) > limit:
+            last = tasks[limit - 1]
+            response.headers["X-Next-Cursor"] = encode_cursor(last[2], last[0])
+        set_etag(response, etag)
 
+        if responses.FAST_JSON:
+            return list_response(response, responses.task_rows(tasks[:limit]))
         result = []
-        for task in tasks:
+        for task in tasks[:limit]:
             result.append({
                 "id": task[0],
                 "title": task[1],
-                "due_date": str(task[2]),
+                "due_date": str(task[2]) if task[2] is not None else None,
                 "duration": task[3],
                 "status": task[4]
             })
-
-        cur.close()
-        conn.close()
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching tasks: {str(e)}")
 
+class Scheduled(BaseModel):
+    message: str
+    start_time: str
+    end_time: str
+
 # Schedule a task to a specific time slot
-@app.post("/schedule")
-def schedule_task(task_id: int, schedule_date: str, start_time: str):
+@app.post("/schedule", response_model=Scheduled)
+async def schedule_task(task_id: int, schedule_date: str, start_time: str):
     try:
         # Parse date and time
         try:
-            if '/' in schedule_date:
-                parts = schedule_date.split('/')
-                if len(parts) == 3:
-                    month, day, year = parts
-                    if len(year) == 2:
-                        year = '20' + year if int(year) < 50 else '19' + year
-                    schedule_date_str = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-                else:
-                    raise ValueError("Invalid date format")
-            else:
-                schedule_date_str = schedule_date
-            
-            schedule_date_obj = datetime.strptime(schedule_date_str, '%Y-%m-%d').date()
+            schedule_date_obj = datetime.strptime(parse_date_str(schedule_date), '%Y-%m-%d').date()
             start_time_obj = datetime.strptime(start_time, '%H:%M').time()
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid date/time format: {str(e)}")
-        
-        conn = get_conn()
-        cur = conn.cursor()
-
-        # Check if task exists and get duration
-        cur.execute("SELECT id, duration_minutes, user_id FROM tasks WHERE id = %s", (task_id,))
-        task = cur.fetchone()
-        if not task:
-            raise HTTPException(status_code=404, detail="Task not found")
-        
-        duration = task[1]
-        user_id = task[2]
-        
-        # Calculate end time
-        start_datetime = datetime.combine(schedule_date_obj, start_time_obj)
-        end_datetime = start_datetime + timedelta(minutes=duration)
-        end_time_obj = end_datetime.time()
-        
-        # Check for conflicts - get all scheduled tasks for this date
-        cur.execute("""
-            SELECT d.scheduled_time, t.duration_minutes 
-            FROM daily_plan d
-            JOIN tasks t ON t.id = d.task_id
-            WHERE d.plan_date = %s AND d.scheduled_time IS NOT NULL
-        """, (schedule_date_obj,))
-        
-        existing_schedules = cur.fetchall()
-        has_conflict = False
-        
-        for existing_start, existing_duration in existing_schedules:
-            existing_start_time = existing_start if isinstance(existing_start, time) else datetime.strptime(str(existing_start), '%H:%M:%S').time()
-            existing_start_dt = datetime.combine(schedule_date_obj, existing_start_time)
-            existing_end_dt = existing_start_dt + timedelta(minutes=existing_duration)
-            existing_end_time = existing_end_dt.time()
-            
-            # Check if new task overlaps with existing task
-            start_dt = datetime.combine(schedule_date_obj, start_time_obj)
-            end_dt = datetime.combine(schedule_date_obj, end_time_obj)
-            
-            if (start_dt < existing_end_dt and end_dt > existing_start_dt):
-                has_conflict = True
-                break
-        
-        if has_conflict:
-            raise HTTPException(status_code=400, detail="Time slot conflicts with existing schedule")
-        
-        # Delete existing schedule for this task if any
-        cur.execute("DELETE FROM daily_plan WHERE task_id = %s", (task_id,))
-        
-        # Insert new schedule
-        cur.execute("""
-            INSERT INTO daily_plan (user_id, task_id, plan_date, scheduled_time, task_order) 
-            VALUES (%s, %s, %s, %s, 1)
-        """, (user_id, task_id, schedule_date_obj, start_time_obj))
-
-        conn.commit()
-        cur.close()
-        conn.close()
+
+        end_time_obj, user_id, changed_days = await db.run(store.schedule_task, task_id, schedule_date_obj, start_time_obj, await caller_user_id())
+        schedule_cache.invalidate_days(user_id, changed_days)
+        events.hub.publish(user_id, "schedule.changed", task_id, changed_days)
 
         return {"message": "Task scheduled successfully", "start_time": start_time, "end_time": end_time_obj.strftime('%H:%M')}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error scheduling task: {str(e)}")
 
+# A one-off task, or with recurring_id and category, an occurrence of a recurring task
+class ScheduleEntry(BaseModel):
+    task_id: Optional[int] = None
+    recurring_id: Optional[int] = None
+    title: str
+    start_time: str
+    end_time: str
+    duration: Optional[int] = None
+    due_date: Optional[str] = None
+    category: Optional[str] = None
+
 # Get schedule for a specific date
-@app.get("/schedule/{schedule_date}")
-def get_schedule(schedule_date: str):
+@app.get("/schedule/{schedule_date}", response_model=List[ScheduleEntry], response_model_exclude_unset=True)
+async def get_schedule(request: Request, response: Response, schedule_date: str, user_id: int = None):
     try:
+        user_id = await current_user_id(user_id)
+
         try:
-            if '/' in schedule_date:
-                parts = schedule_date.split('/')
-                if len(parts) == 3:
-                    month, day, year = parts
-                    if len(year) == 2:
-                        year = '20' + year if int(year) < 50 else '19' + year
-                    schedule_date_str = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-                else:
-                    raise ValueError("Invalid date format")
-            else:
-                schedule_date_str = schedule_date
-            
-            schedule_date_obj = datetime.strptime(schedule_date_str, '%Y-%m-%d').date()
+            schedule_date_obj = datetime.strptime(parse_date_str(schedule_date), '%Y-%m-%d').date()
         except:
             raise HTTPException(status_code=400, detail="Invalid date format. Use M/D/YY or YYYY-MM-DD")
-        
-        conn = get_conn()
-        cur = conn.cursor()
-
-        cur.execute("""
-            SELECT t.id, t.title, d.scheduled_time, t.duration_minutes, t.deadline
-            FROM daily_plan d
-            JOIN tasks t ON t.id = d.task_id
-            WHERE d.plan_date = %s AND d.scheduled_time IS NOT NULL
-            ORDER BY d.scheduled_time ASC
-        """, (schedule_date_obj,))
-
-        scheduled_tasks = cur.fetchall()
-        
-        result = []
-        for task in scheduled_tasks:
-            task_id, title, start_time, duration, deadline = task
-            start_time_obj = start_time if isinstance(start_time, time) else datetime.strptime(str(start_time), '%H:%M:%S').time()
-            start_datetime = datetime.combine(schedule_date_obj, start_time_obj)
-            end_datetime = start_datetime + timedelta(minutes=duration)
-            end_time_obj = end_datetime.time()
-            
-            result.append({
-                "task_id": task_id,
-                "title": title,
-                "start_time": start_time_obj.strftime('%H:%M'),
-                "end_time": end_time_obj.strftime('%H:%M'),
-                "duration": duration,
-                "due_date": str(deadline)
-            })
 
-        cur.close()
-        conn.close()
+        etag = make_etag(request, user_id)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
 
-        return result
+        set_etag(response, etag)
+        return list_response(response, await cached_read("day", user_id, schedule_date_obj, store.day_schedule))
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching schedule: {str(e)}")
 
-# Get weekly schedule
-@app.get("/schedule/week/{week_start}")
-def get_weekly_schedule(week_start: str):
+# Get weekly schedule, keyed by date
+@app.get("/schedule/week/{week_start}", response_model=Dict[str, List[ScheduleEntry]], response_model_exclude_unset=True)
+async def get_weekly_schedule(request: Request, response: Response, week_start: str, user_id: int = None):
     try:
+        user_id = await current_user_id(user_id)
+
         try:
-            if '/' in week_start:
-                parts = week_start.split('/')
-                if len(parts) == 3:
-                    month, day, year = parts
-                    if len(year) == 2:
-                        year = '20' + year if int(year) < 50 else '19' + year
-                    week_start_str = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-                else:
-                    raise ValueError("Invalid date format")
-            else:
-                week_start_str = week_start
-            
-            week_start_obj = datetime.strptime(week_start_str, '%Y-%m-%d').date()
+            week_start_obj = datetime.strptime(parse_date_str(week_start), '%Y-%m-%d').date()
             # Adjust to Monday
-            days_since_monday = week_start_obj.weekday()
-            monday = week_start_obj - timedelta(days=days_since_monday)
+            monday = week_start_obj - timedelta(days=week_start_obj.weekday())
         except:
             raise HTTPException(status_code=400, detail="Invalid date format")
-        
-        conn = get_conn()
-        cur = conn.cursor()
-
-        week_end = monday + timedelta(days=6)
-        
-        cur.execute("""
-            SELECT d.plan_date, t.id, t.title, d.scheduled_time, t.duration_minutes, t.deadline
-            FROM daily_plan d
-            JOIN tasks t ON t.id = d.task_id
-            WHERE d.plan_date >= %s AND d.plan_date <= %s AND d.scheduled_time IS NOT NULL
-            ORDER BY d.plan_date ASC, d.scheduled_time ASC
-        """, (monday, week_end))
-
-        scheduled_tasks = cur.fetchall()
-        
-        # Organize by day
-        week_schedule = {}
-        current_date = monday
-        for i in range(7):
-            week_schedule[str(current_date)] = []
-            current_date += timedelta(days=1)
-        
-        for task in scheduled_tasks:
-            plan_date, task_id, title, start_time, duration, deadline = task
-            date_str = str(plan_date)
-            
-            start_time_obj = start_time if isinstance(start_time, time) else datetime.strptime(str(start_time), '%H:%M:%S').time()
-            start_datetime = datetime.combine(plan_date, start_time_obj)
-            end_datetime = start_datetime + timedelta(minutes=duration)
-            end_time_obj = end_datetime.time()
-            
-            if date_str in week_schedule:
-                week_schedule[date_str].append({
-                    "task_id": task_id,
-                    "title": title,
-                    "start_time": start_time_obj.strftime('%H:%M'),
-                    "end_time": end_time_obj.strftime('%H:%M'),
-                    "duration": duration,
-                    "due_date": str(deadline)
-                })
-
-        cur.close()
-        conn.close()
-
-        return week_schedule
+
+        etag = make_etag(request, user_id)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+
+        set_etag(response, etag)
+        return list_response(response, await cached_read("week", user_id, monday, store.week_schedule))
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching weekly schedule: {str(e)}")
 
-# Delete task
-@app.delete("/tasks/{task_id}")
-def delete_task(task_id: int):
+# Helper function to resolve the Monday of the requested (or current) week
+def week_monday(week_start: str = None) -> date:
+    day = datetime.strptime(parse_date_str(week_start), '%Y-%m-%d').date() if week_start else date.today()
+    return day - timedelta(days=day.weekday())
+
+class UnplannedTask(BaseModel):
+    task_id: int
+    title: str
+    reason: str
+
+class PlanGenerated(BaseModel):
+    message: str
+    week_start: str
+    week_end: str
+    tasks_planned: int
+    late: int
+    unplanned: List[UnplannedTask]
+
+# Generate a plan for the whole week from all pending tasks
+@app.post("/generate-plan", response_model=PlanGenerated)
+async def generate_plan(week_start: str = None, user_id: int = None):
     try:
-        conn = get_conn()
-        cur = conn.cursor()
+        user_id = await current_user_id(user_id)
+
+        try:
+            monday = week_monday(week_start)
+        except:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use M/D/YY or YYYY-MM-DD")
+
+        result = await db.run(store.generate_plan, user_id, monday)
+        # plan_week only moves rows within this week
+        week = [monday + timedelta(days=offset) for offset in range(7)]
+        schedule_cache.invalidate_days(user_id, week)
+        events.hub.publish(user_id, "schedule.changed", None, week)
+
+        return {
+            "message": "Plan generated successfully",
+            "week_start": str(monday),
+            "week_end": str(monday + timedelta(days=6)),
+            **result
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating plan: {str(e)}")
+
+class PlanTask(BaseModel):
+    task_id: Optional[int] = None
+    recurring_id: Optional[int] = None
+    title: str
+    start_time: str
+    end_time: str
+    duration: Optional[int] = None
+    priority: Optional[int] = None
+    deadline: Optional[str] = None
+    category: Optional[str] = None
 
-        cur.execute("SELECT id FROM tasks WHERE id = %s", (task_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Task not found")
+class PlanDay(BaseModel):
+    date: str
+    day_name: str
+    tasks: List[PlanTask]
+    total_minutes: int
 
-        cur.execute("DELETE FROM daily_plan WHERE task_id = %s", (task_id,))
-        cur.execute("DELETE FROM tasks WHERE id = %s", (task_id,))
+# Get the generated plan for a week, one entry per day
+@app.get("/plan/week", response_model=List[PlanDay], response_model_exclude_unset=True)
+async def get_week_plan(request: Request, response: Response, week_start: str = None, user_id: int = None):
+    try:
+        user_id = await current_user_id(user_id)
+
+        try:
+            monday = week_monday(week_start)
+        except:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use M/D/YY or YYYY-MM-DD")
+
+        # Without week_start the week depends on today, so it is part of the tag
+        etag = make_etag(request, user_id, monday)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+
+        set_etag(response, etag)
+        return list_response(response, await cached_read("plan", user_id, monday, store.week_plan))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching week plan: {str(e)}")
+
+# available_minutes: the user's available time that day, less their recurring tasks
+class DayLoad(BaseModel):
+    date: str
+    booked_minutes: int
+    bookings: int
+    available_minutes: int
+
+# Booked minutes per day between two dates (inclusive), at most a year, from the day_load summary
+@app.get("/plan/load", response_model=List[DayLoad])
+async def get_day_loads(request: Request, response: Response, start: str, end: str, user_id: int = None):
+    try:
+        try:
+            first_day = datetime.strptime(parse_date_str(start), '%Y-%m-%d').date()
+            last_day = datetime.strptime(parse_date_str(end), '%Y-%m-%d').date()
+        except:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use M/D/YY or YYYY-MM-DD")
+        if last_day < first_day:
+            raise HTTPException(status_code=400, detail="end must not be before start")
+        if (last_day - first_day).days >= 366:
+            raise HTTPException(status_code=400, detail="The range can be at most 366 days")
+
+        user_id = await current_user_id(user_id)
+
+        etag = make_etag(request, user_id)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+
+        set_etag(response, etag)
+        return await db.read(store.day_loads, user_id, first_day, last_day)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching day loads: {str(e)}")
+
+# Export the schedule between two dates (inclusive) as NDJSON or an iCalendar feed,
+# streamed from the database in batches so any range takes the same memory
+@app.get("/export/schedule", response_class=StreamingResponse)
+async def export_schedule(start: str, end: str, format: str = "ndjson", user_id: int = None):
+    try:
+        if format not in export.FORMATS:
+            raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(export.FORMATS)}")
+        try:
+            first_day = datetime.strptime(parse_date_str(start), '%Y-%m-%d').date()
+            last_day = datetime.strptime(parse_date_str(end), '%Y-%m-%d').date()
+        except:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use M/D/YY or YYYY-MM-DD")
+        if last_day < first_day:
+            raise HTTPException(status_code=400, detail="end must not be before start")
+
+        user_id = await current_user_id(user_id)
+
+        body = export.stream_export(user_id, first_day, last_day, format)
+        # Read the first batch before answering, so a database error is a 500 rather than a cut-off 200
+        first = await body.__anext__()
+        filename = f"schedule-{first_day}-{last_day}.{format}"
+        return StreamingResponse(
+            export.prepend(first, body),
+            media_type=export.FORMATS[format],
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error exporting schedule: {str(e)}")
 
-        conn.commit()
-        cur.close()
-        conn.close()
+# reflow_job: the background job that moves later tasks into the freed time, see GET /reflow/jobs/{id}
+class Removed(BaseModel):
+    message: str
+    reflow_job: Optional[int] = None
 
-        return {"message": "Task deleted successfully"}
+# Delete task
+@app.delete("/tasks/{task_id}", response_model=Removed)
+async def delete_task(task_id: int):
+    try:
+        user_id, changed_days = await db.run(store.delete_task, task_id, await caller_user_id())
+        schedule_cache.invalidate_days(user_id, changed_days)
+        events.hub.publish(user_id, "task.deleted", task_id, changed_days)
+        # Later tasks move up into the freed time in the background
+        job_id = reflow_jobs.queue.schedule(user_id, changed_days)
+        return {"message": "Task deleted successfully", "reflow_job": job_id}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting task: {str(e)}")
 
 # Unschedule a task (remove from schedule but keep task)
-@app.delete("/schedule/{task_id}")
-def unschedule_task(task_id: int):
+@app.delete("/schedule/{task_id}", response_model=Removed)
+async def unschedule_task(task_id: int):
     try:
-        conn = get_conn()
-        cur = conn.cursor()
+        user_id, changed_days = await db.run(store.unschedule_task, task_id, await caller_user_id())
+        schedule_cache.invalidate_days(user_id, changed_days)
+        events.hub.publish(user_id, "schedule.changed", task_id, changed_days)
+        job_id = reflow_jobs.queue.schedule(user_id, changed_days)
+        return {"message": "Task unscheduled successfully", "reflow_job": job_id}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error unscheduling task: {str(e)}")
 
-        cur.execute("DELETE FROM daily_plan WHERE task_id = %s", (task_id,))
-        conn.commit()
-        
-        if cur.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Task not found in schedule")
+class Completed(BaseModel):
+    message: str
+    task_id: int
+    completed_at: str
+    reflow_job: Optional[int] = None
 
-        cur.close()
-        conn.close()
+# Mark a task completed; its bookings that haven't started are removed and later tasks move up
+@app.post("/tasks/{task_id}/complete", response_model=Completed)
+async def complete_task(task_id: int):
+    try:
+        now = datetime.now().replace(microsecond=0)
+        user_id, completed_at, changed_days = await db.run(store.complete_task, task_id, now, await caller_user_id())
+        schedule_cache.invalidate_days(user_id, changed_days)
+        events.hub.publish(user_id, "task.completed", task_id, changed_days)
+        job_id = reflow_jobs.queue.schedule(user_id, changed_days)
+        return {"message": "Task completed", "task_id": task_id, "completed_at": str(completed_at), "reflow_job": job_id}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error completing task: {str(e)}")
 
-        return {"message": "Task unscheduled successfully"}
+# Change feed (Server-Sent Events): task and schedule changes for one user as they happen.
+# Reconnects resume after the Last-Event-ID header (or ?since=); see events.py
+@app.get("/events", response_class=StreamingResponse)
+async def get_events(request: Request, user_id: int = None, since: str = None):
+    try:
+        user_id = await current_user_id(user_id)
+        subscriber, first = events.hub.subscribe(user_id, request.headers.get("last-event-id") or since)
+    except events.TooManySubscribers as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error unscheduling task: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error opening event stream: {str(e)}")
+
+    return StreamingResponse(
+        events.stream(events.hub, subscriber, first),
+        media_type="text/event-stream",
+        # No proxy buffering, or events arrive in bursts
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Event stream stats (open streams, events published, lagging subscribers dropped, replays, resets)
+@app.get("/events/stats", response_model=Stats)
+async def get_event_stats():
+    return events.hub.stats()
+
+class ReflowJob(BaseModel):
+    id: int
+    user_id: int
+    status: str
+    days: List[str]
+    queued_at: float
+    wait_ms: Optional[float] = None
+    run_ms: Optional[float] = None
+    candidates: Optional[int] = None
+    moved: List[Dict[str, Any]]
+    error: Optional[str] = None
+
+class ReflowStatus(BaseModel):
+    enabled: bool
+    queued: int
+    scheduled: int
+    coalesced: int
+    completed: int
+    failed: int
+    tasks_moved: int
+    jobs: List[ReflowJob]
+
+# Background reflow: queue counters and the most recent jobs with their timings
+@app.get("/reflow/jobs", response_model=ReflowStatus)
+async def get_reflow_jobs(limit: int = Query(50, ge=1, le=reflow_jobs.JOB_HISTORY)):
+    return reflow_jobs.queue.status(limit)
+
+# One reflow job, as returned by DELETE /tasks/{id} and DELETE /schedule/{id}
+@app.get("/reflow/jobs/{job_id}", response_model=ReflowJob)
+async def get_reflow_job(job_id: int):
+    job = reflow_jobs.queue.job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Reflow job not found")
+    return job
+
+class ArchiveRun(BaseModel):
+    cutoff: str
+    started_at: float
+    batches: int
+    bookings: int
+    tasks: int
+    run_ms: Optional[float] = None
+    error: Optional[str] = None
+
+class ArchiveStatus(BaseModel):
+    enabled: bool
+    retention_days: int
+    cutoff: str
+    running: bool
+    archived_through: Optional[str] = None
+    tasks_archived: bool
+    runs: int
+    failed: int
+    batches: int
+    bookings: int
+    tasks: int
+    last_run: Optional[ArchiveRun] = None
+
+# Archiving of old bookings and completed tasks: settings, counters and the last run
+@app.get("/archive/status", response_model=ArchiveStatus)
+async def get_archive_status():
+    return archive_jobs.archiver.status()
+
+# Archive everything past the retention cutoff now, instead of at the next scheduled run
+@app.post("/archive/run", response_model=ArchiveRun)
+async def run_archive():
+    try:
+        return await archive_jobs.archiver.run()
+    except archive_jobs.ArchiveRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error archiving: {str(e)}")
+
+# Helper function to turn HH:MM (00:00 - 24:00) into minutes after midnight
+def parse_clock(value: str) -> int:
+    hours, minutes = value.split(':')
+    total = int(hours) * 60 + int(minutes)
+    if not (0 <= int(minutes) < 60 and 0 <= total <= 24 * 60):
+        raise ValueError(f"Invalid time: {value}")
+    return total
+
+# Helper function to parse a start/end pair of HH:MM times
+def parse_window(start_time: str, end_time: str):
+    try:
+        start, end = parse_clock(start_time), parse_clock(end_time)
+    except Exception:
+        raise HTTPException(status_code=400, detail=f"Invalid time: {start_time}-{end_time}. Use HH:MM")
+    if end <= start:
+        raise HTTPException(status_code=400, detail=f"End time must be after start time: {start_time}-{end_time}")
+    return start, end
+
+# Helper function to drop cached availability and bump the user's version after a change
+def availability_changed(user_id: int):
+    availability.invalidate(user_id)
+    schedule_cache.invalidate_days(user_id, [])
+
+class AvailabilityWindow(BaseModel):
+    weekday: int  # 0 = Monday
+    start_time: str
+    end_time: str
+
+class AvailabilityException(BaseModel):
+    date: str
+    start_time: str
+    end_time: str
+    available: bool = False
+
+class AvailabilityExceptionOut(AvailabilityException):
+    id: int
+
+class Blackout(BaseModel):
+    date: str
+    reason: Optional[str] = None
+
+class Availability(BaseModel):
+    uses_default: bool
+    template: List[AvailabilityWindow]
+    exceptions: List[AvailabilityExceptionOut]
+    blackouts: List[Blackout]
+
+class AvailabilityUpdated(BaseModel):
+    message: str
+    windows: int
+
+class AvailabilityExceptionAdded(BaseModel):
+    message: str
+    id: int
+
+class BlackoutAdded(BaseModel):
+    message: str
+    date: str
+
+# Get a user's availability: weekly template, exceptions and blackout dates
+@app.get("/availability", response_model=Availability)
+async def get_availability(user_id: int = None):
+    try:
+        user_id = await current_user_id(user_id)
+        return await db.read(store.get_availability, user_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching availability: {str(e)}")
+
+# Replace the weekly availability template (an empty list goes back to the default)
+@app.put("/availability/template", response_model=AvailabilityUpdated)
+async def set_availability_template(windows: List[AvailabilityWindow], user_id: int = None):
+    try:
+        user_id = await current_user_id(user_id)
+
+        parsed = []
+        for window in windows:
+            if not 0 <= window.weekday <= 6:
+                raise HTTPException(status_code=400, detail=f"Invalid weekday: {window.weekday}. Use 0 (Monday) - 6 (Sunday)")
+            parsed.append((window.weekday, *parse_window(window.start_time, window.end_time)))
+
+        await db.run(store.set_availability_template, user_id, parsed)
+        availability_changed(user_id)
+        return {"message": "Availability updated", "windows": len(parsed)}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating availability: {str(e)}")
+
+# Add or take away free time on one date
+@app.post("/availability/exceptions", response_model=AvailabilityExceptionAdded)
+async def add_availability_exception(exception: AvailabilityException, user_id: int = None):
+    try:
+        user_id = await current_user_id(user_id)
+
+        try:
+            exception_date = datetime.strptime(parse_date_str(exception.date), '%Y-%m-%d').date()
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use M/D/YY or YYYY-MM-DD")
+        start, end = parse_window(exception.start_time, exception.end_time)
+
+        exception_id = await db.run(
+            store.add_availability_exception, user_id, exception_date, start, end, exception.available
+        )
+        availability_changed(user_id)
+        return {"message": "Availability exception added", "id": exception_id}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error adding availability exception: {str(e)}")
+
+# Remove an availability exception
+@app.delete("/availability/exceptions/{exception_id}", response_model=Message)
+async def delete_availability_exception(exception_id: int):
+    try:
+        user_id = await db.run(store.delete_availability_exception, exception_id, await caller_user_id())
+        availability_changed(user_id)
+        return {"message": "Availability exception deleted"}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting availability exception: {str(e)}")
+
+# Block a whole date from scheduling
+@app.post("/availability/blackouts", response_model=BlackoutAdded)
+async def add_blackout(blackout_date: str, reason: str = None, user_id: int = None):
+    try:
+        user_id = await current_user_id(user_id)
+
+        try:
+            blackout_date_obj = datetime.strptime(parse_date_str(blackout_date), '%Y-%m-%d').date()
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use M/D/YY or YYYY-MM-DD")
+
+        await db.run(store.add_blackout, user_id, blackout_date_obj, reason)
+        availability_changed(user_id)
+        return {"message": "Blackout date added", "date": str(blackout_date_obj)}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error adding blackout date: {str(e)}")
+
+# Remove a blackout date
+@app.delete("/availability/blackouts/{blackout_date}", response_model=Message)
+async def delete_blackout(blackout_date: str, user_id: int = None):
+    try:
+        user_id = await current_user_id(user_id)
+
+        try:
+            blackout_date_obj = datetime.strptime(parse_date_str(blackout_date), '%Y-%m-%d').date()
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use M/D/YY or YYYY-MM-DD")
+
+        await db.run(store.delete_blackout, user_id, blackout_date_obj)
+        availability_changed(user_id)
+        return {"message": "Blackout date deleted"}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting blackout date: {str(e)}")
+
+class RecurringTask(BaseModel):
+    title: str
+    start_time: str  # HH:MM
+    duration: int
+    freq: str = "weekly"  # daily or weekly
+    every: int = 1  # every N days or weeks
+    weekdays: Optional[str] = None  # weekly only, e.g. MO,WE,FR (default: the start date's weekday)
+    start_date: Optional[str] = None  # default today
+    until: Optional[str] = None
+    count: Optional[int] = None
+    category: Optional[str] = None
+
+# A recurring task as stored: weekdays is None for daily tasks, start_date is always set
+class RecurringTaskOut(BaseModel):
+    id: int
+    title: str
+    start_time: str
+    duration: int
+    freq: str
+    every: int
+    weekdays: Optional[str] = None
+    start_date: str
+    until: Optional[str] = None
+    count: Optional[int] = None
+    category: Optional[str] = None
+
+class RecurringTaskAdded(RecurringTaskOut):
+    message: str
+
+# Helper function to drop cached rules and every cached schedule of the user after a recurring task changed
+def recurring_changed(user_id: int):
+    recurrence.invalidate(user_id)
+    schedule_cache.invalidate_user(user_id)
+
+# Add a recurring task: the same block on a daily or weekly rule, shown on every matching day
+@app.post("/recurring-tasks", response_model=RecurringTaskAdded)
+async def add_recurring_task(task: RecurringTask, user_id: int = None):
+    try:
+        user_id = await current_user_id(user_id)
+
+        if task.freq not in recurrence.FREQUENCIES:
+            raise HTTPException(status_code=400, detail=f"freq must be one of: {', '.join(recurrence.FREQUENCIES)}")
+        if task.every < 1:
+            raise HTTPException(status_code=400, detail="every must be at least 1")
+        try:
+            start = parse_clock(task.start_time)
+        except Exception:
+            raise HTTPException(status_code=400, detail=f"Invalid time: {task.start_time}. Use HH:MM")
+        if task.duration <= 0 or start + task.duration > 24 * 60:
+            raise HTTPException(status_code=400, detail="The task must have a duration and end by midnight")
+        weekdays = 0
+        if task.weekdays:
+            if task.freq != "weekly":
+                raise HTTPException(status_code=400, detail="weekdays only applies to weekly tasks")
+            try:
+                weekdays = recurrence.parse_weekdays(task.weekdays)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        try:
+            start_date = datetime.strptime(parse_date_str(task.start_date), '%Y-%m-%d').date() if task.start_date else date.today()
+            until = datetime.strptime(parse_date_str(task.until), '%Y-%m-%d').date() if task.until else None
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use M/D/YY or YYYY-MM-DD")
+        if until is not None and task.count is not None:
+            raise HTTPException(status_code=400, detail="Give until or count, not both")
+        if until is not None and until < start_date:
+            raise HTTPException(status_code=400, detail="until must not be before start_date")
+        if task.count is not None and not 1 <= task.count <= recurrence.MAX_COUNT:
+            raise HTTPException(status_code=400, detail=f"count must be between 1 and {recurrence.MAX_COUNT}")
+
+        rule = await db.run(
+            store.add_recurring_task, user_id, task.title, start, task.duration, task.freq, task.every,
+            weekdays, start_date, until, task.count, task.category
+        )
+        recurring_changed(user_id)
+        return {"message": "Recurring task added", **rule.describe()}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error adding recurring task: {str(e)}")
+
+# List a user's recurring tasks
+@app.get("/recurring-tasks", response_model=List[RecurringTaskOut])
+async def get_recurring_tasks(user_id: int = None):
+    try:
+        user_id = await current_user_id(user_id)
+        return await db.read(store.list_recurring_tasks, user_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching recurring tasks: {str(e)}")
+
+# Delete a recurring task and all of its occurrences
+@app.delete("/recurring-tasks/{recurring_id}", response_model=Message)
+async def delete_recurring_task(recurring_id: int):
+    try:
+        user_id = await db.run(store.delete_recurring_task, recurring_id, await caller_user_id())
+        recurring_changed(user_id)
+        return {"message": "Recurring task deleted"}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting recurring task: {str(e)}")
+
+class UserCreated(BaseModel):
+    message: str
+    id: int
+    username: str
+    token: str
+
+class CurrentUser(BaseModel):
+    id: int
+
+# Create a user. The response has the user's API token, which is not stored and can't be shown again;
+# send it as "Authorization: Bearer <token>" and every endpoint acts for that user
+@app.post("/users", response_model=UserCreated)
+async def create_user(username: str):
+    try:
+        username = username.strip()
+        if not username or len(username) > 50:
+            raise HTTPException(status_code=400, detail="Username must be 1-50 characters")
+        token = secrets.token_urlsafe(32)
+        user_id = await db.run(store.create_user, username, users.hash_token(token))
+        users.invalidate(user_id)
+        return {"message": "User created", "id": user_id, "username": username, "token": token}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating user: {str(e)}")
+
+# The user this request is for
+@app.get("/users/me", response_model=CurrentUser)
+async def get_current_user(user_id: int = None):
+    return {"id": await current_user_id(user_id)}
+
+# Delete a user and everything they own; the request must be made as that user
+@app.delete("/users/{user_id}", response_model=Message)
+async def delete_user(user_id: int):
+    try:
+        if await caller_user_id() != user_id:
+            raise HTTPException(status_code=403, detail="Only the user themselves can delete their account")
+        await db.run(store.delete_user, user_id)
+        users.invalidate(user_id)
+        availability.invalidate(user_id)
+        recurrence.invalidate(user_id)
+        schedule_cache.invalidate_user(user_id)
+        return {"message": "User deleted"}
+    except StoreError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting user: {str(e)}")
@@ -0,0 +1,71 @@
+"""
+What has been moved to the archive tables, so reads know when to look there.
+
+archive_jobs.py moves bookings of completed tasks dated before the retention
+cutoff (ARCHIVE_RETENTION_DAYS before today) from daily_plan to
+daily_plan_archive. Bookings of pending tasks stay, so the planner still
+sees those tasks as booked. It also moves tasks completed before the cutoff,
+once none of their bookings are left in daily_plan, from tasks to
+tasks_archive. The live tables then
+hold only recent history, however long the app runs.
+
+Reads stay the same from the outside. The schedule, week plan and export
+reads also query daily_plan_archive when their range starts on or before
+the newest archived date, or before the cutoff, where another worker may
+have archived since. Reads of recent and future dates, which are the hot
+path, never touch it. GET /tasks adds archived tasks when it lists all
+statuses or completed ones, once any task has been archived.
+
+Each worker keeps its own copy of the state. The API loads it at startup.
+After each batch the archive job sends what it moved to every worker
+through publish() (see shared.py), and after each run it reloads its own
+copy from the database.
+"""
+import os
+from datetime import date, timedelta
+
+from shared import bus
+
+RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "90"))
+
+
+def cutoff(today: date = None) -> date:
+    """Bookings before this date, and tasks completed before it, are archived."""
+    return (today or date.today()) - timedelta(days=RETENTION_DAYS)
+
+
+class ArchiveState:
+    def __init__(self):
+        self.archived_through = None  # newest plan_date in daily_plan_archive
+        self.tasks_archived = False
+
+    def covers(self, first_day: date) -> bool:
+        """Whether archived bookings may fall in a range starting on first_day."""
+        if first_day < cutoff():
+            return True
+        return self.archived_through is not None and first_day <= self.archived_through
+
+    def note(self, archived_through: date = None, tasks_archived: bool = False):
+        """Record rows this process has seen archived; the state only moves forward."""
+        if archived_through is not None and (self.archived_through is None or archived_through > self.archived_through):
+            self.archived_through = archived_through
+        self.tasks_archived = self.tasks_archived or tasks_archived
+
+
+state = ArchiveState()
+
+
+def publish(archived_through: date = None, tasks_archived: bool = False):
+    """Record a batch's progress in every worker's state."""
+    bus.publish("archive.progress", {
+        "archived_through": str(archived_through) if archived_through else None,
+        "tasks_archived": tasks_archived,
+    })
+
+
+def _progress(message, seq):
+    archived_through = message["archived_through"]
+    state.note(date.fromisoformat(archived_through) if archived_through else None, message["tasks_archived"])
+
+
+bus.on("archive.progress", _progress)
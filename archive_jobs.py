@@ -0,0 +1,127 @@
+"""
+Background job that moves old history into the archive tables (see archive.py).
+
+Every ARCHIVE_INTERVAL seconds, starting when the API starts, the archiver
+runs store.archive_batch until nothing is left to move. Each batch moves
+at most ARCHIVE_BATCH_SIZE bookings and ARCHIVE_BATCH_SIZE completed tasks
+in its own short transaction, and locks only those rows. The archiver
+pauses ARCHIVE_BATCH_PAUSE_MS between batches, so requests for the same
+rows never wait long. A run that falls behind is no worse than one that
+has not started yet: reads look in both tables, and the next run picks up
+where this one stopped.
+
+POST /archive/run starts a run at once and waits for it. GET /archive/status
+shows the counters and the last run, for the worker that answers. Every
+worker runs its own archiver; runs that overlap lock different rows, or
+wait for each other's batches.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+import archive
+import db
+import store
+
+ENABLED = os.getenv("ARCHIVE_ENABLED", "1") == "1"
+INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+BATCH_PAUSE = float(os.getenv("ARCHIVE_BATCH_PAUSE_MS", "50")) / 1000
+
+logger = logging.getLogger("smartplanner.archive")
+
+
+class ArchiveRunning(Exception):
+    """Raised when a run is asked for while one is already going in this process."""
+
+
+class Archiver:
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._worker = None
+        self._last_run = None
+        self._stats = {"runs": 0, "failed": 0, "batches": 0, "bookings": 0, "tasks": 0}
+
+    async def refresh(self):
+        """Load what is archived already into archive.state."""
+        archived_through, tasks_archived = await db.run(store.archive_state)
+        archive.state.note(archived_through, tasks_archived)
+
+    async def run(self):
+        """Archive everything past the cutoff, one batch at a time. Returns the run's summary."""
+        if self._lock.locked():
+            raise ArchiveRunning("An archive run is already in progress")
+        async with self._lock:
+            cutoff = archive.cutoff()
+            run = {"cutoff": str(cutoff), "started_at": time.time(), "batches": 0, "bookings": 0, "tasks": 0,
+                   "run_ms": None, "error": None}
+            started = time.perf_counter()
+            try:
+                while True:
+                    now = datetime.now().replace(microsecond=0)
+                    result = await db.run(store.archive_batch, cutoff, now, BATCH_SIZE)
+                    archive.publish(result["archived_through"], result["tasks"] > 0)
+                    run["batches"] += 1
+                    run["bookings"] += result["bookings"]
+                    run["tasks"] += result["tasks"]
+                    if result["bookings"] < BATCH_SIZE and result["tasks"] < BATCH_SIZE:
+                        break
+                    await asyncio.sleep(BATCH_PAUSE)
+                # Pick up what other workers archived
+                await self.refresh()
+                self._stats["runs"] += 1
+            except Exception as e:
+                run["error"] = str(e)
+                self._stats["failed"] += 1
+                raise
+            finally:
+                run["run_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                for key in ("batches", "bookings", "tasks"):
+                    self._stats[key] += run[key]
+                self._last_run = run
+            return run
+
+    async def work(self):
+        while True:
+            try:
+                await self.run()
+            except ArchiveRunning:
+                pass
+            except Exception:
+                logger.exception("Archive run failed")
+            await asyncio.sleep(INTERVAL)
+
+    async def start(self):
+        try:
+            await self.refresh()
+        except Exception:
+            # The first run loads it instead, once the database is reachable
+            logger.exception("Could not load the archive state")
+        if ENABLED:
+            self._worker = asyncio.create_task(self.work())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def status(self):
+        return {
+            "enabled": ENABLED,
+            "retention_days": archive.RETENTION_DAYS,
+            "cutoff": str(archive.cutoff()),
+            "running": self._lock.locked(),
+            "archived_through": str(archive.state.archived_through) if archive.state.archived_through else None,
+            "tasks_archived": archive.state.tasks_archived,
+            **self._stats,
+            "last_run": self._last_run,
+        }
+
+
+archiver = Archiver()
@@ -0,0 +1,159 @@
+"""
+Per-user availability compiled into day bitmaps.
+
+A day is SLOTS_PER_DAY slots of SLOT_MINUTES each; bit i of a mask stands for
+[i * SLOT_MINUTES, (i + 1) * SLOT_MINUTES). A user's availability is:
+
+- a weekly template: windows per weekday (0 = Monday). Users without one get
+  DEFAULT_TEMPLATE, the old fixed rules (weekdays outside school hours 8-4,
+  weekends from 5 AM);
+- exceptions: windows on one date that add free time (available) or take it away;
+- blackout dates: nothing can be scheduled that day.
+
+Each date's mask is built once per Availability and memoized, and loaded
+Availability objects are cached per user for AVAILABILITY_CACHE_TTL seconds
+(and dropped by invalidate() in every worker when they change; see
+per_user_cache.py), so the slot finder normally runs no availability
+queries at all.
+"""
+from datetime import date, timedelta
+from datetime import time as time_of_day
+
+from per_user_cache import PerUserCache
+
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+# Compiled days kept per Availability before the memo starts over
+MAX_MEMO_DAYS = 4096
+
+# (start minute, end minute) windows per weekday, end exclusive
+DEFAULT_TEMPLATE = {
+    weekday: [(5 * 60, 8 * 60), (16 * 60, 24 * 60)] if weekday < 5 else [(5 * 60, 24 * 60)]
+    for weekday in range(7)
+}
+
+
+def to_minutes(value) -> int:
+    """Minutes after midnight for a TIME column (time, timedelta or 'HH:MM[:SS]', up to 24:00)."""
+    if isinstance(value, time_of_day):
+        return value.hour * 60 + value.minute
+    if isinstance(value, timedelta):
+        # mysql.connector and aiomysql return TIME columns as timedelta
+        return int(value.total_seconds()) // 60
+    hours, minutes = str(value).split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def to_time(minutes: int) -> time_of_day:
+    return time_of_day((minutes // 60) % 24, minutes % 60)
+
+
+def window_mask(start: int, end: int) -> int:
+    """Slots lying entirely inside [start, end) minutes."""
+    first = -(-start // SLOT_MINUTES)
+    last = min(end, 24 * 60) // SLOT_MINUTES
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def busy_mask(start: int, end: int) -> int:
+    """Slots touched by [start, end) minutes, so a booking off the 5 minute grid still blocks its slots."""
+    first = max(start, 0) // SLOT_MINUTES
+    last = min(-(-end // SLOT_MINUTES), SLOTS_PER_DAY)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def first_run(free: int, length: int) -> int:
+    """Lowest slot i where slots i .. i + length - 1 are all set in free, or -1."""
+    if length <= 0:
+        return -1
+    # After each step bit i is set iff the `covered` slots starting at i are all free
+    runs = free
+    covered = 1
+    while covered < length and runs:
+        step = min(covered, length - covered)
+        runs &= runs >> step
+        covered += step
+    if not runs:
+        return -1
+    return (runs & -runs).bit_length() - 1
+
+
+class Availability:
+    def __init__(self, template=None, exceptions=None, blackouts=()):
+        template = template or DEFAULT_TEMPLATE
+        self.weekday_masks = [0] * 7
+        for weekday, windows in template.items():
+            for start, end in windows:
+                self.weekday_masks[weekday] |= window_mask(start, end)
+        self.exceptions = exceptions or {}  # date -> [(start, end, available)]
+        self.blackouts = set(blackouts)
+        self._days = {}
+
+    def day_mask(self, day: date) -> int:
+        mask = self._days.get(day)
+        if mask is None:
+            if day in self.blackouts:
+                mask = 0
+            else:
+                mask = self.weekday_masks[day.weekday()]
+                windows = self.exceptions.get(day, ())
+                for start, end, available in windows:
+                    if available:
+                        mask |= window_mask(start, end)
+                # Time taken away wins over time added, and blocks every slot it touches
+                for start, end, available in windows:
+                    if not available:
+                        mask &= ~busy_mask(start, end)
+            if len(self._days) >= MAX_MEMO_DAYS:
+                self._days.clear()
+            self._days[day] = mask
+        return mask
+
+
+DEFAULT = Availability()
+
+
+async def fetch(cur, user_id: int) -> Availability:
+    """The user's availability straight from the database, with three small queries."""
+    await cur.execute(
+        "SELECT weekday, start_time, end_time FROM availability_templates WHERE user_id = %s",
+        (user_id,)
+    )
+    template = {}
+    for weekday, start_time, end_time in await cur.fetchall():
+        template.setdefault(weekday, []).append((to_minutes(start_time), to_minutes(end_time)))
+    if template:
+        # Weekdays missing from a user's template have no free time
+        template = {weekday: template.get(weekday, []) for weekday in range(7)}
+
+    await cur.execute(
+        "SELECT exception_date, start_time, end_time, available FROM availability_exceptions WHERE user_id = %s",
+        (user_id,)
+    )
+    exceptions = {}
+    for exception_date, start_time, end_time, available in await cur.fetchall():
+        exceptions.setdefault(exception_date, []).append((to_minutes(start_time), to_minutes(end_time), bool(available)))
+
+    await cur.execute("SELECT blackout_date FROM blackout_dates WHERE user_id = %s", (user_id,))
+    blackouts = [row[0] for row in await cur.fetchall()]
+
+    return Availability(template, exceptions, blackouts)
+
+
+_cache = PerUserCache("availability", fetch)
+
+
+def invalidate(user_id: int):
+    """Drop the user's cached availability here and in every other worker (see shared.py)."""
+    _cache.invalidate(user_id)
+
+
+async def load(cur, user_id: int = None) -> Availability:
+    """The user's compiled availability, from the cache or fetch()."""
+    if user_id is None:
+        return DEFAULT
+    return await _cache.load(cur, user_id)
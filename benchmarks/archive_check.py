@@ -0,0 +1,144 @@
+"""
+Archive check: hot reads with growing history, before and after archiving.
+
+For each history length it builds an in-memory database on the
+DB_DRIVER=sqlite backend. User 1 gets --per-day completed tasks booked on
+every past day of that history, plus the current bench_suite data (pending
+tasks around today with a busy calendar). It times the hot reads with all
+of that history in the live tables, then runs store.archive_batch until
+nothing is left to move and times them again:
+
+- find_available_slot  for a 30 minute task from today
+- get_weekly_schedule  this week
+- get_tasks            the first page of pending tasks
+- past_week            a week inside the archived range (reads the archive after)
+
+The past week and the list of completed tasks must read the same before and
+after archiving, and the script exits 1 if they don't. After archiving, the
+hot reads should take the same time whatever the history length.
+
+    python benchmarks/archive_check.py [--history-days 0 365 1095] [--per-day 10] [--min-time 0.5]
+"""
+import argparse
+import os
+import sys
+from datetime import date, datetime, time, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import archive  # noqa: E402
+import db_sqlite  # noqa: E402
+import store  # noqa: E402
+from bench_suite import fill_day_load, measure, seed  # noqa: E402
+from scheduler import find_available_slot  # noqa: E402
+
+CURRENT_TASKS = 1000
+FIRST_HISTORY_ID = 1_000_000
+
+
+def seed_history(database, days, per_day, today):
+    """per_day completed tasks for user 1 on each of the days before the current data, each booked that day."""
+    first_day = today - timedelta(days=CURRENT_TASKS // 40 + days)
+    tasks, bookings = [], []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        for slot in range(per_day):
+            task_id = FIRST_HISTORY_ID + offset * per_day + slot
+            starts_at = datetime.combine(day, time(8)) + timedelta(minutes=30 * slot)
+            tasks.append((task_id, f"done {task_id}", day, starts_at + timedelta(minutes=30)))
+            bookings.append((task_id, day, starts_at.time(), starts_at, starts_at + timedelta(minutes=30)))
+    with database.checkout() as raw:
+        raw.executemany(
+            "INSERT INTO tasks (id, user_id, title, deadline, duration_minutes, priority, status, category, completed_at) "
+            "VALUES (?, 1, ?, ?, 30, 1, 'completed', 'General', ?)",
+            tasks
+        )
+        raw.executemany(
+            "INSERT INTO daily_plan (user_id, task_id, plan_date, scheduled_time, task_order, starts_at, ends_at) "
+            "VALUES (1, ?, ?, ?, 1, ?, ?)",
+            bookings
+        )
+        fill_day_load(raw)
+        raw.commit()
+    return first_day
+
+
+def cases(today, past_monday):
+    monday = today - timedelta(days=today.weekday())
+
+    async def slot(conn):
+        return await find_available_slot(conn.cursor(), today, 30, user_id=1)
+
+    async def weekly(conn):
+        return await store.week_schedule(conn, 1, monday)
+
+    async def tasks(conn):
+        return await store.list_tasks(conn, 1, status="pending", limit=100)
+
+    async def past_week(conn):
+        return await store.week_schedule(conn, 1, past_monday)
+
+    return [
+        ("find_available_slot", slot),
+        ("get_weekly_schedule", weekly),
+        ("get_tasks", tasks),
+        ("past_week", past_week),
+    ]
+
+
+def archive_all(database, today):
+    """Run archive batches until none is full, as archive_jobs does. Returns (batches, bookings, tasks)."""
+    batches = bookings = tasks = 0
+    while True:
+        now = datetime.combine(today, time(12))
+        result = database.run_blocking(store.archive_batch, archive.cutoff(today), now, 500)
+        archive.state.note(result["archived_through"], result["tasks"] > 0)
+        batches += 1
+        bookings += result["bookings"]
+        tasks += result["tasks"]
+        if result["bookings"] < 500 and result["tasks"] < 500:
+            return batches, bookings, tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--history-days", type=int, nargs="+", default=[0, 365, 1095])
+    parser.add_argument("--per-day", type=int, default=10, help="completed tasks per past day")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to run each case")
+    args = parser.parse_args()
+
+    today = date.today()
+    failures = []
+    print(f"{'history':>8} {'tables':<9} {'case':<20} {'ops/sec':>10} {'mean ms':>9} {'queries':>8} {'rows':>7}")
+    for days in args.history_days:
+        archive.state = archive.ArchiveState()
+        database = db_sqlite.Database(":memory:")
+        seed(database, CURRENT_TASKS, today)
+        first_day = seed_history(database, days, args.per_day, today)
+        past = max(first_day, archive.cutoff(today) - timedelta(days=30))
+        past_monday = past - timedelta(days=past.weekday())
+
+        async def completed(conn):
+            return await store.list_tasks(conn, 1, status="completed", limit=100)
+
+        before = (database.run_blocking(store.week_schedule, 1, past_monday), database.run_blocking(completed))
+        for phase in ("live", "archived"):
+            if phase == "archived":
+                batches, bookings, tasks = archive_all(database, today)
+                print(f"{days:>8} archived {bookings} bookings and {tasks} tasks in {batches} batches")
+                after = (database.run_blocking(store.week_schedule, 1, past_monday), database.run_blocking(completed))
+                if after != before:
+                    failures.append(days)
+                    print(f"{days:>8} FAIL: past reads changed after archiving")
+            for name, op in cases(today, past_monday):
+                result = measure(database, op, args.min_time)
+                print(f"{days:>8} {phase:<9} {name:<20} {result['ops_per_sec']:>10.1f} {result['mean_ms']:>9.3f} "
+                      f"{result['queries']:>8g} {result['rows']:>7g}")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
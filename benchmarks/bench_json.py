@@ -0,0 +1,144 @@
+"""
+JSON encoding benchmark: the list endpoints' response paths at 1k and 100k rows.
+
+Each case turns the rows an endpoint gets from the store into the response
+body, the way api.py does on each path, leaving out the query:
+
+- untyped      dicts built per row, jsonable_encoder, json.dumps (before response models)
+- model        dicts built per row, validated and serialized by the response model,
+               json.dumps (what FastAPI does with response_model, the default)
+- fast         responses.FastJSONResponse: the content encoded in one call (JSON_FAST_PATH=1)
+- fast-stdlib  the same without orjson, on the stdlib json module
+
+for GET /tasks (row tuples from store.list_tasks) and GET /schedule/week
+(the cached dict of schedule entries). For each case it prints rows/sec and
+the peak Python memory while encoding one response (tracemalloc). The body
+must be the same on every path, and the script checks that it is.
+
+    python benchmarks/bench_json.py [--sizes 1000 100000] [--min-time 1]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+import api  # noqa: E402
+import responses  # noqa: E402
+
+
+def task_rows(count, today):
+    """Tuples shaped like store.list_tasks rows: (id, title, deadline, duration, status)."""
+    return [
+        (task_id, f"Task {task_id}", today + timedelta(days=task_id % 60), 15 + task_id % 8 * 15, "pending")
+        for task_id in range(1, count + 1)
+    ]
+
+
+def week_entries(count, monday):
+    """A store.week_schedule result with count entries spread over the week."""
+    week = {str(monday + timedelta(days=offset)): [] for offset in range(7)}
+    days = list(week)
+    for task_id in range(1, count + 1):
+        minute = task_id % 48 * 30
+        week[days[task_id % 7]].append({
+            "task_id": task_id,
+            "title": f"Task {task_id}",
+            "start_time": f"{minute // 60:02d}:{minute % 60:02d}",
+            "end_time": f"{(minute + 30) // 60:02d}:{(minute + 30) % 60:02d}",
+            "duration": 30,
+            "due_date": str(monday + timedelta(days=task_id % 30)),
+        })
+    return week
+
+
+def task_dicts(rows):
+    # The loop in api.get_tasks
+    return [
+        {"id": task[0], "title": task[1], "due_date": str(task[2]) if task[2] is not None else None,
+         "duration": task[3], "status": task[4]}
+        for task in rows
+    ]
+
+
+def with_stdlib(encode):
+    def run(content):
+        orjson, responses.orjson = responses.orjson, None
+        try:
+            return encode(content)
+        finally:
+            responses.orjson = orjson
+    return run
+
+
+def cases():
+    tasks = TypeAdapter(List[api.TaskSummary])
+    week = TypeAdapter(Dict[str, List[api.ScheduleEntry]])
+    render = JSONResponse(None).render
+    fast = responses.FastJSONResponse(None).render
+    return {
+        "GET /tasks": {
+            "untyped": lambda rows: render(jsonable_encoder(task_dicts(rows))),
+            "model": lambda rows: render(tasks.dump_python(tasks.validate_python(task_dicts(rows)), mode="json")),
+            "fast": lambda rows: fast(responses.task_rows(rows)),
+            "fast-stdlib": with_stdlib(lambda rows: fast(responses.task_rows(rows))),
+        },
+        "GET /schedule/week": {
+            "untyped": lambda entries: render(jsonable_encoder(entries)),
+            "model": lambda entries: render(week.dump_python(week.validate_python(entries), mode="json",
+                                                             exclude_unset=True)),
+            "fast": fast,
+            "fast-stdlib": with_stdlib(fast),
+        },
+    }
+
+
+def measure(encode, content, rows, min_time):
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        encode(content)
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+    tracemalloc.start()
+    encode(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"rows_per_sec": rows * calls / elapsed, "ms_per_response": elapsed / calls * 1000, "peak_mb": peak / 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds per case")
+    args = parser.parse_args()
+
+    today = date.today()
+    monday = today - timedelta(days=today.weekday())
+    print(f"orjson: {'installed' if responses.orjson is not None else 'not installed, fast = fast-stdlib'}")
+    print(f"{'endpoint':<18} {'rows':>7} {'path':<12} {'rows/sec':>11} {'ms/resp':>9} {'peak MB':>8}")
+    for size in args.sizes:
+        content = {"GET /tasks": task_rows(size, today), "GET /schedule/week": week_entries(size, monday)}
+        for endpoint, paths in cases().items():
+            bodies = {name: encode(content[endpoint]) for name, encode in paths.items()}
+            if len({json.dumps(json.loads(body)) for body in bodies.values()}) != 1:
+                sys.exit(f"{endpoint}: the paths disagree on the response body")
+            for name, encode in paths.items():
+                result = measure(encode, content[endpoint], size, args.min_time)
+                print(f"{endpoint:<18} {size:>7} {name:<12} {result['rows_per_sec']:>11,.0f} "
+                      f"{result['ms_per_response']:>9.2f} {result['peak_mb']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
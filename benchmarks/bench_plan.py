@@ -0,0 +1,84 @@
+"""
+Week planner benchmark: auto_schedule_task in a loop vs one plan_week pass.
+
+Seeds N pending tasks with deadlines spread over next week in the SQLite
+stand-in, then plans them both ways and prints queries, wall time, how
+many tasks got a slot and how many of those land on or before their
+deadline.
+
+    python benchmarks/bench_plan.py [sizes...]
+"""
+import os
+import random
+import sys
+import time as clock
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from db import SyncCursor, drive  # noqa: E402
+from scheduler import auto_schedule_task, plan_week  # noqa: E402
+import standin  # noqa: E402
+
+
+def seed_tasks(conn, count, monday):
+    rng = random.Random(count)
+    cur = conn.cursor()
+    for index in range(count):
+        cur.execute(
+            "INSERT INTO tasks (user_id, title, deadline, duration_minutes, priority, status, category) VALUES (1, ?, ?, ?, ?, 'pending', ?)",
+            (f"task {index}", monday + timedelta(days=rng.randint(0, 6)), rng.choice([15, 30, 45]),
+             rng.randint(1, 3), rng.choice(["Math", "English", "Science"])),
+        )
+    conn.commit()
+
+
+def on_time(conn):
+    rows = conn.execute("""
+        SELECT COUNT(*), SUM(CASE WHEN d.plan_date <= t.deadline THEN 1 ELSE 0 END)
+        FROM daily_plan d JOIN tasks t ON t.id = d.task_id
+    """).fetchone()
+    return rows[0], rows[1] or 0
+
+
+def run_loop(count, monday):
+    conn = standin.connect()
+    seed_tasks(conn, count, monday)
+    cur = standin.CountingCursor(conn)
+    tasks = conn.execute("SELECT id, deadline, duration_minutes FROM tasks").fetchall()
+
+    started = clock.perf_counter()
+    for task_id, deadline, duration in tasks:
+        drive(auto_schedule_task(SyncCursor(cur), task_id, 1, str(deadline), duration))
+        conn.commit()
+    elapsed = clock.perf_counter() - started
+    return cur.queries, elapsed, on_time(conn)
+
+
+def run_plan(count, monday):
+    conn = standin.connect()
+    seed_tasks(conn, count, monday)
+    cur = standin.CountingCursor(conn)
+
+    started = clock.perf_counter()
+    drive(plan_week(SyncCursor(cur), 1, monday, today=monday))
+    conn.commit()
+    elapsed = clock.perf_counter() - started
+    return cur.queries, elapsed, on_time(conn)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [50, 100, 200]
+    today = date.today()
+    monday = today + timedelta(days=7 - today.weekday())
+
+    print(f"Planning week of {monday}")
+    print(f"{'tasks':>6} {'mode':<20} {'queries':>8} {'ms':>10} {'placed':>7} {'on time':>8}")
+    for count in sizes:
+        for label, runner in (("auto_schedule loop", run_loop), ("plan_week", run_plan)):
+            queries, elapsed, (placed, in_time) = runner(count, monday)
+            print(f"{count:>6} {label:<20} {queries:>8} {elapsed * 1000:>10.1f} {placed:>7} {in_time:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Slot finder benchmark: per-candidate queries (old) vs one range query (new).
+
+Runs both implementations against the same dense week of user 1's in the
+SQLite stand-in and prints query count and latency per call. The new one
+runs for the user, as the app calls it, so it reads their availability and
+day_load.
+
+    python benchmarks/bench_slot_finder.py [repeats]
+"""
+import os
+import sys
+import time as clock
+from datetime import date, datetime, time, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from db import SyncCursor, drive  # noqa: E402
+from scheduler import find_available_slot  # noqa: E402
+import standin  # noqa: E402
+
+
+def is_school_hours(date_obj, time_obj):
+    # School is Monday-Friday, 8 AM - 4 PM
+    return date_obj.weekday() < 5 and 8 <= time_obj.hour < 16
+
+
+def legacy_find_available_slot(cur, date_obj, duration):
+    """find_available_slot as it was before the interval index: one query per candidate."""
+    available_hours = list(range(5, 8)) + list(range(16, 24))
+    for day_offset in range(8):
+        check_date = date_obj + timedelta(days=day_offset)
+        is_weekend = check_date.weekday() >= 5
+        hours_to_check = list(range(5, 24)) if is_weekend else available_hours
+        for hour in hours_to_check:
+            for minute in [0, 30]:
+                start_time = time(hour, minute)
+                start_datetime = datetime.combine(check_date, start_time)
+                end_datetime = start_datetime + timedelta(minutes=duration)
+                end_time = end_datetime.time()
+                if not is_weekend and is_school_hours(check_date, start_time):
+                    continue
+                if not is_weekend and is_school_hours(check_date, end_time):
+                    continue
+                cur.execute("""
+                    SELECT d.scheduled_time, t.duration_minutes
+                    FROM daily_plan d
+                    JOIN tasks t ON t.id = d.task_id
+                    WHERE d.plan_date = %s AND d.scheduled_time IS NOT NULL
+                """, (check_date,))
+                conflicts = False
+                for existing_start, existing_duration in cur.fetchall():
+                    existing_start_dt = datetime.combine(check_date, existing_start)
+                    existing_end_dt = existing_start_dt + timedelta(minutes=existing_duration)
+                    if start_datetime < existing_end_dt and end_datetime > existing_start_dt:
+                        conflicts = True
+                        break
+                if not conflicts:
+                    return check_date, start_time
+    return None, None
+
+
+def run(label, finder, conn, first_day, duration, repeats):
+    cur = standin.CountingCursor(conn)
+    # Fills the availability and recurrence caches, which the app keeps warm
+    finder(cur, first_day, duration)
+    cur.queries = 0
+    result = finder(cur, first_day, duration)
+    queries = cur.queries
+
+    started = clock.perf_counter()
+    for _ in range(repeats):
+        finder(cur, first_day, duration)
+    per_call_ms = (clock.perf_counter() - started) * 1000 / repeats
+
+    print(f"{label:<8} slot={result[0]} {result[1]}  queries/call={queries:<4} latency/call={per_call_ms:8.3f} ms")
+    return result
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    first_day = date.today()
+    conn = standin.connect()
+    standin.seed_dense_week(conn, first_day)
+
+    print(f"Dense week starting {first_day}, 30 minute task, {repeats} repeats")
+    before = run("before", legacy_find_available_slot, conn, first_day, 30, repeats)
+    after = run("after", lambda cur, day, duration: drive(find_available_slot(SyncCursor(cur), day, duration, user_id=1)),
+                conn, first_day, 30, repeats)
+    assert before == after, f"implementations disagree: {before} != {after}"
+
+
+if __name__ == "__main__":
+    main()
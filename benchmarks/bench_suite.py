@@ -0,0 +1,217 @@
+"""
+Scheduler benchmark suite: the hot read and scheduling paths at several data sizes.
+
+For each size it builds an in-memory database on the DB_DRIVER=sqlite backend
+with that many tasks for one user (deadlines spread around today, a busy
+calendar of up to 20 half-hour bookings a day) and runs, through
+db_sqlite.Database with the same instrumented connection db.run uses:
+
+- find_available_slot  for a 30 minute task from today
+- auto_schedule_task   for an unscheduled task, rolled back after each call
+- get_weekly_schedule  store.week_schedule for this week
+- get_tasks            store.list_tasks, first page of 100
+
+and prints ops/sec, mean latency, queries and rows per call and peak Python
+memory per call (tracemalloc; SQLite's own page cache is not counted).
+
+    python benchmarks/bench_suite.py [--sizes 10 1000 100000] [--min-time 1]
+    python benchmarks/bench_suite.py --json results.json
+    python benchmarks/bench_suite.py --baseline results.json [--tolerance 0.25]
+
+With --baseline it exits 1 if any case lost more than --tolerance of its
+ops/sec, runs more queries per call, or peaks more than --tolerance higher in
+memory than the saved run, so a regression fails the build before deploy.
+Compare runs from the same machine; ops/sec varies across hardware.
+"""
+import argparse
+import json
+import os
+import sys
+import time as clock
+import tracemalloc
+from datetime import date, datetime, time, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db_sqlite  # noqa: E402
+import metrics  # noqa: E402
+import store  # noqa: E402
+from availability import DEFAULT_TEMPLATE  # noqa: E402
+from scheduler import auto_schedule_task, find_available_slot  # noqa: E402
+
+BOOKINGS_PER_DAY = 20
+MEMORY_CALLS = 5
+
+
+def half_hours(day: date):
+    """Start times of the bookable half-hours on day under the default availability."""
+    starts = []
+    for start, end in DEFAULT_TEMPLATE[day.weekday()]:
+        starts.extend(range(start, end - 29, 30))
+    return [time(minute // 60, minute % 60) for minute in starts]
+
+
+def fill_day_load(raw):
+    """Rebuild day_load from the bookings, for data inserted straight into daily_plan."""
+    raw.execute("DELETE FROM day_load")
+    raw.execute(
+        "INSERT INTO day_load (user_id, plan_date, booked_minutes, bookings) "
+        "SELECT user_id, plan_date, SUM(CAST(ROUND((julianday(ends_at) - julianday(starts_at)) * 1440) AS INTEGER)), "
+        "COUNT(*) FROM daily_plan WHERE plan_date IS NOT NULL GROUP BY user_id, plan_date"
+    )
+
+
+def seed(database, count, today):
+    """count tasks for user 1 around today, with the first BOOKINGS_PER_DAY due each day booked the day before."""
+    span = max(14, count // 40)
+    first_day = today - timedelta(days=span // 2)
+    with database.checkout() as raw:
+        raw.executemany(
+            "INSERT INTO tasks (id, user_id, title, deadline, duration_minutes, priority, status, category) "
+            "VALUES (?, 1, ?, ?, 30, ?, 'pending', 'General')",
+            ((index + 1, f"task {index}", first_day + timedelta(days=index % span), index % 3 + 1) for index in range(count))
+        )
+        rows = []
+        booked = {}
+        for index in range(count):
+            day = first_day + timedelta(days=index % span - 1)
+            slots = half_hours(day)
+            slot = booked.get(day, 0)
+            if slot >= min(BOOKINGS_PER_DAY, len(slots)):
+                continue
+            booked[day] = slot + 1
+            starts_at = datetime.combine(day, slots[slot])
+            rows.append((index + 1, day, slots[slot], starts_at, starts_at + timedelta(minutes=30)))
+        raw.executemany(
+            "INSERT INTO daily_plan (user_id, task_id, plan_date, scheduled_time, task_order, starts_at, ends_at) "
+            "VALUES (1, ?, ?, ?, 1, ?, ?)",
+            rows
+        )
+        fill_day_load(raw)
+        # The task auto_schedule_task places on every call; it has no booking of its own
+        cur = raw.execute(
+            "INSERT INTO tasks (user_id, title, deadline, duration_minutes, priority, status) "
+            "VALUES (1, 'benchmark target', ?, 30, 1, 'pending')",
+            (today + timedelta(days=3),)
+        )
+        raw.commit()
+        return cur.lastrowid, len(rows)
+
+
+def cases(today, target_id):
+    monday = today - timedelta(days=today.weekday())
+    due = str(today + timedelta(days=3))
+
+    async def slot(conn):
+        return await find_available_slot(conn.cursor(), today, 30, user_id=1)
+
+    async def auto_schedule(conn):
+        result = await auto_schedule_task(conn.cursor(), target_id, 1, due, 30)
+        # Leave the database as it was so every call does the same work
+        await conn.rollback()
+        return result
+
+    async def weekly(conn):
+        return await store.week_schedule(conn, 1, monday)
+
+    async def tasks(conn):
+        return await store.list_tasks(conn, 1, limit=100)
+
+    return [
+        ("find_available_slot", slot),
+        ("auto_schedule_task", auto_schedule),
+        ("get_weekly_schedule", weekly),
+        ("get_tasks", tasks),
+    ]
+
+
+def measure(database, op, min_time):
+    run = database.run_blocking
+    op = metrics.instrumented(op)
+    run(op)  # warm up: availability cache, SQLite page cache
+
+    stats = metrics.RequestStats({})
+    token = metrics.current.set(stats)
+    try:
+        calls = 0
+        started = clock.perf_counter()
+        deadline = started + min_time
+        while calls < 3 or clock.perf_counter() < deadline:
+            run(op)
+            calls += 1
+        elapsed = clock.perf_counter() - started
+    finally:
+        metrics.current.reset(token)
+
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(MEMORY_CALLS):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            run(op)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ops_per_sec": calls / elapsed,
+        "mean_ms": elapsed / calls * 1000,
+        "queries": stats.queries / calls,
+        "rows": stats.rows / calls,
+        "peak_kib": peak / 1024,
+    }
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for key, before in sorted(baseline.items()):
+        after = results.get(key)
+        if after is None:
+            continue
+        if after["ops_per_sec"] < before["ops_per_sec"] * (1 - tolerance):
+            found.append(f"{key}: {before['ops_per_sec']:.0f} -> {after['ops_per_sec']:.0f} ops/sec")
+        if after["queries"] > before["queries"]:
+            found.append(f"{key}: {before['queries']:g} -> {after['queries']:g} queries per call")
+        # Small absolute slack so a few hundred bytes of noise on tiny cases don't fail the run
+        if after["peak_kib"] > before["peak_kib"] * (1 + tolerance) + 16:
+            found.append(f"{key}: {before['peak_kib']:.0f} -> {after['peak_kib']:.0f} KiB peak")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds to run each case")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed ops/sec and memory change")
+    args = parser.parse_args()
+
+    today = date.today()
+    results = {}
+    print(f"{'tasks':>7} {'case':<20} {'ops/sec':>10} {'mean ms':>9} {'queries':>8} {'rows':>7} {'peak KiB':>9}")
+    for count in args.sizes:
+        database = db_sqlite.Database(":memory:")
+        target_id, booked = seed(database, count, today)
+        for name, op in cases(today, target_id):
+            result = measure(database, op, args.min_time)
+            results[f"{name}@{count}"] = result
+            print(f"{count:>7} {name:<20} {result['ops_per_sec']:>10.1f} {result['mean_ms']:>9.3f} "
+                  f"{result['queries']:>8g} {result['rows']:>7g} {result['peak_kib']:>9.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print("REGRESSION", line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Load test: requests/sec and latency under concurrent clients.
+
+Drives a mix of GET /schedule/{today}, GET /tasks and POST /tasks from
+--clients keep-alive connections for --seconds and prints throughput and
+latency percentiles.
+
+Against a running server (start it with DB_DRIVER=sync or DB_DRIVER=async
+pointing at a local MySQL):
+
+    python benchmarks/load_test.py --url http://127.0.0.1:8000
+
+Without --url it starts the app in-process on the SQLite stand-in, with a
+fixed per-statement delay standing in for the MySQL round trip, once per
+driver model:
+
+    python benchmarks/load_test.py [--clients 64] [--latency-ms 5] [--pool-size 50]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time as clock
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("AUTO_MIGRATE", "0")
+
+import db  # noqa: E402
+import standin  # noqa: E402
+
+
+def request_mix(rng, today):
+    roll = rng.random()
+    if roll < 0.45:
+        return "GET", f"/schedule/{today}"
+    if roll < 0.9:
+        return "GET", "/tasks?limit=50"
+    due = today + timedelta(days=rng.randint(1, 6))
+    return "POST", f"/tasks?title=load&due_date={due}&duration={rng.choice([15, 30, 45])}"
+
+
+async def client(host, port, deadline, rng, latencies, errors, mix=request_mix):
+    reader, writer = await asyncio.open_connection(host, port)
+    today = date.today()
+    try:
+        while clock.perf_counter() < deadline:
+            method, path = mix(rng, today)
+            started = clock.perf_counter()
+            writer.write(
+                f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: 0\r\n\r\n".encode()
+            )
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(clock.perf_counter() - started)
+            if status >= 400:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def drive_load(host, port, clients, seconds, mix=request_mix):
+    latencies = []
+    errors = []
+    deadline = clock.perf_counter() + seconds
+    started = clock.perf_counter()
+    await asyncio.gather(*(
+        client(host, port, deadline, random.Random(index), latencies, errors, mix) for index in range(clients)
+    ))
+    return latencies, errors, clock.perf_counter() - started
+
+
+def report(label, latencies, errors, elapsed):
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    print(f"{label:<10} {len(latencies):>8} {len(latencies) / elapsed:>10.1f} "
+          f"{pct(0.5):>8.1f} {pct(0.95):>8.1f} {pct(0.99):>8.1f} {len(errors):>7}")
+
+
+def start_in_process(driver, latency, pool_size):
+    """Serve api.app on a free port from a background thread, backed by the stand-in."""
+    import uvicorn
+    import api
+
+    fake = standin.LatencyStandin(latency, pool_size)
+    # Give the day some existing blocks so the slot finder has work to do
+    for index in range(20):
+        asyncio.run(fake.runner("async")(
+            api.store.add_task, 1, f"seed {index}", str(date.today() + timedelta(days=index % 7)), 30
+        ))
+    db.run = fake.runner(driver)
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=0, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        clock.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, thread, port
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="base URL of a running server (default: in-process stand-in)")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--latency-ms", type=float, default=5, help="stand-in round trip per statement")
+    parser.add_argument("--pool-size", type=int, default=50, help="stand-in connection pool size")
+    args = parser.parse_args()
+
+    print(f"{'driver':<10} {'requests':>8} {'req/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    if args.url:
+        target = urlsplit(args.url)
+        report("server", *asyncio.run(drive_load(target.hostname, target.port or 80, args.clients, args.seconds)))
+        return
+
+    for driver in ("sync", "async"):
+        server, thread, port = start_in_process(driver, args.latency_ms / 1000, args.pool_size)
+        report(driver, *asyncio.run(drive_load("127.0.0.1", port, args.clients, args.seconds)))
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Read/write splitting check: routing, read-your-writes and failover through the API.
+
+By default it runs on DB_DRIVER=sqlite with a primary file and a replica
+file that a background thread refreshes from it every --lag-ms, standing in
+for asynchronous replication. It then checks, through the API, that:
+
+- a user who just wrote reads from the primary and sees the write at once
+- another user's reads go to the replica
+- once the pin expires and the replica has caught up, the writer reads from it too
+- a replica that disappears is taken out of rotation, reads fail over to the
+  primary without errors, and the health check brings it back
+
+    python benchmarks/replica_check.py [--lag-ms 300] [--pin-seconds 1]
+    DB_REPLICAS=127.0.0.1:3307 python benchmarks/replica_check.py --mysql
+
+With --mysql it uses the servers from DB_* and DB_REPLICAS, for example two
+local MySQL instances with or without replication between them, and skips
+the failover step (it can't stop a server).
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def copy_database(source: str, target: str):
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+class Replicator(threading.Thread):
+    """Copies the primary over the replica every lag seconds, like a replica that far behind."""
+
+    def __init__(self, primary: str, replica: str, lag: float):
+        super().__init__(daemon=True)
+        self.primary = primary
+        self.replica = replica
+        self.lag = lag
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.lag):
+            copy_database(self.primary, self.replica)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lag-ms", type=float, default=300, help="stand-in replication delay")
+    parser.add_argument("--pin-seconds", type=float, default=1.0, help="DB_READ_PIN_SECONDS")
+    parser.add_argument("--mysql", action="store_true", help="use DB_* and DB_REPLICAS instead of the stand-in")
+    args = parser.parse_args()
+
+    replicator = None
+    os.environ["DB_READ_PIN_SECONDS"] = str(args.pin_seconds)
+    os.environ["DB_REPLICA_CHECK_INTERVAL"] = "0.2"
+    if args.mysql:
+        if not os.getenv("DB_REPLICAS"):
+            parser.error("--mysql needs DB_REPLICAS")
+    else:
+        directory = tempfile.mkdtemp()
+        primary = os.path.join(directory, "primary.sqlite3")
+        replica = os.path.join(directory, "replica.sqlite3")
+        os.environ.update(DB_DRIVER="sqlite", SQLITE_PATH=primary, DB_REPLICAS=replica)
+
+    # Read the environment above at import
+    from fastapi.testclient import TestClient
+    import api
+    import db
+
+    failures = []
+
+    def check(name, ok, detail=""):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}{f' ({detail})' if detail else ''}")
+        if not ok:
+            failures.append(name)
+
+    def reads():
+        return {key: value for key, value in db.router.stats().items() if key != "replicas"}
+
+    due = str(date.today() + timedelta(days=3))
+    with TestClient(api.app) as client:
+        if not args.mysql:
+            copy_database(primary, replica)
+            replicator = Replicator(primary, replica, args.lag_ms / 1000)
+            replicator.start()
+
+        writer = client.post("/users", params={"username": f"writer-{time.time_ns()}"}).json()
+        reader = client.post("/users", params={"username": f"reader-{time.time_ns()}"}).json()
+        as_writer = {"Authorization": f"Bearer {writer['token']}"}
+        as_reader = {"Authorization": f"Bearer {reader['token']}"}
+        # Let the replica learn about both users before anyone reads
+        time.sleep(max(args.pin_seconds, 2 * args.lag_ms / 1000))
+
+        before = reads()
+        task = client.post("/tasks", params={"title": "read your writes", "due_date": due, "duration": 30},
+                           headers=as_writer).json()
+        listed = [row["id"] for row in client.get("/tasks", headers=as_writer).json()]
+        after = reads()
+        check("writer sees the new task immediately", task["task_id"] in listed)
+        check("writer's read was pinned to the primary", after["pinned_reads"] == before["pinned_reads"] + 1)
+
+        before = reads()
+        client.get("/tasks", headers=as_reader)
+        check("another user's read went to a replica", reads()["replica_reads"] == before["replica_reads"] + 1)
+
+        time.sleep(args.pin_seconds + 2 * args.lag_ms / 1000)
+        before = reads()
+        listed = [row["id"] for row in client.get("/tasks", headers=as_writer).json()]
+        after = reads()
+        check("after the pin, the writer reads from the replica", after["replica_reads"] == before["replica_reads"] + 1)
+        if args.mysql:
+            print(f"     task visible on the replica: {task['task_id'] in listed} (needs replication between the servers)")
+        else:
+            check("the replica caught up with the write", task["task_id"] in listed)
+
+        if not args.mysql:
+            replicator.stopped.set()
+            replicator.join()
+            # A directory where the file was: SQLite can't open it, like a server that went away
+            os.remove(replica)
+            os.mkdir(replica)
+            before = reads()
+            response = client.get("/tasks", headers=as_reader)
+            after = reads()
+            check("reads keep working with the replica gone", response.status_code == 200, response.status_code)
+            check("the failed read failed over to the primary", after["failovers"] == before["failovers"] + 1)
+            check("the replica left the rotation", not db.router.replicas[0].healthy)
+
+            os.rmdir(replica)
+            copy_database(primary, replica)
+            deadline = time.monotonic() + 5
+            while not db.router.replicas[0].healthy and time.monotonic() < deadline:
+                time.sleep(0.1)
+            check("the health check put it back", db.router.replicas[0].healthy)
+
+        print("router:", reads())
+
+    if not args.mysql:
+        shutil.rmtree(directory, ignore_errors=True)
+    if failures:
+        print(f"FAILED: {len(failures)} check(s)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+In-memory SQLite stand-in for the MySQL tables, used by the benchmarks.
+
+The schema and statement translation come from db_sqlite (the DB_DRIVER=sqlite
+backend). On top of it: a per-cursor query counter so a benchmark can report
+round trips, a dense-week seed, and LatencyStandin and LockingStandin, which
+replace db.run for load and concurrency tests with a simulated round trip
+before every statement.
+"""
+import asyncio
+import threading
+import time as time_module
+from datetime import date, time, timedelta
+from functools import partial
+
+import anyio
+
+import db_sqlite
+from db import SyncCursor, drive
+from db_sqlite import connect, to_sqlite  # noqa: F401 (benchmarks open databases with standin.connect)
+from scheduler import book
+
+
+class CountingCursor:
+    def __init__(self, conn):
+        self._cur = conn.cursor()
+        self.queries = 0
+
+    def execute(self, sql, params=()):
+        self.queries += 1
+        self._cur.execute(to_sqlite(sql), params)
+
+    def executemany(self, sql, seq):
+        self.queries += 1
+        self._cur.executemany(to_sqlite(sql), seq)
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    def close(self):
+        self._cur.close()
+
+
+def seed_dense_week(conn, first_day: date, days: int = 7, gap_every: int = 5):
+    """
+    Fill every bookable half-hour of each of user 1's days with a 30 minute
+    task, leaving one free slot every `gap_every` hours. Bookings go through
+    scheduler.book, like the app's, so day_load matches them.
+    """
+    raw = CountingCursor(conn)
+    cur = SyncCursor(raw)
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        for hour in range(5, 24):
+            for minute in (0, 30):
+                if minute == 30 and hour % gap_every == 0 and offset == days - 1:
+                    continue
+                raw.execute(
+                    "INSERT INTO tasks (user_id, title, deadline, duration_minutes, priority, status) VALUES (1, %s, %s, 30, 1, 'pending')",
+                    (f"busy {day} {hour}:{minute:02d}", day + timedelta(days=7)),
+                )
+                drive(book(cur, 1, raw.lastrowid, day, time(hour, minute), 30))
+    conn.commit()
+
+
+class LatencyStandin:
+    """
+    Stand-in for the MySQL server behind db.run, for load tests without MySQL.
+
+    Statements run against one shared in-memory SQLite database, each preceded
+    by a fixed round-trip delay. With blocking=True the delay is time.sleep
+    (what mysql.connector does to a worker thread); otherwise it is
+    asyncio.sleep (what aiomysql does). A semaphore models the pool size.
+    Operations share one SQLite connection, so transactions are not isolated;
+    use LockingStandin where that matters.
+    """
+
+    def __init__(self, latency: float, pool_size: int):
+        self.latency = latency
+        self.pool_size = pool_size
+        self.conn = connect(check_same_thread=False)
+        self.lock = threading.Lock()
+        self.queries = 0
+
+    def runner(self, driver: str):
+        """A drop-in replacement for db.run using the given driver model."""
+        if driver == "async":
+            slots = asyncio.Semaphore(self.pool_size)
+
+            async def run(op, *args, **kwargs):
+                async with slots:
+                    return await op(_StandinConnection(self, self.conn, self.lock, blocking=False), *args, **kwargs)
+        else:
+            slots = threading.BoundedSemaphore(self.pool_size)
+
+            def run_blocking(op, *args, **kwargs):
+                with slots:
+                    return drive(op(_StandinConnection(self, self.conn, self.lock, blocking=True), *args, **kwargs))
+
+            async def run(op, *args, **kwargs):
+                return await anyio.to_thread.run_sync(partial(run_blocking, op, *args, **kwargs))
+        return run
+
+
+class LockingStandin(db_sqlite.Database):
+    """
+    The file-backed db_sqlite.Database, with `latency` seconds of sleep before
+    every statement to widen race windows in concurrency tests.
+    """
+
+    def __init__(self, path: str, latency: float = 0.0):
+        super().__init__(path, timeout=60)
+        self.latency = latency
+
+    def wrap(self, raw):
+        return _DelayedConnection(raw, self.latency)
+
+
+class _DelayedConnection(db_sqlite.SQLiteConnection):
+    def __init__(self, raw, latency):
+        super().__init__(raw)
+        self.latency = latency
+
+    def cursor(self, **kwargs):
+        return _DelayedCursor(self._raw, self.latency)
+
+
+class _DelayedCursor(db_sqlite.SQLiteCursor):
+    def __init__(self, raw_conn, latency):
+        super().__init__(raw_conn)
+        self.latency = latency
+
+    async def execute(self, sql, params=None):
+        time_module.sleep(self.latency)
+        await super().execute(sql, params)
+
+    async def executemany(self, sql, seq):
+        time_module.sleep(self.latency)
+        await super().executemany(sql, seq)
+
+
+class _StandinConnection:
+    def __init__(self, standin, raw, lock, blocking):
+        self.standin = standin
+        self.raw = raw
+        self.lock = lock
+        self.blocking = blocking
+
+    async def round_trip(self):
+        if not self.standin.latency:
+            return
+        if self.blocking:
+            time_module.sleep(self.standin.latency)
+        else:
+            await asyncio.sleep(self.standin.latency)
+
+    def cursor(self, **kwargs):
+        return _StandinCursor(self)
+
+    async def commit(self):
+        await self.round_trip()
+        with self.lock:
+            self.raw.commit()
+
+    async def rollback(self):
+        await self.round_trip()
+        with self.lock:
+            self.raw.rollback()
+
+
+class _StandinCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+        self.lastrowid = None
+        self.rowcount = -1
+
+    async def execute(self, sql, params=()):
+        await self.conn.round_trip()
+        with self.conn.lock:
+            self.conn.standin.queries += 1
+            if " FOR UPDATE" in sql and not self.conn.raw.in_transaction:
+                self.conn.raw.execute("BEGIN IMMEDIATE")
+            cur = self.conn.raw.execute(to_sqlite(sql), params or ())
+            self.rows = cur.fetchall()
+            self.lastrowid = cur.lastrowid
+            self.rowcount = cur.rowcount
+
+    async def executemany(self, sql, seq):
+        await self.conn.round_trip()
+        with self.conn.lock:
+            self.conn.standin.queries += 1
+            cur = self.conn.raw.executemany(to_sqlite(sql), seq)
+            self.rowcount = cur.rowcount
+
+    async def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    async def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    async def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
@@ -0,0 +1,148 @@
+"""
+Concurrency stress test: many parallel bookings against the same day.
+
+Creates --tasks unscheduled 30 minute tasks, then books them from --workers
+threads at once, half with POST /schedule's fixed-slot path (random start
+times, so most collide) and half with POST /tasks' auto-scheduler aimed at
+the same day. Afterwards it checks that no two bookings on the day overlap
+and no task holds more than one slot, and prints bookings/sec.
+
+    python benchmarks/stress_booking.py [--workers 32] [--tasks 400] [--latency-ms 2]
+    python benchmarks/stress_booking.py --mysql   # against DB_* (books a day in 2099, then cleans up)
+
+Only --mysql checks the locking: store.lock_user's SELECT ... FOR UPDATE
+on the user's row and db.run's deadlock retry, against a real server.
+Without it the script runs on the file-backed SQLite stand-in, where each
+operation has its own connection, FOR UPDATE is dropped and SQLite's
+database-wide write lock serializes every write. That only exercises the
+booking and conflict logic under parallel callers; it says nothing about
+the row lock or the retry.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time as clock
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db  # noqa: E402
+import standin  # noqa: E402
+import store  # noqa: E402
+from availability import to_minutes  # noqa: E402
+
+STRESS_TITLE = "stress booking"
+
+
+async def create_tasks(conn, count, deadline):
+    cur = conn.cursor()
+    await cur.executemany(
+        "INSERT INTO tasks (user_id, title, deadline, duration_minutes, priority, status) VALUES (%s,%s,%s,%s,%s,%s)",
+        [(1, STRESS_TITLE, deadline, 30, 1, 'pending')] * count
+    )
+    await conn.commit()
+    await cur.execute("SELECT id FROM tasks WHERE title = %s ORDER BY id", (STRESS_TITLE,))
+    return [row[0] for row in await cur.fetchall()]
+
+
+async def bookings(conn, day):
+    cur = conn.cursor()
+    await cur.execute("""
+        SELECT d.task_id, d.scheduled_time, t.duration_minutes
+        FROM daily_plan d JOIN tasks t ON t.id = d.task_id
+        WHERE d.user_id = 1 AND d.plan_date = %s
+        ORDER BY d.scheduled_time
+    """, (day,))
+    day_rows = await cur.fetchall()
+    await cur.execute("""
+        SELECT COUNT(*) FROM (
+            SELECT task_id FROM daily_plan GROUP BY task_id HAVING COUNT(*) > 1
+        ) doubled
+    """)
+    doubled = (await cur.fetchone())[0]
+    return day_rows, doubled
+
+
+async def cleanup(conn):
+    cur = conn.cursor()
+    await cur.execute("DELETE FROM daily_plan WHERE task_id IN (SELECT id FROM tasks WHERE title = %s)", (STRESS_TITLE,))
+    await cur.execute("DELETE FROM tasks WHERE title = %s", (STRESS_TITLE,))
+    await conn.commit()
+
+
+def book(run, task_id, day, rng):
+    if rng.random() < 0.5:
+        start = time(rng.randint(5, 22), rng.choice([0, 15, 30, 45]))
+        try:
+            run(store.schedule_task, task_id, day, start)
+            return "booked"
+        except store.StoreError as e:
+            return "conflict" if e.status_code == 400 else "error"
+    _, result = run(store.add_task, 1, STRESS_TITLE, str(day), 30, str(day))
+    if not result["scheduled"]:
+        return "no slot"
+    return "booked" if result["schedule_date"] == str(day) else "other day"
+
+
+def overlaps(day_rows, day):
+    found = 0
+    busy_until = None
+    for _, start_time, duration in day_rows:
+        start = datetime.combine(day, time()) + timedelta(minutes=to_minutes(start_time))
+        if busy_until is not None and start < busy_until:
+            found += 1
+        end = start + timedelta(minutes=duration)
+        busy_until = end if busy_until is None else max(busy_until, end)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--tasks", type=int, default=400)
+    parser.add_argument("--latency-ms", type=float, default=2, help="stand-in delay per statement")
+    parser.add_argument("--mysql", action="store_true", help="use the MySQL database from DB_* instead of the stand-in")
+    args = parser.parse_args()
+
+    if args.mysql:
+        run = db.run_blocking
+        # A Sunday far away: the whole day is bookable and nobody else uses it
+        day = date(2099, 1, 4)
+        run(cleanup)
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "stress.sqlite3")
+        run = standin.LockingStandin(path, args.latency_ms / 1000).run_blocking
+        day = date.today() + timedelta(days=(6 - date.today().weekday()) or 7)
+
+    task_ids = run(create_tasks, args.tasks, day + timedelta(days=7))
+    rngs = [random.Random(task_id) for task_id in task_ids]
+
+    started = clock.perf_counter()
+    with ThreadPoolExecutor(args.workers) as pool:
+        outcomes = list(pool.map(lambda pair: book(run, pair[0], day, pair[1]), zip(task_ids, rngs)))
+    elapsed = clock.perf_counter() - started
+
+    day_rows, doubled = run(bookings, day)
+    found = overlaps(day_rows, day)
+    if args.mysql:
+        run(cleanup)
+
+    counts = {outcome: outcomes.count(outcome) for outcome in sorted(set(outcomes))}
+    print(f"{len(outcomes)} booking attempts from {args.workers} workers in {elapsed:.2f}s "
+          f"({len(outcomes) / elapsed:.1f}/s)")
+    print("outcomes:", ", ".join(f"{name} {count}" for name, count in counts.items()))
+    print(f"rows on {day}: {len(day_rows)}, overlapping: {found}, tasks with more than one slot: {doubled}")
+    if args.mysql:
+        print(f"deadlock retries: {db.retry_stats['deadlock_retries']}")
+    else:
+        print("stand-in: SQLite serialized the writes; run with --mysql to check store.lock_user and the deadlock retry")
+    if found or doubled or counts.get("booked", 0) != len(day_rows):
+        print("FAILED: the schedule was double-booked")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
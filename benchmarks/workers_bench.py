@@ -0,0 +1,276 @@
+"""
+Workers benchmark: throughput at 1, 2 and 4 worker processes, and whether they stay coherent.
+
+For each --workers count it starts `python serve.py` with WEB_CONCURRENCY
+set to it. The server runs on one SQLite database file (DB_DRIVER=sqlite),
+seeded with the bench_suite data, and the workers share state through
+shared.py. The script then:
+
+- drives a CPU-bound mix of GET /tasks?limit=500, GET /schedule/week and
+  POST /tasks from --clients keep-alive connections for --seconds, and
+  prints the throughput and latency percentiles as load_test.py does;
+- with more than one worker, checks coherence. Each request goes on a new
+  connection, so it may land on any worker. The check books tasks so
+  every worker caches a new user's availability, changes that user's
+  availability, and requires every booking after that to follow the
+  change. Every one of those bookings must also arrive as an event on one
+  open GET /events stream, whichever worker made it;
+- with more than one worker, sends SIGHUP while clients keep sending
+  requests, so every worker is restarted in turn, and counts the requests
+  that failed (there should be none).
+
+The script exits 1 if a coherence or restart check fails. Throughput can
+only grow with workers up to the number of CPU cores; on one core the
+extra workers just take turns.
+
+    python benchmarks/workers_bench.py [--workers 1 2 4] [--clients 32] [--seconds 10] [--tasks 1000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time as clock
+from datetime import date, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import db_sqlite  # noqa: E402
+from bench_suite import seed  # noqa: E402
+from load_test import drive_load, report  # noqa: E402
+
+HOST = "127.0.0.1"
+
+
+def cpu_mix(rng, today):
+    roll = rng.random()
+    if roll < 0.45:
+        return "GET", "/tasks?limit=500"
+    if roll < 0.9:
+        return "GET", f"/schedule/week/{today - timedelta(days=rng.randint(0, 13))}"
+    due = today + timedelta(days=rng.randint(1, 6))
+    return "POST", f"/tasks?title=load&due_date={due}&duration={rng.choice([15, 30, 45])}"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+async def call(port, method, path, headers=None, body=None):
+    """One request on its own connection. Returns (status, parsed JSON body)."""
+    reader, writer = await asyncio.open_connection(HOST, port)
+    try:
+        data = json.dumps(body).encode() if body is not None else b""
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {HOST}", "Connection: close", f"Content-Length: {len(data)}"]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + data)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    return status, json.loads(content) if content else None
+
+
+def start_server(workers, port, directory, log):
+    env = dict(
+        os.environ,
+        DB_DRIVER="sqlite",
+        SQLITE_PATH=os.path.join(directory, "planner.sqlite3"),
+        STATE_PATH=os.path.join(directory, f"state-{port}.sqlite3"),
+        SCHEDULE_CACHE_PATH=os.path.join(directory, f"cache-{port}.sqlite3"),
+        WEB_CONCURRENCY=str(workers),
+        HOST=HOST,
+        PORT=str(port),
+        ARCHIVE_ENABLED="0",
+        REFLOW_ENABLED="0",
+    )
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "serve.py")], cwd=ROOT, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_for_workers(port, workers, timeout=60):
+    """Wait until `workers` different workers have answered. Returns how many did."""
+    seen = set()
+    deadline = clock.monotonic() + timeout
+    while clock.monotonic() < deadline and len(seen) < workers:
+        try:
+            status, stats = await call(port, "GET", "/cache/stats")
+            if status == 200:
+                seen.add(stats["state"]["worker"])
+        except (OSError, IndexError):
+            pass
+        await asyncio.sleep(0.05)
+    return len(seen)
+
+
+async def read_events(reader, created):
+    """Collect the task ids of the task.created events on a stream."""
+    kind = None
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        if line.startswith(b"event: "):
+            kind = line[7:].strip()
+        elif line.startswith(b"data: ") and kind == b"task.created":
+            created.add(json.loads(line[6:])["task_id"])
+
+
+async def check_coherence(port, workers):
+    """Availability changes and events made through one worker reach all of them. Returns the failures."""
+    failures = []
+    requests = 4 * workers
+    status, created = await call(port, "POST", f"/users?username=coherence{port}")
+    headers = {"X-User-Id": created["id"]}
+    due = date.today() + timedelta(days=28)
+
+    # Every worker this reaches caches the user's default availability
+    for index in range(requests):
+        await call(port, "POST", f"/tasks?title=warm{index}&duration=15&due_date={due}", headers)
+
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(f"GET /events HTTP/1.1\r\nHost: {HOST}\r\nX-User-Id: {created['id']}\r\n\r\n".encode())
+    await writer.drain()
+    created_ids = set()
+    listener = asyncio.create_task(read_events(reader, created_ids))
+
+    window = [{"weekday": weekday, "start_time": "03:00", "end_time": "04:00"} for weekday in range(7)]
+    await call(port, "PUT", "/availability/template", headers, window)
+    # Polling picks the change up within STATE_POLL_MS
+    await asyncio.sleep(0.2)
+
+    stale = 0
+    task_ids = set()
+    for index in range(requests):
+        status, added = await call(port, "POST", f"/tasks?title=after{index}&duration=15&due_date={due}", headers)
+        if status != 200 or not added["scheduled"] or not "03:00" <= added["schedule_time"] < "04:00":
+            stale += 1
+        if status == 200:
+            task_ids.add(added["task_id"])
+    if stale:
+        failures.append(f"{stale}/{requests} bookings ignored the new availability")
+
+    deadline = clock.monotonic() + 5
+    while clock.monotonic() < deadline and not task_ids <= created_ids:
+        await asyncio.sleep(0.05)
+    received = len(task_ids & created_ids)
+    if received != requests:
+        failures.append(f"the event stream got {received} of {requests} task.created events")
+    listener.cancel()
+    writer.close()
+    print(f"{'coherence':<10} {requests} bookings after the change, {stale} stale; "
+          f"{received}/{requests} events on one stream")
+    return failures
+
+
+async def restart_under_load(port, process, workers, clients, seconds):
+    """
+    Send SIGHUP while clients keep sending requests. Returns (requests,
+    retries, failures, workers back). A worker that is stopping closes
+    connections it accepted but has not read a request from yet; like a
+    browser with a GET, the client sends such a request again, once.
+    """
+    done = retries = 0
+    failures = []
+    deadline = clock.monotonic() + seconds
+
+    async def client():
+        nonlocal done, retries
+        while clock.monotonic() < deadline:
+            for attempt in range(2):
+                try:
+                    status, _ = await call(port, "GET", "/tasks?limit=50")
+                    if status >= 500:
+                        failures.append(status)
+                    break
+                except (IndexError, ConnectionResetError):
+                    # Closed without a response
+                    if attempt:
+                        failures.append("closed")
+                    else:
+                        retries += 1
+                except OSError as e:
+                    failures.append(type(e).__name__)
+                    break
+            done += 1
+
+    async def restart():
+        await asyncio.sleep(1)
+        process.send_signal(signal.SIGHUP)
+
+    await asyncio.gather(restart(), *(client() for _ in range(clients)))
+    return done, retries, failures, await wait_for_workers(port, workers, timeout=30)
+
+
+async def run(workers, args, directory, log):
+    port = free_port()
+    process = start_server(workers, port, directory, log)
+    failures = []
+    try:
+        started = await wait_for_workers(port, workers)
+        if started < workers:
+            return [f"only {started} of {workers} workers answered"]
+        # Warm up each worker's caches and the pools before measuring
+        await drive_load(HOST, port, args.clients, 1, cpu_mix)
+        latencies, errors, elapsed = await drive_load(HOST, port, args.clients, args.seconds, cpu_mix)
+        report(f"{workers} worker{'s' if workers > 1 else ''}", latencies, errors, elapsed)
+        if errors:
+            failures.append(f"{len(errors)} requests failed under load")
+        if workers > 1:
+            failures += await check_coherence(port, workers)
+            done, retries, failed, back = await restart_under_load(port, process, workers, min(args.clients, 8), 6)
+            print(f"{'restart':<10} {done} requests during SIGHUP, {retries} retried, {len(failed)} failed; "
+                  f"{back}/{workers} workers back")
+            if failed or back < workers:
+                failures.append(f"requests failed during the restart ({', '.join(map(str, failed))}), "
+                                f"{back}/{workers} workers back")
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--tasks", type=int, default=1000, help="tasks seeded for user 1")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs")
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        seed(db_sqlite.Database(os.path.join(directory, "planner.sqlite3")), args.tasks, date.today())
+        log_path = os.path.join(directory, "server.log")
+        with open(log_path, "w") as log:
+            print(f"{'workers':<10} {'requests':>8} {'req/sec':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+            for workers in args.workers:
+                failures += asyncio.run(run(workers, args, directory, log))
+        if failures:
+            with open(log_path) as log:
+                sys.stderr.write(log.read()[-4000:])
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
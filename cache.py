@@ -0,0 +1,272 @@
+"""
+Read cache for the schedule endpoints.
+
+Entries are keyed by (user_id, kind, day), where kind is "day" for
+GET /schedule/{date} and "week" / "plan" for the week views keyed by their
+Monday. Writes call invalidate_days with the dates they touched, which drops
+those days and the weeks containing them.
+
+A change that can move any of a user's days (a recurring task) calls
+invalidate_user, which drops all of that user's entries.
+
+Every invalidation also bumps the user's generation, and every write
+invalidates (with no days if it changed no schedule), so the generation is
+the user's data version. A reader takes the generation before going to the
+database and set() ignores the value if it changed meanwhile, so a read that
+raced a write can't put stale data back. The API also builds ETags from it
+with version(). ALL_USERS has a generation bumped by every write, for reads
+that span users.
+
+SCHEDULE_CACHE picks the backend:
+- memory (default): per-process LRU, fastest, but each uvicorn worker has its own
+- shared: a SQLite file on local disk that all workers on the host read and invalidate
+- off: no caching
+"""
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+ALL_USERS = 0
+
+
+def _week_of(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def _affected_keys(user_id, days):
+    keys = set()
+    for day in days:
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        monday = _week_of(day)
+        keys.update({(user_id, "day", day), (user_id, "week", monday), (user_id, "plan", monday)})
+    return keys
+
+
+class ScheduleCache:
+    """In-process LRU with a TTL, bounded to max_entries."""
+
+    def __init__(self, max_entries=1024, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, expires_at), most recently used on the right
+        self._generations = {}
+        # Counters restart with the process, so ETags from an earlier run must not match
+        self._epoch = secrets.token_hex(4)
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0, "stale_sets": 0}
+
+    def generation(self, user_id):
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def version(self, user_id):
+        return f"{self._epoch}.{self.generation(user_id)}"
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key, value, generation):
+        with self._lock:
+            if self._generations.get(key[0], 0) != generation:
+                self._stats["stale_sets"] += 1
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate_days(self, user_id, days):
+        keys = _affected_keys(user_id, days)
+        with self._lock:
+            for owner in {user_id, ALL_USERS}:
+                self._generations[owner] = self._generations.get(owner, 0) + 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self._stats["invalidations"] += 1
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for owner in {user_id, ALL_USERS}:
+                self._generations[owner] = self._generations.get(owner, 0) + 1
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats.update({"backend": "memory", "max_entries": self.max_entries, "ttl": self.ttl})
+        return stats
+
+
+class SharedScheduleCache:
+    """
+    The same cache in a SQLite file, so every worker on the host sees one set of
+    entries and one generation per user. Values are stored as JSON, which the
+    schedule responses already are. Hit/miss counters are per process.
+    """
+
+    def __init__(self, path, max_entries=1024, ttl=60.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, expires_at REAL, used_at REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_used ON entries (used_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS generations (user_id INTEGER PRIMARY KEY, generation INTEGER)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('epoch', ?)", (secrets.token_hex(4),))
+        self._epoch = self._conn.execute("SELECT value FROM meta WHERE name = 'epoch'").fetchone()[0]
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0, "stale_sets": 0}
+
+    @staticmethod
+    def _key(key):
+        user_id, kind, day = key
+        return f"{user_id}:{kind}:{day}"
+
+    def _generation(self, user_id):
+        row = self._conn.execute("SELECT generation FROM generations WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def generation(self, user_id):
+        with self._lock:
+            return self._generation(user_id)
+
+    def version(self, user_id):
+        return f"{self._epoch}.{self.generation(user_id)}"
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM entries WHERE key = ?", (self._key(key),)).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (self._key(key),))
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._conn.execute("UPDATE entries SET used_at = ? WHERE key = ?", (now, self._key(key)))
+            self._stats["hits"] += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, generation):
+        now = time.time()
+        encoded = json.dumps(value)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._generation(key[0]) != generation:
+                    self._stats["stale_sets"] += 1
+                    return
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                    (self._key(key), encoded, now + self.ttl, now)
+                )
+                evicted = self._conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                ).rowcount
+                self._stats["evictions"] += max(evicted, 0)
+            finally:
+                self._conn.execute("COMMIT")
+
+    def invalidate_days(self, user_id, days):
+        keys = [self._key(key) for key in _affected_keys(user_id, days)]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO generations (user_id, generation) VALUES (?, 1) "
+                    "ON CONFLICT(user_id) DO UPDATE SET generation = generation + 1",
+                    [(owner,) for owner in {user_id, ALL_USERS}]
+                )
+                removed = self._conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys]).rowcount
+                self._stats["invalidations"] += max(removed, 0)
+            finally:
+                self._conn.execute("COMMIT")
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO generations (user_id, generation) VALUES (?, 1) "
+                    "ON CONFLICT(user_id) DO UPDATE SET generation = generation + 1",
+                    [(owner,) for owner in {user_id, ALL_USERS}]
+                )
+                removed = self._conn.execute("DELETE FROM entries WHERE key LIKE ?", (f"{user_id}:%",)).rowcount
+                self._stats["invalidations"] += max(removed, 0)
+            finally:
+                self._conn.execute("COMMIT")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        stats.update({"backend": "shared", "path": self.path, "max_entries": self.max_entries, "ttl": self.ttl})
+        return stats
+
+
+class NoCache(ScheduleCache):
+    """Stores nothing, but still keeps the per-user generations for ETags."""
+
+    def __init__(self):
+        super().__init__(max_entries=0, ttl=0)
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, generation):
+        pass
+
+    def stats(self):
+        return {"backend": "off"}
+
+
+def create_cache():
+    backend = os.getenv("SCHEDULE_CACHE", "memory")
+    max_entries = int(os.getenv("SCHEDULE_CACHE_SIZE", "1024"))
+    ttl = float(os.getenv("SCHEDULE_CACHE_TTL", "60"))
+    if backend == "off":
+        return NoCache()
+    if backend == "shared":
+        path = os.getenv("SCHEDULE_CACHE_PATH", "/tmp/smartplanner-schedule-cache.sqlite3")
+        return SharedScheduleCache(path, max_entries, ttl)
+    return ScheduleCache(max_entries, ttl)
+
+
+schedule_cache = create_cache()
@@ -0,0 +1,84 @@
+"""
+Booked time per user per day, kept in the day_load table.
+
+A row holds the minutes booked on one user's day and how many bookings
+make them up. Every write to daily_plan goes through remove() and adjust()
+in the same transaction, under the user's lock (store.lock_user), so the
+rows always add up to the user's bookings. Archived bookings stay counted,
+because archiving moves a booking rather than cancelling it. Deleting a
+task takes its archived bookings off too.
+
+A range of days is one primary key read, however many bookings they hold:
+- GET /plan/load returns it per day, for dashboards.
+- The slot finder (scheduler.find_available_slot) uses it to try days with
+  room for the task first. It loads bookings only for days that have any.
+  With SCHEDULE_PLACEMENT=lightest it prefers the least booked days before
+  the deadline.
+"""
+from collections import defaultdict
+
+
+def minutes(starts_at, ends_at) -> int:
+    """A booking's length, as counted in booked_minutes."""
+    if starts_at is None or ends_at is None:
+        return 0
+    return int((ends_at - starts_at).total_seconds()) // 60
+
+
+def days(changes):
+    """The distinct dates a list of changes touches, in order."""
+    return sorted({day for day, _, _ in changes if day is not None})
+
+
+async def remove(cur, where: str, params, table: str = "daily_plan"):
+    """
+    Delete the bookings matching where from table. Returns the changes that
+    take them off day_load, as (plan_date, minutes, bookings), for adjust().
+    """
+    await cur.execute(f"SELECT plan_date, starts_at, ends_at FROM {table} WHERE {where}", params)
+    rows = await cur.fetchall()
+    if not rows:
+        return []
+    await cur.execute(f"DELETE FROM {table} WHERE {where}", params)
+    return [(plan_date, -minutes(starts_at, ends_at), -1) for plan_date, starts_at, ends_at in rows]
+
+
+async def adjust(cur, user_id: int, changes):
+    """Apply (plan_date, minutes, bookings) changes to the user's day_load rows, one statement per kind."""
+    totals = defaultdict(lambda: [0, 0])
+    for day, booked, count in changes:
+        if day is not None:
+            totals[day][0] += booked
+            totals[day][1] += count
+    # A booking moved within its day changes nothing
+    totals = {day: total for day, total in totals.items() if total != [0, 0]}
+    if not totals:
+        return
+
+    marks = ", ".join(["%s"] * len(totals))
+    await cur.execute(
+        f"SELECT plan_date FROM day_load WHERE user_id = %s AND plan_date IN ({marks})",
+        (user_id, *totals)
+    )
+    existing = {row[0] for row in await cur.fetchall()}
+    updates = [(booked, count, user_id, day) for day, (booked, count) in totals.items() if day in existing]
+    inserts = [(user_id, day, booked, count) for day, (booked, count) in totals.items() if day not in existing]
+    if updates:
+        await cur.executemany("""
+            UPDATE day_load SET booked_minutes = booked_minutes + %s, bookings = bookings + %s
+            WHERE user_id = %s AND plan_date = %s
+        """, updates)
+    if inserts:
+        await cur.executemany(
+            "INSERT INTO day_load (user_id, plan_date, booked_minutes, bookings) VALUES (%s, %s, %s, %s)",
+            inserts
+        )
+
+
+async def read(cur, user_id: int, first_day, last_day):
+    """{plan_date: (booked_minutes, bookings)} for the user's days in the range that have a row."""
+    await cur.execute("""
+        SELECT plan_date, booked_minutes, bookings FROM day_load
+        WHERE user_id = %s AND plan_date >= %s AND plan_date <= %s
+    """, (user_id, first_day, last_day))
+    return {plan_date: (booked, count) for plan_date, booked, count in await cur.fetchall()}
@@ -0,0 +1,182 @@
+"""
+aiomysql connection pool for DB_DRIVER=async.
+
+Operations are the same coroutines the sync driver runs (see db.run); here
+they get a real aiomysql connection and run on the event loop, so a request
+waiting on MySQL doesn't hold a threadpool worker.
+"""
+import asyncio
+import os
+
+import aiomysql
+
+import db
+
+_pool = None
+_pool_lock = asyncio.Lock()
+_replica_pools = {}  # DB_REPLICAS entry -> pool
+_stats = {"checkouts": 0, "waits": 0}
+
+
+class AsyncCursor:
+    """aiomysql cursor, created on first use so conn.cursor() needn't be awaited."""
+
+    def __init__(self, raw_conn, **kwargs):
+        self._raw_conn = raw_conn
+        self._kwargs = kwargs
+        self._cur = None
+
+    async def _cursor(self):
+        if self._cur is None:
+            if self._kwargs.get("dictionary"):
+                self._cur = await self._raw_conn.cursor(aiomysql.DictCursor)
+            elif self._kwargs.get("unbuffered"):
+                # Rows stay on the server until fetched instead of being read into memory by execute()
+                self._cur = await self._raw_conn.cursor(aiomysql.SSCursor)
+            else:
+                self._cur = await self._raw_conn.cursor()
+        return self._cur
+
+    async def execute(self, sql, params=None):
+        await (await self._cursor()).execute(sql, params)
+
+    async def executemany(self, sql, seq):
+        await (await self._cursor()).executemany(sql, seq)
+
+    async def fetchone(self):
+        return await self._cur.fetchone()
+
+    async def fetchmany(self, size):
+        return await self._cur.fetchmany(size)
+
+    async def fetchall(self):
+        return await self._cur.fetchall()
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+
+class AsyncConnection:
+    def __init__(self, raw):
+        self._raw = raw
+
+    def cursor(self, **kwargs):
+        return AsyncCursor(self._raw, **kwargs)
+
+    async def commit(self):
+        await self._raw.commit()
+
+    async def rollback(self):
+        await self._raw.rollback()
+
+
+async def create_pool(dsn):
+    return await aiomysql.create_pool(
+        host=dsn["host"],
+        port=dsn["port"],
+        user=dsn["user"],
+        password=dsn["password"],
+        db=dsn["database"],
+        connect_timeout=10,
+        autocommit=False,
+        minsize=1,
+        maxsize=int(os.getenv("DB_POOL_SIZE", "5")),
+        pool_recycle=int(float(os.getenv("DB_POOL_RECYCLE", "300"))),
+    )
+
+
+async def get_pool():
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await create_pool(db.primary_dsn())
+    return _pool
+
+
+async def get_replica_pool(replica_dsn: str):
+    pool = _replica_pools.get(replica_dsn)
+    if pool is None:
+        async with _pool_lock:
+            pool = _replica_pools.get(replica_dsn)
+            if pool is None:
+                pool = _replica_pools[replica_dsn] = await create_pool(db.parse_dsn(replica_dsn))
+    return pool
+
+
+async def run_once(op, *args, **kwargs):
+    return await run_on_pool(await get_pool(), op, *args, **kwargs)
+
+
+async def run_on_pool(pool, op, *args, **kwargs):
+    _stats["checkouts"] += 1
+    if pool.freesize == 0 and pool.size >= pool.maxsize:
+        _stats["waits"] += 1
+    async with pool.acquire() as raw:
+        try:
+            return await op(AsyncConnection(raw), *args, **kwargs)
+        finally:
+            # aiomysql closes connections released mid-transaction instead of reusing
+            # them, so end the read snapshot (or a failed write) here
+            if raw.get_transaction_status():
+                await raw.rollback()
+
+
+async def run(op, *args, **kwargs):
+    """Run op(conn, *args) on a pooled aiomysql connection, retrying deadlocks like db.run_blocking."""
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return await run_once(op, *args, **kwargs)
+        except Exception as e:
+            if not db.should_retry(e, attempt):
+                raise
+        await asyncio.sleep(db.deadlock_backoff(attempt))
+
+
+async def run_on(replica_dsn: str, op, *args, **kwargs):
+    """db.run_on for the async driver: op once on the replica's own pool."""
+    return await run_on_pool(await get_replica_pool(replica_dsn), op, *args, **kwargs)
+
+
+async def stream(op, *args, **kwargs):
+    """db.stream for the async driver: op is an async generator run on one pooled connection."""
+    pool = await get_pool()
+    _stats["checkouts"] += 1
+    async with pool.acquire() as raw:
+        finished = False
+        try:
+            async for item in op(AsyncConnection(raw), *args, **kwargs):
+                yield item
+            finished = True
+        finally:
+            if not finished:
+                # The pool drops closed connections; an open one would first drain the unread rows
+                raw.close()
+            elif raw.get_transaction_status():
+                await raw.rollback()
+
+
+async def close_pool():
+    global _pool
+    pools = list(_replica_pools.values())
+    _replica_pools.clear()
+    if _pool is not None:
+        pools.append(_pool)
+        _pool = None
+    for pool in pools:
+        pool.close()
+        await pool.wait_closed()
+
+
+def pool_stats():
+    stats = dict(_stats)
+    if _pool is not None:
+        stats.update({"size": _pool.maxsize, "open": _pool.size, "idle": _pool.freesize})
+    return stats
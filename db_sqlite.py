@@ -0,0 +1,355 @@
+"""
+Embedded SQLite backend for DB_DRIVER=sqlite.
+
+The store operations only use the small cursor interface from db.py and SQL
+that both databases understand, so they run here unchanged: statements are
+translated on the way through (%s becomes ?, FOR UPDATE is dropped) and DATE,
+TIME and DATETIME columns come back as date/time objects as they do from
+MySQL. This is for local development, CI and benchmarks, not production.
+
+    DB_DRIVER=sqlite SQLITE_PATH=/tmp/smartplanner.sqlite3 uvicorn api:app
+    DB_DRIVER=sqlite SQLITE_PATH=:memory: ...   # throwaway database per process
+
+A file database gives every operation its own connection, and a statement
+with FOR UPDATE starts the transaction with BEGIN IMMEDIATE, taking SQLite's
+database-wide write lock: coarser than InnoDB's row lock, but it serializes
+the same writers. An in-memory database has a single connection, so
+operations run one at a time.
+
+The schema is created at the current migration version on first use; keep
+SCHEMA in step with migrations.MIGRATIONS.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, time
+from functools import partial
+
+import anyio
+
+from db import drive, step_blocking
+
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+sqlite3.register_adapter(time, lambda t: t.strftime('%H:%M:%S'))
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("DATE", lambda b: date.fromisoformat(b.decode()))
+sqlite3.register_converter("TIME", lambda b: time.fromisoformat(b.decode()))
+sqlite3.register_converter("DATETIME", lambda b: datetime.fromisoformat(b.decode()))
+
+SCHEMA_VERSION = 10
+
+# Availability times are TEXT, not TIME: end_time may be 24:00:00, which datetime.time can't hold
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(50) NOT NULL UNIQUE,
+    password_hash VARCHAR(255) NOT NULL,
+    role VARCHAR(20) DEFAULT 'user',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    title TEXT,
+    deadline DATE,
+    duration_minutes INT,
+    priority INT,
+    status VARCHAR(20) DEFAULT 'pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    category VARCHAR(50) DEFAULT 'General',
+    completed_at TIMESTAMP NULL
+);
+CREATE TABLE IF NOT EXISTS daily_plan (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    task_id INT REFERENCES tasks(id) ON DELETE CASCADE,
+    plan_date DATE,
+    scheduled_time TIME,
+    task_order INT,
+    starts_at DATETIME NULL,
+    ends_at DATETIME NULL,
+    pinned BOOLEAN NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS availability_templates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    weekday INT NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS availability_exceptions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    exception_date DATE NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    available BOOLEAN NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blackout_dates (
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    blackout_date DATE NOT NULL,
+    reason VARCHAR(255),
+    PRIMARY KEY (user_id, blackout_date)
+);
+CREATE TABLE IF NOT EXISTS recurring_tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    title TEXT,
+    start_time TIME NOT NULL,
+    duration_minutes INT NOT NULL,
+    freq VARCHAR(10) NOT NULL,
+    repeat_every INT NOT NULL DEFAULT 1,
+    weekdays INT NOT NULL DEFAULT 0,
+    start_date DATE NOT NULL,
+    until_date DATE NULL,
+    occurrence_count INT NULL,
+    category VARCHAR(50) DEFAULT 'General',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS api_tokens (
+    token_hash CHAR(64) PRIMARY KEY,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS tasks_archive (
+    id INTEGER PRIMARY KEY,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    title TEXT,
+    deadline DATE,
+    duration_minutes INT,
+    priority INT,
+    status VARCHAR(20),
+    created_at TIMESTAMP NULL,
+    category VARCHAR(50),
+    completed_at TIMESTAMP NULL,
+    archived_at DATETIME NOT NULL
+);
+CREATE TABLE IF NOT EXISTS daily_plan_archive (
+    id INTEGER PRIMARY KEY,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    task_id INT,
+    plan_date DATE NOT NULL,
+    scheduled_time TIME,
+    starts_at DATETIME NULL,
+    ends_at DATETIME NULL,
+    pinned BOOLEAN NOT NULL DEFAULT 0,
+    title TEXT,
+    duration_minutes INT,
+    priority INT,
+    deadline DATE,
+    category VARCHAR(50),
+    archived_at DATETIME NOT NULL
+);
+CREATE TABLE IF NOT EXISTS day_load (
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    plan_date DATE NOT NULL,
+    booked_minutes INT NOT NULL DEFAULT 0,
+    bookings INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, plan_date)
+);
+CREATE INDEX IF NOT EXISTS idx_recurring_tasks_user ON recurring_tasks (user_id);
+CREATE INDEX IF NOT EXISTS idx_api_tokens_user ON api_tokens (user_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_user_status_deadline ON tasks (user_id, status, deadline);
+CREATE INDEX IF NOT EXISTS idx_tasks_user_deadline ON tasks (user_id, deadline, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_deadline ON tasks (deadline, id);
+CREATE INDEX IF NOT EXISTS idx_daily_plan_user_date_time ON daily_plan (user_id, plan_date, scheduled_time);
+CREATE INDEX IF NOT EXISTS idx_daily_plan_user_ends ON daily_plan (user_id, ends_at, starts_at);
+CREATE INDEX IF NOT EXISTS idx_daily_plan_task ON daily_plan (task_id);
+CREATE INDEX IF NOT EXISTS idx_daily_plan_date ON daily_plan (plan_date);
+CREATE INDEX IF NOT EXISTS idx_tasks_status_completed ON tasks (status, completed_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_archive_user_deadline ON tasks_archive (user_id, deadline, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_archive_deadline ON tasks_archive (deadline, id);
+CREATE INDEX IF NOT EXISTS idx_daily_plan_archive_user_date ON daily_plan_archive (user_id, plan_date, starts_at);
+CREATE INDEX IF NOT EXISTS idx_daily_plan_archive_task ON daily_plan_archive (task_id);
+CREATE INDEX IF NOT EXISTS idx_daily_plan_archive_date ON daily_plan_archive (plan_date);
+CREATE INDEX IF NOT EXISTS idx_availability_templates_user ON availability_templates (user_id, weekday);
+CREATE INDEX IF NOT EXISTS idx_availability_exceptions_user_date ON availability_exceptions (user_id, exception_date);
+INSERT OR IGNORE INTO users (id, username, password_hash) VALUES (1, 'default', 'default_hash');
+"""
+
+
+def to_sqlite(sql):
+    """MySQL statement -> SQLite: ? placeholders, no row locking clause."""
+    return sql.replace("%s", "?").replace(" FOR UPDATE", "")
+
+
+def connect(path=":memory:", **kwargs):
+    """A raw sqlite3 connection with the schema in place."""
+    conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, **kwargs)
+    # Off by default in SQLite; MySQL enforces them and deletes rely on ON DELETE CASCADE
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    conn.commit()
+    return conn
+
+
+class SQLiteCursor:
+    """Async-style cursor that takes MySQL statements, like db.SyncCursor."""
+
+    def __init__(self, raw_conn):
+        self._conn = raw_conn
+        self._raw = raw_conn.cursor()
+        self.lastrowid = None
+        self.rowcount = -1
+
+    async def execute(self, sql, params=None):
+        if " FOR UPDATE" in sql and not self._conn.in_transaction:
+            self._conn.execute("BEGIN IMMEDIATE")
+        self._raw.execute(to_sqlite(sql), params or ())
+        self.lastrowid = self._raw.lastrowid
+        self.rowcount = self._raw.rowcount
+
+    async def executemany(self, sql, seq):
+        self._raw.executemany(to_sqlite(sql), seq)
+        self.rowcount = self._raw.rowcount
+
+    async def fetchone(self):
+        return self._raw.fetchone()
+
+    async def fetchmany(self, size):
+        return self._raw.fetchmany(size)
+
+    async def fetchall(self):
+        return self._raw.fetchall()
+
+
+class SQLiteConnection:
+    def __init__(self, raw):
+        self._raw = raw
+
+    def cursor(self, **kwargs):
+        return SQLiteCursor(self._raw)
+
+    async def commit(self):
+        self._raw.commit()
+
+    async def rollback(self):
+        self._raw.rollback()
+
+
+class Database:
+    """One SQLite database (a file path or ":memory:") that runs store operations."""
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self.in_memory = path == ":memory:"
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"operations": 0, "in_use": 0}
+        self._shared = None
+        if self.in_memory:
+            self._shared = connect(path, check_same_thread=False)
+        else:
+            conn = connect(path, timeout=timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.close()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, detect_types=sqlite3.PARSE_DECLTYPES,
+                               check_same_thread=False)
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def wrap(self, raw):
+        """The connection object an operation is handed; the benchmark stand-ins override this."""
+        return SQLiteConnection(raw)
+
+    @contextmanager
+    def checkout(self):
+        if self.in_memory:
+            with self._lock:
+                yield self._shared
+            return
+        raw = self.connect()
+        try:
+            yield raw
+        finally:
+            raw.close()
+
+    def run_blocking(self, op, *args, **kwargs):
+        """Run op(conn, *args) on this thread; an uncommitted transaction is rolled back."""
+        self.count_operation(1)
+        try:
+            with self.checkout() as raw:
+                try:
+                    return drive(op(self.wrap(raw), *args, **kwargs))
+                finally:
+                    if raw.in_transaction:
+                        raw.rollback()
+        finally:
+            self.count_operation(-1)
+
+    def count_operation(self, change: int):
+        """Track one operation starting (1) or finishing (-1)."""
+        with self._stats_lock:
+            if change > 0:
+                self._stats["operations"] += 1
+            self._stats["in_use"] += change
+
+    def stats(self):
+        with self._stats_lock:
+            return {"path": self.path, "in_memory": self.in_memory, **self._stats}
+
+
+_database = None
+_database_lock = threading.Lock()
+_replicas = {}  # DB_REPLICAS path -> Database
+
+
+def get_database():
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = Database(os.getenv("SQLITE_PATH", "smartplanner.sqlite3"))
+    return _database
+
+
+async def run(op, *args, **kwargs):
+    """db.run for DB_DRIVER=sqlite: the operation runs on a worker thread, as with the sync driver."""
+    return await anyio.to_thread.run_sync(partial(get_database().run_blocking, op, *args, **kwargs))
+
+
+def get_replica(path: str):
+    """
+    A database file standing in for a read replica. Nothing copies the
+    primary into it; whoever sets one up (see benchmarks/replica_check.py)
+    does that, with whatever lag they want to test.
+    """
+    database = _replicas.get(path)
+    if database is None:
+        with _database_lock:
+            database = _replicas.get(path)
+            if database is None:
+                database = _replicas[path] = Database(path)
+    return database
+
+
+async def run_on(path: str, op, *args, **kwargs):
+    """db.run_on for DB_DRIVER=sqlite."""
+    return await anyio.to_thread.run_sync(partial(get_replica(path).run_blocking, op, *args, **kwargs))
+
+
+async def stream(op, *args, **kwargs):
+    """
+    db.stream for DB_DRIVER=sqlite. An in-memory database is held for the
+    whole stream, so other operations wait until it finishes.
+    """
+    database = get_database()
+    checkout = database.checkout()
+    raw = await anyio.to_thread.run_sync(checkout.__enter__)
+    database.count_operation(1)
+    try:
+        async for item in step_blocking(op(database.wrap(raw), *args, **kwargs)):
+            yield item
+    finally:
+        if raw.in_transaction:
+            raw.rollback()
+        checkout.__exit__(None, None, None)
+        database.count_operation(-1)
+
+
+def pool_stats():
+    return get_database().stats()
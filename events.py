@@ -0,0 +1,222 @@
+"""
+Per-user change feed, pushed to clients as Server-Sent Events.
+
+The handlers that change tasks or the schedule call hub.publish(user_id,
+type, task_id, days) after their transaction commits. Each open
+GET /events stream is a subscriber with its own queue of at most
+EVENTS_QUEUE_SIZE events, so a slow client can't make the hub buffer
+without limit. When a subscriber's queue is full it is marked lagging and
+dropped from the hub. Its stream sends what is already queued and then
+ends. The browser's EventSource reconnects with the id of the last event
+it saw, and that id picks up where it left off. A client behind on the
+network never blocks publish() or the other subscribers.
+
+Event ids are resume tokens of the form "<epoch>-<seq>". The hub keeps the
+last EVENTS_HISTORY events per user for the last EVENTS_USERS users, so a
+reconnect sent with Last-Event-ID (or ?since=) replays only the events
+after it. If those events are gone (the token predates the history or
+this worker's start, or comes from another run), the stream starts with a
+"reset" event instead, and the client reloads everything once. A new stream
+without a token starts with a "ready" event that carries the current id.
+
+A stream holds no database connection, so an open client costs one queue
+and a heartbeat comment every EVENTS_HEARTBEAT seconds, which keeps
+proxies from closing an idle stream.
+
+publish() sends each change through the state bus (see shared.py). Every
+worker's hub records it and feeds its own streams, so a client sees
+changes made through any worker. On the shared bus, events arrive in the
+same order with the same ids everywhere, and a client can reconnect to a
+different worker and resume. Each worker then delivers, including its own
+changes, on its next poll, up to STATE_POLL_MS later.
+"""
+import asyncio
+import json
+import os
+from collections import OrderedDict, deque
+
+from shared import bus
+
+QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+HISTORY = int(os.getenv("EVENTS_HISTORY", "200"))
+USERS = int(os.getenv("EVENTS_USERS", "1024"))
+HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "1000"))
+# Milliseconds EventSource waits before reconnecting
+RETRY_MS = 2000
+
+class TooManySubscribers(Exception):
+    """Raised when EVENTS_MAX_SUBSCRIBERS streams are already open."""
+
+
+class Subscriber:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.lagging = False
+        # Events up to this seq were sent already, by the replay or by the worker the client came from
+        self.since = 0
+
+
+class EventHub:
+    def __init__(self):
+        self._last = bus.first_seq
+        # Events up to this seq came before this worker started, or were lost in a bus reset
+        self._floor = bus.first_seq
+        self._history = OrderedDict()  # user_id -> (deque of events, seq of the newest one dropped)
+        # Highest seq that may have been lost with a user evicted from _history
+        self._evicted_through = 0
+        self._subscribers = {}  # user_id -> set of Subscriber
+        self._stats = {"published": 0, "delivered": 0, "lagging": 0, "replayed": 0, "resets": 0}
+
+    def token(self, seq: int) -> str:
+        return f"{bus.epoch}-{seq}"
+
+    def parse_token(self, value: str):
+        """seq of a token from this run, or None if it is from another run or malformed."""
+        epoch, _, seq = (value or "").partition("-")
+        if epoch != bus.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def _record(self, user_id: int, event):
+        entry = self._history.get(user_id)
+        if entry is None:
+            entry = self._history[user_id] = (deque(), [0])
+            while len(self._history) > USERS:
+                _, (evicted, _) = self._history.popitem(last=False)
+                if evicted:
+                    self._evicted_through = max(self._evicted_through, evicted[-1]["seq"])
+        else:
+            self._history.move_to_end(user_id)
+        events, dropped = entry
+        events.append(event)
+        if len(events) > HISTORY:
+            dropped[0] = events.popleft()["seq"]
+
+    def publish(self, user_id: int, type: str, task_id: int = None, days=()):
+        """Send a change to every worker's hub. Call from the event loop. Returns its seq."""
+        self._stats["published"] += 1
+        return bus.publish("event", {
+            "user_id": user_id,
+            "type": type,
+            "data": {"task_id": task_id, "days": sorted(str(day) for day in days)},
+        })
+
+    def deliver(self, message, seq: int):
+        """Record a change from the bus and queue it for the user's open streams."""
+        user_id = message["user_id"]
+        event = {"seq": seq, "type": message["type"], "data": message["data"]}
+        self._last = seq
+        self._record(user_id, event)
+
+        for subscriber in list(self._subscribers.get(user_id, ())):
+            if seq <= subscriber.since:
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+                self._stats["delivered"] += 1
+            except asyncio.QueueFull:
+                # Stop feeding it; the client resumes from its last event on reconnect
+                subscriber.lagging = True
+                self._stats["lagging"] += 1
+                self._remove(subscriber)
+
+    def reset(self, payload, seq: int):
+        """Forget the history after the bus lost messages, and end every stream so clients reset."""
+        self._history.clear()
+        self._floor = self._last = max(self._last, seq)
+        for subscribers in list(self._subscribers.values()):
+            for subscriber in list(subscribers):
+                subscriber.lagging = True
+                self._remove(subscriber)
+
+    def _missed(self, user_id: int, since: int):
+        """Events for the user after seq since, or None if some of them are no longer kept."""
+        if since < self._floor:
+            return None
+        entry = self._history.get(user_id)
+        if entry is None:
+            return None if since < self._evicted_through else []
+        events, dropped = entry
+        if since < dropped[0]:
+            return None
+        return [event for event in events if event["seq"] > since]
+
+    def subscribe(self, user_id: int, since: str = None):
+        """
+        Open a subscription. Returns (subscriber, first events), where the
+        first events are the replay after since, or a single "ready" or
+        "reset" event.
+        """
+        if sum(len(subscribers) for subscribers in self._subscribers.values()) >= MAX_SUBSCRIBERS:
+            raise TooManySubscribers(f"Too many open event streams (limit {MAX_SUBSCRIBERS})")
+
+        seq = None
+        if not since:
+            first = [{"seq": self._last, "type": "ready", "data": {}}]
+        else:
+            seq = self.parse_token(since)
+            first = self._missed(user_id, seq) if seq is not None else None
+            if first is None:
+                seq = None
+                self._stats["resets"] += 1
+                first = [{"seq": self._last, "type": "reset", "data": {}}]
+            else:
+                self._stats["replayed"] += len(first)
+
+        # No await since reading the history, so nothing published in between is missed
+        subscriber = Subscriber(user_id)
+        if seq is not None:
+            subscriber.since = seq
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber, first
+
+    def _remove(self, subscriber):
+        subscribers = self._subscribers.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.user_id]
+
+    def unsubscribe(self, subscriber):
+        self._remove(subscriber)
+
+    def stats(self):
+        return {
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "users_with_history": len(self._history),
+            **self._stats,
+        }
+
+
+def frame(hub, event) -> str:
+    """One event in the SSE wire format."""
+    return (f"id: {hub.token(event['seq'])}\n"
+            f"event: {event['type']}\n"
+            f"data: {json.dumps(event['data'], separators=(',', ':'))}\n\n")
+
+
+async def stream(hub, subscriber, first):
+    """The body of an event stream: the first events, then live ones and heartbeats."""
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        for event in first:
+            yield frame(hub, event)
+        while True:
+            if subscriber.lagging and subscriber.queue.empty():
+                # Dropped by the hub; ending the stream makes the client reconnect and resume
+                return
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield frame(hub, event)
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+hub = EventHub()
+bus.on("event", hub.deliver, ordered=True)
+bus.on("reset", hub.reset)
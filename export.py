@@ -0,0 +1,157 @@
+"""
+Schedule export over a date range, as NDJSON or iCalendar, streamed.
+
+stream_export() runs store.export_schedule through db.stream and turns each
+batch of rows into one chunk of the response body, so GET /export/schedule
+can send months of schedule while only one batch is in memory.
+
+- ndjson: one JSON object per booking per line, with the fields the schedule
+  endpoints use plus full starts_at / ends_at timestamps
+- ics: an RFC 5545 calendar with one VEVENT per booking. Times are floating
+  (no time zone), like the stored schedule, so calendar apps show them in
+  the viewer's zone. The UID is per task, so re-importing after a task was
+  rescheduled moves its event instead of adding a second one. An occurrence
+  of a recurring task gets one per rule and date.
+
+Occurrences of recurring tasks are exported alongside the bookings, with
+task_id null and the rule's recurring_id, as the schedule endpoints show them.
+"""
+import json
+import os
+from datetime import datetime, timezone
+
+import db
+import store
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "ics": "text/calendar; charset=utf-8",
+}
+BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+
+def ndjson_chunk(rows) -> str:
+    lines = []
+    for plan_date, task_id, title, starts_at, ends_at, duration, deadline, category, recurring_id in rows:
+        # isoformat() is several times faster than strftime(); HH:MM is a slice of it
+        starts, ends = starts_at.isoformat(), ends_at.isoformat()
+        lines.append(json.dumps({
+            "date": str(plan_date),
+            "task_id": task_id,
+            "recurring_id": recurring_id,
+            "title": title,
+            "start_time": starts[11:16],
+            "end_time": ends[11:16],
+            "starts_at": starts,
+            "ends_at": ends,
+            "duration": duration,
+            "due_date": str(deadline),
+            "category": category,
+        }, separators=(",", ":")))
+    return "".join(line + "\n" for line in lines)
+
+
+def ics_text(value) -> str:
+    """Escape a TEXT property value."""
+    return (str(value).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def ics_line(line: str) -> str:
+    """A content line folded at 75 octets, without splitting a UTF-8 character."""
+    if len(line) <= 75 and line.isascii():
+        return line + "\r\n"
+    parts = []
+    current = ""
+    size = 0
+    for char in line:
+        width = len(char.encode())
+        if size + width > 75:
+            parts.append(current)
+            # Continuation lines start with a space, which counts toward their 75
+            current = " "
+            size = 1
+        current += char
+        size += width
+    parts.append(current)
+    return "\r\n".join(parts) + "\r\n"
+
+
+def ics_header() -> str:
+    return "".join(ics_line(line) for line in (
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Smart Planner//Schedule Export//EN",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        "X-WR-CALNAME:Smart Planner",
+    ))
+
+
+def ics_footer() -> str:
+    return ics_line("END:VCALENDAR")
+
+
+def ics_datetime(value) -> str:
+    """Floating DATE-TIME: 2026-10-19T05:00:00 -> 20261019T050000."""
+    return value.isoformat().replace("-", "").replace(":", "")
+
+
+def ics_chunk(rows, stamp: str) -> str:
+    lines = []
+    for plan_date, task_id, title, starts_at, ends_at, duration, deadline, category, recurring_id in rows:
+        if recurring_id is None:
+            uid = f"task-{task_id}"
+        else:
+            uid = f"recurring-{recurring_id}-{plan_date.isoformat().replace('-', '')}"
+        lines.extend((
+            "BEGIN:VEVENT",
+            f"UID:{uid}@smartplanner",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{ics_datetime(starts_at)}",
+            f"DTEND:{ics_datetime(ends_at)}",
+            f"SUMMARY:{ics_text(title or '')}",
+        ))
+        if deadline and recurring_id is None:
+            lines.append(f"DESCRIPTION:{ics_text(f'Due {deadline}')}")
+        if category:
+            lines.append(f"CATEGORIES:{ics_text(category)}")
+        lines.append("END:VEVENT")
+    return "".join(ics_line(line) for line in lines)
+
+
+async def stream_export(user_id: int, first_day, last_day, fmt: str):
+    """
+    The export body in chunks of bytes. The first chunk comes after the first
+    batch has been read, so a caller can await it to surface database errors
+    before the response starts; an empty range still yields one chunk.
+    """
+    if fmt == "ics":
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        prefix, suffix = ics_header(), ics_footer()
+
+        def chunk(rows):
+            return ics_chunk(rows, stamp)
+    else:
+        prefix, suffix = "", ""
+        chunk = ndjson_chunk
+
+    batches = db.stream(store.export_schedule, user_id, first_day, last_day, BATCH_SIZE)
+    try:
+        async for rows in batches:
+            yield (prefix + chunk(rows)).encode()
+            prefix = ""
+    finally:
+        # Closing the generator early (client went away) hands the connection back now, not at GC
+        await batches.aclose()
+    yield (prefix + suffix).encode()
+
+
+async def prepend(first: bytes, rest):
+    """Chunk `first`, then the rest of a stream_export body."""
+    try:
+        yield first
+        async for chunk in rest:
+            yield chunk
+    finally:
+        await rest.aclose()
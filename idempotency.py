@@ -0,0 +1,358 @@
+"""
+Idempotency keys for POST /tasks and POST /schedule.
+
+A client that gives up on a slow POST and sends it again can't tell whether
+the first one ran. With an Idempotency-Key header (up to 255 characters,
+new for each action the user means, e.g. a UUID, and the same on every
+retry of it) it doesn't have to. IdempotencyMiddleware runs the request
+once per key. A repeat gets the stored status, headers and body back, plus
+Idempotent-Replayed: true.
+
+- Keys are per caller. The same key sent with other credentials
+  (Authorization / X-User-Id) is another key.
+- A repeat has to be the same request: method, path, query string and
+  body. One that differs gets 422, so a reused key never returns the
+  result of some other request.
+- A repeat that arrives while the first request is still running waits for
+  it and gets its response. The first request runs to the end even if its
+  client has gone.
+- Only successful (2xx) responses are kept. An error goes to the requests
+  waiting on it in the same worker, and then the key is free again, so a
+  retry (or a repeat waiting in another worker) runs the request again.
+- Responses are kept for IDEMPOTENCY_TTL seconds. At most
+  IDEMPOTENCY_MAX_KEYS are kept; the least recently used go first.
+
+IDEMPOTENCY_STORE picks where the keys are kept:
+- memory (default): per process.
+- shared: a SQLite file at IDEMPOTENCY_PATH, used by every worker on the
+  host, so a retry that lands on another worker is still a repeat. serve.py
+  picks this when it runs several workers. The worker that runs a request
+  claims its key with a pending row, and the others poll that row until
+  the response is in. A claim older than IDEMPOTENCY_LOCK_TIMEOUT seconds
+  (its worker died mid-request) is taken over.
+- off: the header is ignored.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import users
+
+ROUTES = {("POST", "/tasks"), ("POST", "/schedule")}
+MAX_KEY_LENGTH = 255
+# How often a request polls a key another worker is running
+WAIT_POLL = 0.05
+
+DONE, CLAIMED, BUSY = "done", "claimed", "busy"
+
+
+class KeyReused(Exception):
+    """The key was first sent with a different request."""
+
+
+class IdempotencyStore:
+    """Responses by key in an in-process LRU with a TTL, and the requests running now."""
+
+    backend = "memory"
+
+    def __init__(self, max_keys=10000, ttl=86400.0):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (fingerprint, response, expires_at), most recently used on the right
+        self._running = {}  # key -> (fingerprint, task)
+        self._stats = {"executed": 0, "replayed": 0, "joined": 0, "reused": 0, "evictions": 0, "expired": 0}
+
+    def _claim(self, key, fingerprint):
+        """(DONE, fingerprint, response), (BUSY, fingerprint, None) or (CLAIMED, fingerprint, None)."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[2] >= time.monotonic():
+                self._entries.move_to_end(key)
+                return DONE, entry[0], entry[1]
+            del self._entries[key]
+            self._stats["expired"] += 1
+        return CLAIMED, fingerprint, None
+
+    def _save(self, key, fingerprint, response):
+        self._entries[key] = (fingerprint, response, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _release(self, key):
+        pass
+
+    async def _execute(self, key, fingerprint, execute):
+        try:
+            response = await execute()
+        except BaseException:
+            self._release(key)
+            raise
+        finally:
+            self._running.pop(key, None)
+        if 200 <= response["status"] < 300:
+            self._save(key, fingerprint, response)
+        else:
+            self._release(key)
+        return response
+
+    async def run(self, key, fingerprint, execute):
+        """
+        The response for key: stored, from the request with that key running
+        now, or from `await execute()`. Returns (response, replayed). Raises
+        KeyReused if the key belongs to a request with another fingerprint.
+        """
+        while True:
+            running = self._running.get(key)
+            if running is not None:
+                if running[0] != fingerprint:
+                    self._stats["reused"] += 1
+                    raise KeyReused()
+                self._stats["joined"] += 1
+                return await asyncio.shield(running[1]), True
+
+            state, owner, response = self._claim(key, fingerprint)
+            if owner != fingerprint:
+                self._stats["reused"] += 1
+                raise KeyReused()
+            if state == DONE:
+                self._stats["replayed"] += 1
+                return response, True
+            if state == CLAIMED:
+                break
+            # Another worker is running it
+            await asyncio.sleep(WAIT_POLL)
+
+        self._stats["executed"] += 1
+        # Its own task, so it finishes even if this request is cancelled, and its waiters get the answer
+        task = asyncio.ensure_future(self._execute(key, fingerprint, execute))
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._running[key] = (fingerprint, task)
+        return await asyncio.shield(task), False
+
+    def stats(self):
+        return {**self._stats, "backend": self.backend, "keys": len(self._entries), "running": len(self._running),
+                "max_keys": self.max_keys, "ttl": self.ttl}
+
+
+class SharedIdempotencyStore(IdempotencyStore):
+    """The same keys in a SQLite file, for every worker on the host. Counters are per process."""
+
+    backend = "shared"
+
+    def __init__(self, path, max_keys=10000, ttl=86400.0, lock_timeout=60.0):
+        super().__init__(max_keys, ttl)
+        self.path = path
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        # response is NULL while the request is running, claimed_at is when it started
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency_keys "
+            "(key TEXT PRIMARY KEY, fingerprint TEXT, response TEXT, claimed_at REAL, expires_at REAL, used_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_used ON idempotency_keys (used_at)")
+
+    @staticmethod
+    def _encode(response):
+        return json.dumps({
+            "status": response["status"],
+            "headers": [[name.decode("latin-1"), value.decode("latin-1")] for name, value in response["headers"]],
+            "body": response["body"].decode("latin-1"),
+        })
+
+    @staticmethod
+    def _decode(encoded):
+        response = json.loads(encoded)
+        return {
+            "status": response["status"],
+            "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in response["headers"]],
+            "body": response["body"].encode("latin-1"),
+        }
+
+    def _claim(self, key, fingerprint):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT fingerprint, response, claimed_at, expires_at FROM idempotency_keys WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    owner, response, claimed_at, expires_at = row
+                    if response is not None and expires_at >= now:
+                        self._conn.execute("UPDATE idempotency_keys SET used_at = ? WHERE key = ?", (now, key))
+                        return DONE, owner, self._decode(response)
+                    if response is None and now - claimed_at < self.lock_timeout:
+                        return BUSY, owner, None
+                    if response is not None:
+                        self._stats["expired"] += 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, response, claimed_at, expires_at, used_at) "
+                    "VALUES (?, ?, NULL, ?, NULL, ?)",
+                    (key, fingerprint, now, now)
+                )
+                return CLAIMED, fingerprint, None
+            finally:
+                self._conn.execute("COMMIT")
+
+    def _save(self, key, fingerprint, response):
+        now = time.time()
+        encoded = self._encode(response)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE idempotency_keys SET response = ?, expires_at = ?, used_at = ? WHERE key = ?",
+                    (encoded, now + self.ttl, now, key)
+                )
+                expired = self._conn.execute(
+                    "DELETE FROM idempotency_keys WHERE expires_at < ?", (now,)
+                ).rowcount
+                self._stats["expired"] += max(expired, 0)
+                evicted = self._conn.execute(
+                    "DELETE FROM idempotency_keys WHERE key IN "
+                    "(SELECT key FROM idempotency_keys ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_keys,)
+                ).rowcount
+                self._stats["evictions"] += max(evicted, 0)
+            finally:
+                self._conn.execute("COMMIT")
+
+    def _release(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND response IS NULL", (key,))
+
+    def stats(self):
+        with self._lock:
+            keys = self._conn.execute("SELECT COUNT(*) FROM idempotency_keys WHERE response IS NOT NULL").fetchone()[0]
+        return {**super().stats(), "keys": keys, "path": self.path, "lock_timeout": self.lock_timeout}
+
+
+class NoStore(IdempotencyStore):
+    """Runs every request; the header is ignored."""
+
+    async def run(self, key, fingerprint, execute):
+        return await execute(), False
+
+    def stats(self):
+        return {"backend": "off"}
+
+
+def create_store():
+    backend = os.getenv("IDEMPOTENCY_STORE", "memory")
+    max_keys = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+    ttl = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+    if backend == "off":
+        return NoStore()
+    if backend == "shared":
+        path = os.getenv("IDEMPOTENCY_PATH", "/tmp/smartplanner-idempotency.sqlite3")
+        return SharedIdempotencyStore(path, max_keys, ttl, float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "60")))
+    return IdempotencyStore(max_keys, ttl)
+
+
+store = create_store()
+
+
+def caller(context) -> str:
+    """Who sent the request, as far as its headers say; keys are kept per caller."""
+    if context is None or context.anonymous:
+        return "anonymous"
+    if context.token is not None:
+        return "token:" + users.hash_token(context.token)
+    return "user:" + context.header_user_id
+
+
+def digest(*parts) -> str:
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(part if isinstance(part, bytes) else str(part).encode())
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+async def send_json(send, status: int, content, headers=()):
+    body = json.dumps(content).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware: runs a ROUTES request with an Idempotency-Key header once per key."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in ROUTES:
+            await self.app(scope, receive, send)
+            return
+        key = next((value.decode("latin-1").strip() for name, value in scope["headers"]
+                    if name == b"idempotency-key"), None)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await send_json(send, 400, {"detail": f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"})
+            return
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+        first = True
+
+        async def replay_receive():
+            nonlocal first
+            if first:
+                first = False
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        async def execute():
+            response = {"status": 500, "headers": [], "body": b""}
+            parts = []
+
+            async def capture(message):
+                if message["type"] == "http.response.start":
+                    response["status"] = message["status"]
+                    response["headers"] = list(message.get("headers", []))
+                elif message["type"] == "http.response.body":
+                    parts.append(message.get("body", b""))
+
+            await self.app(scope, replay_receive, capture)
+            response["body"] = b"".join(parts)
+            return response
+
+        try:
+            response, replayed = await store.run(
+                digest(caller(users.current.get()), key),
+                digest(scope["method"], scope["path"], scope.get("query_string", b""), body),
+                execute,
+            )
+        except KeyReused:
+            await send_json(send, 422, {"detail": "Idempotency-Key was already used for a different request"})
+            return
+
+        headers = list(response["headers"])
+        if replayed:
+            headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": response["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": response["body"]})
@@ -0,0 +1,277 @@
+"""
+Request and database metrics in Prometheus text format, served at GET /metrics.
+
+MetricsMiddleware times every request and records it per route template
+(/schedule/{schedule_date}, not the concrete URL) and status. Database
+operations run through db.run get an instrumented connection whose cursors
+count queries, rows fetched and time spent in the database; those land in
+the current request's RequestStats and in per-route histograms. Statements
+slower than SLOW_QUERY_MS are logged to the "smartplanner.slow_query" logger
+with the SQL (which only has %s placeholders) and a count of redacted
+parameters, never their values.
+
+Metrics are per process; with several uvicorn workers each serves its own.
+"""
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_MS", "200")) / 1000
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+slow_query_log = logging.getLogger("smartplanner.slow_query")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} counter")
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        names = self.labels + ("le",)
+        for label_values, values in series:
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{_labels(names, label_values + (bound,))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(names, label_values + ('+Inf',))} {values[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {values[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {values[-1]}")
+
+
+REQUEST_SECONDS = Histogram(
+    "smartplanner_http_request_duration_seconds", "Request latency by route template, method and status.",
+    LATENCY_BUCKETS, ("route", "method", "status"))
+REQUEST_QUERIES = Histogram(
+    "smartplanner_http_request_db_queries", "Database statements run per request.",
+    QUERY_COUNT_BUCKETS, ("route",))
+REQUEST_DB_SECONDS = Histogram(
+    "smartplanner_http_request_db_seconds", "Time per request spent waiting on the database.",
+    LATENCY_BUCKETS, ("route",))
+DB_QUERIES = Counter("smartplanner_db_queries_total", "Database statements run.", ("route",))
+DB_ROWS = Counter("smartplanner_db_rows_fetched_total", "Rows fetched from the database.", ("route",))
+DB_SLOW_QUERIES = Counter("smartplanner_db_slow_queries_total", "Statements slower than SLOW_QUERY_MS.", ("route",))
+DB_CONNECTION_ERRORS = Counter("smartplanner_db_connection_errors_total", "Failed attempts to open a MySQL connection.")
+
+REGISTRY = [REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_DB_SECONDS, DB_QUERIES, DB_ROWS, DB_SLOW_QUERIES, DB_CONNECTION_ERRORS]
+
+
+class RequestStats:
+    __slots__ = ("scope", "queries", "rows", "db_seconds")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.queries = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+
+    @property
+    def route(self):
+        # The router stores the matched FastAPI route on the (shared) scope before calling the handler
+        return getattr(self.scope.get("route"), "path", "unmatched")
+
+
+current = ContextVar("request_stats", default=None)
+
+
+def _route():
+    stats = current.get()
+    return stats.route if stats is not None else "background"
+
+
+def _record(sql, params, elapsed):
+    stats = current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+    route = _route()
+    DB_QUERIES.inc(route)
+    if elapsed >= SLOW_QUERY_SECONDS:
+        DB_SLOW_QUERIES.inc(route)
+        count = len(params) if isinstance(params, (list, tuple)) else (0 if params is None else 1)
+        slow_query_log.warning("slow query %.1f ms route=%s params=<%d redacted>: %s",
+                               elapsed * 1000, route, count, " ".join(sql.split()))
+
+
+def _fetched(count):
+    stats = current.get()
+    if stats is not None:
+        stats.rows += count
+    DB_ROWS.inc(_route(), amount=count)
+
+
+class InstrumentedCursor:
+    """Wraps a db.run cursor (either driver) and records every statement."""
+
+    def __init__(self, cur):
+        self._cur = cur
+
+    async def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            await self._cur.execute(sql, params)
+        finally:
+            _record(sql, params, time.perf_counter() - started)
+
+    async def executemany(self, sql, seq):
+        started = time.perf_counter()
+        try:
+            await self._cur.executemany(sql, seq)
+        finally:
+            _record(sql, None, time.perf_counter() - started)
+
+    async def fetchone(self):
+        row = await self._cur.fetchone()
+        if row is not None:
+            _fetched(1)
+        return row
+
+    async def fetchmany(self, size):
+        rows = await self._cur.fetchmany(size)
+        _fetched(len(rows))
+        return rows
+
+    async def fetchall(self):
+        rows = await self._cur.fetchall()
+        _fetched(len(rows))
+        return rows
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+
+class InstrumentedConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(**kwargs))
+
+    async def commit(self):
+        started = time.perf_counter()
+        try:
+            await self._conn.commit()
+        finally:
+            _record("COMMIT", None, time.perf_counter() - started)
+
+    async def rollback(self):
+        started = time.perf_counter()
+        try:
+            await self._conn.rollback()
+        finally:
+            _record("ROLLBACK", None, time.perf_counter() - started)
+
+
+def instrumented(op):
+    """op, but handed an InstrumentedConnection instead of the raw one."""
+    async def run_instrumented(conn, *args, **kwargs):
+        return await op(InstrumentedConnection(conn), *args, **kwargs)
+    return run_instrumented
+
+
+def instrumented_stream(op):
+    """The same for an async generator operation run with db.stream."""
+    def run_instrumented(conn, *args, **kwargs):
+        return op(InstrumentedConnection(conn), *args, **kwargs)
+    return run_instrumented
+
+
+class MetricsMiddleware:
+    """ASGI middleware: per-request stats and latency by route template and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = current.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            current.reset(token)
+            REQUEST_SECONDS.observe(elapsed, stats.route, scope["method"], str(status))
+            REQUEST_QUERIES.observe(stats.queries, stats.route)
+            REQUEST_DB_SECONDS.observe(stats.db_seconds, stats.route)
+
+
+def render(gauges=()):
+    """Every metric in Prometheus text format, plus (name, help, {labels: value}) gauges."""
+    lines = []
+    for metric in REGISTRY:
+        metric.render(lines)
+    for name, help_text, label_name, values in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for label_value, value in sorted(values.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f"{name}{_labels((label_name,), (label_value,))} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,401 @@
+"""
+Versioned schema migrations.
+
+Each migration is (version, description, statements). migrate() applies the
+ones newer than the version recorded in schema_migrations, in order, and
+records each one as it finishes. It runs at API startup and from /init-db.
+
+MySQL commits DDL implicitly, so a migration that fails halfway is not
+rolled back; fix the statement and add a new migration rather than editing
+one that has already shipped.
+
+    python migrations.py            # apply pending migrations
+    python migrations.py explain    # EXPLAIN the hot queries, fail on full scans
+
+Run the explain check against a database with realistic data: on nearly
+empty tables MySQL may pick a table scan even when an index exists.
+
+With DB_DRIVER=sqlite there is nothing to migrate: db_sqlite.SCHEMA is the
+schema at the latest version and must be updated alongside MIGRATIONS.
+"""
+import logging
+import os
+import sys
+import db
+from db import connection
+
+logger = logging.getLogger("smartplanner.migrations")
+
+MIGRATIONS = [
+    (1, "Base tables and default user", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) NOT NULL UNIQUE,
+            password_hash VARCHAR(255) NOT NULL,
+            role VARCHAR(20) DEFAULT 'user',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            title TEXT,
+            deadline DATE,
+            duration_minutes INT,
+            priority INT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            category VARCHAR(50) DEFAULT 'General',
+            completed_at TIMESTAMP NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS daily_plan (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            task_id INT,
+            plan_date DATE,
+            scheduled_time TIME,
+            task_order INT,
+            FOREIGN KEY (task_id) REFERENCES tasks(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        """
+        INSERT INTO users (id, username, password_hash)
+        VALUES (1, 'default', 'default_hash')
+        ON DUPLICATE KEY UPDATE username=username
+        """,
+    ]),
+    (2, "Indexes for schedule and task queries", [
+        # TEXT columns can't be indexed without a prefix; status only ever holds short words
+        "ALTER TABLE tasks MODIFY status VARCHAR(20) DEFAULT 'pending'",
+        "CREATE INDEX idx_tasks_user_status_deadline ON tasks (user_id, status, deadline)",
+        "CREATE INDEX idx_daily_plan_user_date_time ON daily_plan (user_id, plan_date, scheduled_time)",
+    ]),
+    (3, "Indexes for paging GET /tasks by (deadline, id)", [
+        # InnoDB appends the primary key to every secondary index, so these cover (deadline, id)
+        "CREATE INDEX idx_tasks_user_deadline ON tasks (user_id, deadline)",
+        "CREATE INDEX idx_tasks_deadline ON tasks (deadline)",
+    ]),
+    (4, "Per-user availability: weekly template, exceptions, blackout dates", [
+        # weekday is 0 = Monday; end_time may be 24:00:00 for "until midnight"
+        """
+        CREATE TABLE IF NOT EXISTS availability_templates (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            weekday TINYINT NOT NULL,
+            start_time TIME NOT NULL,
+            end_time TIME NOT NULL,
+            INDEX idx_availability_templates_user (user_id, weekday),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        # available = 1 adds free time on that date, 0 takes it away
+        """
+        CREATE TABLE IF NOT EXISTS availability_exceptions (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            exception_date DATE NOT NULL,
+            start_time TIME NOT NULL,
+            end_time TIME NOT NULL,
+            available BOOLEAN NOT NULL,
+            INDEX idx_availability_exceptions_user_date (user_id, exception_date),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS blackout_dates (
+            user_id INT NOT NULL,
+            blackout_date DATE NOT NULL,
+            reason VARCHAR(255),
+            PRIMARY KEY (user_id, blackout_date),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+    ]),
+    (5, "Stored start and end datetimes on daily_plan", [
+        "ALTER TABLE daily_plan ADD COLUMN starts_at DATETIME NULL, ADD COLUMN ends_at DATETIME NULL",
+        """
+        UPDATE daily_plan d
+        JOIN tasks t ON t.id = d.task_id
+        SET d.starts_at = TIMESTAMP(d.plan_date, d.scheduled_time),
+            d.ends_at = TIMESTAMP(d.plan_date, d.scheduled_time) + INTERVAL COALESCE(t.duration_minutes, 0) MINUTE
+        WHERE d.scheduled_time IS NOT NULL AND d.starts_at IS NULL
+        """,
+        # The conflict check reads only the user's bookings that end after the new start
+        "CREATE INDEX idx_daily_plan_user_ends ON daily_plan (user_id, ends_at, starts_at)",
+    ]),
+    (6, "Recurring tasks", [
+        # Occurrences are expanded in recurrence.py, never stored. weekdays is a bitmask, bit 0 = Monday
+        """
+        CREATE TABLE IF NOT EXISTS recurring_tasks (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            title TEXT,
+            start_time TIME NOT NULL,
+            duration_minutes INT NOT NULL,
+            freq VARCHAR(10) NOT NULL,
+            repeat_every INT NOT NULL DEFAULT 1,
+            weekdays TINYINT NOT NULL DEFAULT 0,
+            start_date DATE NOT NULL,
+            until_date DATE NULL,
+            occurrence_count INT NULL,
+            category VARCHAR(50) DEFAULT 'General',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_recurring_tasks_user (user_id),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+    ]),
+    (7, "Pinned bookings, which the background reflow leaves alone", [
+        # 1 for slots the user picked with POST /schedule; auto-placed ones stay 0 and may move earlier
+        "ALTER TABLE daily_plan ADD COLUMN pinned BOOLEAN NOT NULL DEFAULT 0",
+    ]),
+    (8, "API tokens that name the user a request is for", [
+        # Only the SHA-256 of a token is stored; the token itself is shown once, by POST /users
+        """
+        CREATE TABLE IF NOT EXISTS api_tokens (
+            token_hash CHAR(64) PRIMARY KEY,
+            user_id INT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_api_tokens_user (user_id),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+    ]),
+    (9, "Archive tables for completed tasks and past bookings", [
+        # Rows keep their ids; only archive_jobs.py writes here (see archive.py)
+        """
+        CREATE TABLE IF NOT EXISTS tasks_archive (
+            id INT PRIMARY KEY,
+            user_id INT NOT NULL,
+            title TEXT,
+            deadline DATE,
+            duration_minutes INT,
+            priority INT,
+            status VARCHAR(20),
+            created_at TIMESTAMP NULL,
+            category VARCHAR(50),
+            completed_at TIMESTAMP NULL,
+            archived_at DATETIME NOT NULL,
+            INDEX idx_tasks_archive_user_deadline (user_id, deadline),
+            INDEX idx_tasks_archive_deadline (deadline),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        # A booking carries a copy of its task's fields, so past schedules read without a join,
+        # whether the task is still live, archived or deleted
+        """
+        CREATE TABLE IF NOT EXISTS daily_plan_archive (
+            id INT PRIMARY KEY,
+            user_id INT NOT NULL,
+            task_id INT,
+            plan_date DATE NOT NULL,
+            scheduled_time TIME,
+            starts_at DATETIME NULL,
+            ends_at DATETIME NULL,
+            pinned BOOLEAN NOT NULL DEFAULT 0,
+            title TEXT,
+            duration_minutes INT,
+            priority INT,
+            deadline DATE,
+            category VARCHAR(50),
+            archived_at DATETIME NOT NULL,
+            INDEX idx_daily_plan_archive_user_date (user_id, plan_date, starts_at),
+            INDEX idx_daily_plan_archive_task (task_id),
+            INDEX idx_daily_plan_archive_date (plan_date),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        # The archive job's batches: oldest bookings first, completed tasks by completion time
+        "CREATE INDEX idx_daily_plan_date ON daily_plan (plan_date)",
+        "CREATE INDEX idx_tasks_status_completed ON tasks (status, completed_at)",
+    ]),
+    (10, "Booked minutes and bookings per user per day", [
+        # Kept up to date by every daily_plan write, in the same transaction (see day_load.py)
+        """
+        CREATE TABLE IF NOT EXISTS day_load (
+            user_id INT NOT NULL,
+            plan_date DATE NOT NULL,
+            booked_minutes INT NOT NULL DEFAULT 0,
+            bookings INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, plan_date),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        # Archived bookings count too; archiving moves a booking, it doesn't cancel it
+        """
+        INSERT INTO day_load (user_id, plan_date, booked_minutes, bookings)
+        SELECT user_id, plan_date, SUM(minutes), COUNT(*) FROM (
+            SELECT user_id, plan_date, COALESCE(TIMESTAMPDIFF(MINUTE, starts_at, ends_at), 0) AS minutes
+            FROM daily_plan WHERE plan_date IS NOT NULL
+            UNION ALL
+            SELECT user_id, plan_date, COALESCE(TIMESTAMPDIFF(MINUTE, starts_at, ends_at), 0)
+            FROM daily_plan_archive
+        ) bookings
+        GROUP BY user_id, plan_date
+        """,
+    ]),
+]
+
+# Named lock so several workers starting at once don't run the same migration twice
+LOCK_NAME = "smartplanner_migrations"
+
+
+def current_version(cur) -> int:
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cur.fetchone()[0]
+
+
+def migrate():
+    """Apply pending migrations. Returns the schema version afterwards."""
+    if db.DB_DRIVER == "sqlite":
+        # The embedded backend creates its tables at the current version when first opened
+        import db_sqlite
+        db_sqlite.get_database()
+        return db_sqlite.SCHEMA_VERSION
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT GET_LOCK(%s, 30)", (LOCK_NAME,))
+        if cur.fetchone()[0] != 1:
+            raise RuntimeError("Timed out waiting for the migration lock")
+        try:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            version = current_version(cur)
+            for number, description, statements in MIGRATIONS:
+                if number <= version:
+                    continue
+                logger.info("Applying migration %s: %s", number, description)
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (number, description)
+                )
+                conn.commit()
+                version = number
+            return version
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cur.fetchone()
+            cur.close()
+
+
+def migrate_on_start():
+    """migrate() at server start, unless AUTO_MIGRATE=0. Errors are logged, not raised."""
+    if os.getenv("AUTO_MIGRATE", "1") != "1":
+        return
+    try:
+        migrate()
+    except Exception as e:
+        # Keep starting; /init-db can retry once the database is reachable
+        logger.error("Migration error: %s", e)
+
+
+# The queries the schedule endpoints run most, with sample parameters for EXPLAIN
+HOT_QUERIES = [
+    ("busy time for the slot finder", """
+        SELECT plan_date, starts_at, ends_at
+        FROM daily_plan
+        WHERE user_id = %s AND plan_date >= %s AND plan_date <= %s AND starts_at IS NOT NULL
+    """, (1, "2025-01-06", "2025-01-13")),
+    ("conflict check for POST /schedule", """
+        SELECT EXISTS (
+            SELECT 1 FROM daily_plan
+            WHERE user_id = %s AND ends_at > %s AND starts_at < %s AND task_id <> %s
+        )
+    """, (1, "2025-01-06 17:00:00", "2025-01-06 17:30:00", 1)),
+    ("GET /schedule/{date}", """
+        SELECT t.id, t.title, d.starts_at, d.ends_at, t.duration_minutes, t.deadline
+        FROM daily_plan d
+        JOIN tasks t ON t.id = d.task_id
+        WHERE d.user_id = %s AND d.plan_date = %s AND d.scheduled_time IS NOT NULL
+        ORDER BY d.scheduled_time ASC
+    """, (1, "2025-01-06")),
+    ("GET /schedule/week/{week_start}", """
+        SELECT d.plan_date, t.id, t.title, d.starts_at, d.ends_at, t.duration_minutes, t.deadline
+        FROM daily_plan d
+        JOIN tasks t ON t.id = d.task_id
+        WHERE d.user_id = %s AND d.plan_date >= %s AND d.plan_date <= %s AND d.scheduled_time IS NOT NULL
+        ORDER BY d.plan_date ASC, d.scheduled_time ASC
+    """, (1, "2025-01-06", "2025-01-12")),
+    ("pending tasks for /generate-plan", """
+        SELECT t.id, t.title, t.deadline, t.duration_minutes, t.priority, t.category
+        FROM tasks t
+        WHERE t.user_id = %s AND t.status = 'pending'
+        ORDER BY t.deadline ASC
+    """, (1,)),
+    ("GET /tasks page for one user", """
+        SELECT id, title, deadline, duration_minutes, status FROM tasks
+        WHERE user_id = %s AND (deadline > %s OR (deadline = %s AND id > %s))
+        ORDER BY deadline ASC, id ASC LIMIT %s
+    """, (1, "2025-01-06", "2025-01-06", 0, 101)),
+    ("GET /tasks page across users", """
+        SELECT id, title, deadline, duration_minutes, status FROM tasks
+        WHERE (deadline > %s OR (deadline = %s AND id > %s))
+        ORDER BY deadline ASC, id ASC LIMIT %s
+    """, ("2025-01-06", "2025-01-06", 0, 101)),
+    ("booked minutes per day for the slot finder and GET /plan/load", """
+        SELECT plan_date, booked_minutes, bookings FROM day_load
+        WHERE user_id = %s AND plan_date >= %s AND plan_date <= %s
+    """, (1, "2025-01-06", "2025-01-13")),
+    ("reschedule / unschedule by task", """
+        SELECT id FROM daily_plan WHERE task_id = %s
+    """, (1,)),
+    ("archived bookings for past schedule reads", """
+        SELECT plan_date, task_id, title, starts_at, ends_at, duration_minutes, priority, deadline, category
+        FROM daily_plan_archive
+        WHERE user_id = %s AND plan_date >= %s AND plan_date <= %s
+        ORDER BY plan_date ASC, starts_at ASC
+    """, (1, "2024-01-01", "2024-01-07")),
+    ("archive job: next batch of old bookings", """
+        SELECT id, plan_date FROM daily_plan WHERE plan_date < %s ORDER BY plan_date ASC, id ASC LIMIT %s
+    """, ("2024-10-01", 500)),
+    ("archive job: next batch of completed tasks", """
+        SELECT t.id FROM tasks t
+        WHERE t.status = 'completed' AND t.completed_at < %s
+          AND NOT EXISTS (SELECT 1 FROM daily_plan d WHERE d.task_id = t.id)
+        ORDER BY t.completed_at ASC, t.id ASC LIMIT %s
+    """, ("2024-10-01 00:00:00", 500)),
+]
+
+
+def explain_hot_queries():
+    """EXPLAIN each hot query. Returns (name, table, access type, key, rows) for every plan row."""
+    report = []
+    with connection() as conn:
+        cur = conn.cursor(dictionary=True)
+        for name, sql, params in HOT_QUERIES:
+            cur.execute("EXPLAIN " + sql, params)
+            for row in cur.fetchall():
+                report.append((name, row["table"], row["type"], row["key"], row["rows"]))
+        cur.close()
+    return report
+
+
+def main(argv):
+    if argv[1:] == ["explain"]:
+        full_scans = 0
+        for name, table, access, key, rows in explain_hot_queries():
+            # type ALL means MySQL reads every row of the table
+            flag = "FULL SCAN" if access == "ALL" else "ok"
+            full_scans += access == "ALL"
+            print(f"{flag:<10} {name:<36} {table:<4} type={access:<7} key={key} rows={rows}")
+        return 1 if full_scans else 0
+
+    print(f"Schema is at version {migrate()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,74 @@
+"""
+A bounded per-user cache for data the slot finder reads on every call.
+
+Availability (availability.py) and recurrence rules (recurrence.py) are each
+a PerUserCache around a loader, a coroutine that reads one user's data:
+
+    _cache = PerUserCache("availability", fetch)    # AVAILABILITY_CACHE_SIZE / _TTL
+    await _cache.load(cur, user_id)
+    _cache.invalidate(user_id)                      # after a write, in every worker
+
+Entries live for <NAME>_CACHE_TTL seconds (default 60), and at most
+<NAME>_CACHE_SIZE (default 1024) are kept, least recently used dropped
+first. invalidate() sends "<name>.invalidate" on the shared bus, so every
+worker drops its copy (see shared.py); a bus "reset" clears the whole cache.
+
+Each drop bumps a generation, per user and for the whole cache. load() notes
+both before it runs the loader and doesn't store the result if either
+moved, so a load that raced a write can't keep the old data for a whole TTL.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from shared import bus
+
+
+class PerUserCache:
+    """user_id -> loader(cur, user_id), cached with a TTL and an LRU bound."""
+
+    def __init__(self, name: str, loader, size: int = None, ttl: float = None):
+        self.name = name
+        self.loader = loader
+        prefix = name.upper()
+        self.size = size if size is not None else int(os.getenv(f"{prefix}_CACHE_SIZE", "1024"))
+        self.ttl = ttl if ttl is not None else float(os.getenv(f"{prefix}_CACHE_TTL", "60"))
+        self._entries = OrderedDict()  # user_id -> (value, loaded_at), most recently used on the right
+        self._lock = threading.Lock()
+        self._generations = {}  # user_id -> drops of that user
+        self._generation = 0  # drops of the whole cache
+        bus.on(f"{name}.invalidate", self._drop)
+        bus.on("reset", self._clear)
+
+    def invalidate(self, user_id: int):
+        """Drop the user's entry here and in every other worker."""
+        bus.publish(f"{self.name}.invalidate", user_id)
+
+    def _drop(self, user_id, seq):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def _clear(self, payload, seq):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    async def load(self, cur, user_id: int):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self._entries.move_to_end(user_id)
+                return entry[0]
+            generation = self._generation, self._generations.get(user_id, 0)
+
+        value = await self.loader(cur, user_id)
+        with self._lock:
+            if (self._generation, self._generations.get(user_id, 0)) != generation:
+                return value
+            self._entries[user_id] = (value, time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return value
@@ -0,0 +1,182 @@
+"""
+Recurring tasks: RRULE-style rules expanded lazily.
+
+A rule repeats a block of `duration` minutes at a fixed start time, DAILY or
+WEEKLY on a set of weekdays, every `every` days or weeks from dtstart, until
+a date, for `count` occurrences, or forever. Occurrences are never stored:
+readers and the slot finder call occurrences(first_day, last_day), which
+jumps straight to the window and walks only the dates inside it, so an
+open-ended rule costs the same as a one-week one. (A rule with a count walks
+from dtstart, since the n-th date depends on the ones before it, but count is
+capped at MAX_COUNT.)
+
+The slot finder reserves every occurrence in its window as busy time, one
+precomputed day mask per rule, so one-off tasks are placed around them.
+
+Rules are cached per user like availability (see per_user_cache.py), for
+RECURRENCE_CACHE_TTL seconds and dropped by invalidate() in every worker
+when they change, so the slot finder normally runs no extra query.
+"""
+import heapq
+from datetime import date, timedelta
+
+from availability import busy_mask, to_minutes, to_time
+from per_user_cache import PerUserCache
+
+FREQUENCIES = ("daily", "weekly")
+WEEKDAY_CODES = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+MAX_COUNT = 1000
+
+
+def parse_weekdays(value: str) -> int:
+    """RRULE BYDAY list ("MO,WE,FR") -> weekday bitmask, bit 0 = Monday."""
+    mask = 0
+    for code in value.upper().replace(" ", "").split(","):
+        if code not in WEEKDAY_CODES:
+            raise ValueError(f"Invalid weekday: {code}. Use {','.join(WEEKDAY_CODES)}")
+        mask |= 1 << WEEKDAY_CODES.index(code)
+    return mask
+
+
+def format_weekdays(mask: int) -> str:
+    return ",".join(code for index, code in enumerate(WEEKDAY_CODES) if mask >> index & 1)
+
+
+class Recurrence:
+    def __init__(self, rule_id, title, start, duration, freq, every, weekdays, dtstart: date,
+                 until: date = None, count: int = None, category=None):
+        self.id = rule_id
+        self.title = title
+        self.start = start  # minutes after midnight
+        self.duration = duration
+        self.freq = freq
+        self.every = every
+        # Weekly rules default to dtstart's weekday, like RRULE without BYDAY
+        self.weekdays = weekdays or 1 << dtstart.weekday()
+        self.dtstart = dtstart
+        self.until = until
+        self.count = count
+        self.category = category
+        self.mask = busy_mask(start, start + duration)
+
+    def _dates(self, start: date):
+        """Every occurrence on or after start (>= dtstart), without end."""
+        if self.freq == "daily":
+            steps = -(-(start - self.dtstart).days // self.every)
+            day = self.dtstart + timedelta(days=steps * self.every)
+            step = timedelta(days=self.every)
+            while True:
+                yield day
+                day += step
+        first_monday = self.dtstart - timedelta(days=self.dtstart.weekday())
+        # The first week on the rule's cycle that doesn't end before start
+        weeks = (start - first_monday).days // 7
+        monday = first_monday + timedelta(weeks=-(-weeks // self.every) * self.every)
+        weekdays = [weekday for weekday in range(7) if self.weekdays >> weekday & 1]
+        step = timedelta(weeks=self.every)
+        while True:
+            for weekday in weekdays:
+                day = monday + timedelta(days=weekday)
+                if day >= start:
+                    yield day
+            monday += step
+
+    def occurrences(self, first_day: date, last_day: date):
+        """Occurrence dates in [first_day, last_day], in order."""
+        if self.until is not None:
+            last_day = min(last_day, self.until)
+        if max(first_day, self.dtstart) > last_day:
+            return
+        if self.count is not None:
+            for index, day in enumerate(self._dates(self.dtstart)):
+                if index >= self.count or day > last_day:
+                    return
+                if day >= first_day:
+                    yield day
+            return
+        for day in self._dates(max(first_day, self.dtstart)):
+            if day > last_day:
+                return
+            yield day
+
+    def entry(self, day: date):
+        """An occurrence as a schedule entry, alongside the one-off tasks."""
+        return {
+            "task_id": None,
+            "recurring_id": self.id,
+            "title": self.title,
+            "start_time": to_time(self.start).strftime('%H:%M'),
+            "end_time": to_time(self.start + self.duration).strftime('%H:%M'),
+            "duration": self.duration,
+            "due_date": str(day),
+            "category": self.category,
+        }
+
+    def describe(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "start_time": to_time(self.start).strftime('%H:%M'),
+            "duration": self.duration,
+            "freq": self.freq,
+            "every": self.every,
+            "weekdays": format_weekdays(self.weekdays) if self.freq == "weekly" else None,
+            "start_date": str(self.dtstart),
+            "until": str(self.until) if self.until else None,
+            "count": self.count,
+            "category": self.category,
+        }
+
+
+def on_day(rules, day: date):
+    """The rules with an occurrence on day, by start time."""
+    return sorted((rule for rule in rules if next(rule.occurrences(day, day), None)), key=lambda rule: rule.start)
+
+
+def _dated(rule, first_day: date, last_day: date):
+    for day in rule.occurrences(first_day, last_day):
+        yield day, rule
+
+
+def in_range(rules, first_day: date, last_day: date):
+    """(day, rule) for every occurrence in [first_day, last_day], by date and start time, lazily."""
+    return heapq.merge(*(_dated(rule, first_day, last_day) for rule in rules),
+                       key=lambda pair: (pair[0], pair[1].start))
+
+
+def conflicts(rules, day: date, start: int, end: int):
+    """The first rule with an occurrence on day overlapping [start, end) minutes, or None."""
+    for rule in on_day(rules, day):
+        if rule.start < end and start < rule.start + rule.duration:
+            return rule
+    return None
+
+
+async def fetch(cur, user_id: int):
+    """The user's rules straight from the database."""
+    await cur.execute("""
+        SELECT id, title, start_time, duration_minutes, freq, repeat_every, weekdays,
+               start_date, until_date, occurrence_count, category
+        FROM recurring_tasks WHERE user_id = %s ORDER BY id
+    """, (user_id,))
+    return [
+        Recurrence(rule_id, title, to_minutes(start_time), duration, freq, every, weekdays,
+                   start_date, until_date, count, category)
+        for rule_id, title, start_time, duration, freq, every, weekdays, start_date, until_date, count, category
+        in await cur.fetchall()
+    ]
+
+
+_cache = PerUserCache("recurrence", fetch)
+
+
+def invalidate(user_id: int):
+    """Drop the user's cached rules here and in every other worker (see shared.py)."""
+    _cache.invalidate(user_id)
+
+
+async def load(cur, user_id: int = None):
+    """The user's recurrence rules, from the cache or fetch()."""
+    if user_id is None:
+        return []
+    return await _cache.load(cur, user_id)
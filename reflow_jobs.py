@@ -0,0 +1,142 @@
+"""
+Background reflow after deletes and unschedules.
+
+DELETE /tasks/{id} and DELETE /schedule/{id} free time but don't wait for
+anything to move into it: they call queue.schedule(user_id, days), which
+adds the freed days to the user's dirty set and returns a job id at once.
+A worker task (started from the API's lifespan) waits REFLOW_DELAY_MS so a
+burst of deletes collapses into one job per user, then runs
+store.reflow_user, which looks only at the bookings from the earliest dirty
+day to REFLOW_HORIZON_DAYS after it (at most REFLOW_MAX_TASKS) and moves
+each one into earlier free time if any fits (see scheduler.reflow).
+
+A job is queued, running, done or failed; the last REFLOW_JOB_HISTORY jobs
+with their wait and run times are served at GET /reflow/jobs. Jobs are
+per process and not persisted: a restart drops queued ones, which only
+means tasks stay where they were until the next delete.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import db
+import events
+import store
+from cache import schedule_cache
+
+ENABLED = os.getenv("REFLOW_ENABLED", "1") == "1"
+DELAY = float(os.getenv("REFLOW_DELAY_MS", "200")) / 1000
+HORIZON_DAYS = int(os.getenv("REFLOW_HORIZON_DAYS", "14"))
+MAX_TASKS = int(os.getenv("REFLOW_MAX_TASKS", "200"))
+JOB_HISTORY = int(os.getenv("REFLOW_JOB_HISTORY", "200"))
+
+logger = logging.getLogger("smartplanner.reflow")
+
+
+class ReflowQueue:
+    def __init__(self):
+        self._pending = OrderedDict()  # user_id -> queued job, oldest first
+        self._jobs = OrderedDict()  # job id -> job, newest last
+        self._ids = itertools.count(1)
+        self._wakeup = None
+        self._worker = None
+        self._stats = {"scheduled": 0, "coalesced": 0, "completed": 0, "failed": 0, "tasks_moved": 0}
+
+    def schedule(self, user_id: int, days):
+        """Mark days of the user dirty. Returns the id of the job that will reflow them, or None."""
+        days = set(days)
+        if not ENABLED or not days:
+            return None
+        job = self._pending.get(user_id)
+        if job is not None:
+            job["days"].update(days)
+            self._stats["coalesced"] += 1
+            return job["id"]
+
+        job = {
+            "id": next(self._ids),
+            "user_id": user_id,
+            "status": "queued",
+            "days": days,
+            "queued_at": time.time(),
+            "wait_ms": None,
+            "run_ms": None,
+            "candidates": None,
+            "moved": [],
+            "error": None,
+        }
+        self._pending[user_id] = job
+        self._jobs[job["id"]] = job
+        while len(self._jobs) > JOB_HISTORY:
+            self._jobs.popitem(last=False)
+        self._stats["scheduled"] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job["id"]
+
+    async def _run(self, job):
+        job["status"] = "running"
+        job["wait_ms"] = round((time.time() - job["queued_at"]) * 1000, 1)
+        started = time.perf_counter()
+        try:
+            result = await db.run(store.reflow_user, job["user_id"], sorted(job["days"]), HORIZON_DAYS, MAX_TASKS)
+            if result["changed_days"]:
+                schedule_cache.invalidate_days(job["user_id"], result["changed_days"])
+                events.hub.publish(job["user_id"], "schedule.reflowed", None, result["changed_days"])
+            job.update(status="done", candidates=result["candidates"], moved=result["moved"])
+            self._stats["completed"] += 1
+            self._stats["tasks_moved"] += len(result["moved"])
+        except Exception as e:
+            job.update(status="failed", error=str(e))
+            self._stats["failed"] += 1
+            logger.exception("Reflow job %s for user %s failed", job["id"], job["user_id"])
+        finally:
+            job["run_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def work(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Let a burst of deletes land in the same job
+            await asyncio.sleep(DELAY)
+            while self._pending:
+                _, job = self._pending.popitem(last=False)
+                await self._run(job)
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        if self._pending:
+            self._wakeup.set()
+        self._worker = asyncio.create_task(self.work())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    @staticmethod
+    def _public(job):
+        return {**job, "days": sorted(str(day) for day in job["days"])}
+
+    def job(self, job_id: int):
+        job = self._jobs.get(job_id)
+        return self._public(job) if job is not None else None
+
+    def status(self, limit: int = 50):
+        jobs = list(self._jobs.values())[-limit:]
+        return {
+            "enabled": ENABLED,
+            "queued": len(self._pending),
+            **self._stats,
+            "jobs": [self._public(job) for job in reversed(jobs)],
+        }
+
+
+queue = ReflowQueue()
@@ -0,0 +1,52 @@
+"""
+Fast JSON path for the list endpoints (JSON_FAST_PATH=1).
+
+Normally a list endpoint returns plain dicts, and FastAPI validates them
+against the endpoint's response model. It then turns them into JSON-able
+Python objects and json.dumps the result. That is three passes over every
+row, all in Python. With JSON_FAST_PATH=1, GET /tasks, GET /schedule/{date},
+GET /schedule/week/{week_start} and GET /plan/week return a FastJSONResponse
+instead. FastAPI passes it through untouched, and it encodes the content in
+one call. GET /tasks also leaves dates as date objects rather than
+formatting them row by row, since the encoder writes them as YYYY-MM-DD
+itself.
+
+orjson does the encoding when it is installed (`pip install orjson`).
+Without it, the stdlib json module does, which is slower than orjson but
+still skips FastAPI's passes. The response body is the same either way,
+and the same as without the fast path. The response model is still what
+/docs shows, but it isn't checked per response, so it is opt-in.
+
+    python benchmarks/bench_json.py   # rows/sec and memory per response, each path
+"""
+import json
+import os
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FAST_JSON = os.getenv("JSON_FAST_PATH", "0") == "1"
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    # default=str writes dates as YYYY-MM-DD, like orjson
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def task_rows(rows):
+    """GET /tasks rows (id, title, deadline, duration, status) as response items, dates left for the encoder."""
+    return [
+        {"id": task_id, "title": title, "due_date": deadline, "duration": duration, "status": status}
+        for task_id, title, deadline, duration, status in rows
+    ]
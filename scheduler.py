@@ -0,0 +1,448 @@
+import os
+from datetime import date, datetime, time, timedelta
+
+import availability
+import day_load
+import recurrence
+from availability import SLOT_MINUTES, busy_mask, first_run, to_time
+
+# How many days find_available_slot looks at: the start day plus the next 7
+SEARCH_DAYS = 8
+# Where auto_schedule_task puts a new task: "earliest" free slot from where the search starts,
+# or on the "lightest" days before its deadline, the ones with the least time booked (see day_load.py)
+PLACEMENT = os.getenv("SCHEDULE_PLACEMENT", "earliest")
+
+
+class BusyCalendar:
+    """
+    Busy time for a date window as one bitmap per day (see availability.py),
+    loaded from daily_plan's stored starts_at/ends_at in a single query, plus
+    the user's availability and the occurrences of their recurring tasks.
+    """
+
+    def __init__(self, first_day: date, last_day: date, user_availability=availability.DEFAULT):
+        self.first_day = first_day
+        self.last_day = last_day
+        self.availability = user_availability
+        self.busy = {}
+
+    @classmethod
+    async def load(cls, cur, first_day: date, last_day: date, user_id: int = None, exclude=()):
+        """Busy time of one user (or of everyone when user_id is None), leaving out the bookings of tasks in exclude."""
+        calendar = cls(first_day, last_day, await availability.load(cur, user_id))
+        if user_id is None:
+            await cur.execute("""
+                SELECT task_id, plan_date, starts_at, ends_at
+                FROM daily_plan
+                WHERE plan_date >= %s AND plan_date <= %s AND starts_at IS NOT NULL
+            """, (first_day, last_day))
+        else:
+            await cur.execute("""
+                SELECT task_id, plan_date, starts_at, ends_at
+                FROM daily_plan
+                WHERE user_id = %s AND plan_date >= %s AND plan_date <= %s AND starts_at IS NOT NULL
+            """, (user_id, first_day, last_day))
+        for task_id, plan_date, starts_at, ends_at in await cur.fetchall():
+            if task_id in exclude:
+                continue
+            calendar.add_booking(plan_date, starts_at, ends_at)
+        for rule in await recurrence.load(cur, user_id):
+            calendar.add_recurring(rule)
+        return calendar
+
+    async def load_days(self, cur, user_id: int, days):
+        """Add the user's bookings on the given days, with one query."""
+        marks = ", ".join(["%s"] * len(days))
+        await cur.execute(f"""
+            SELECT plan_date, starts_at, ends_at
+            FROM daily_plan
+            WHERE user_id = %s AND plan_date IN ({marks}) AND starts_at IS NOT NULL
+        """, (user_id, *days))
+        for plan_date, starts_at, ends_at in await cur.fetchall():
+            self.add_booking(plan_date, starts_at, ends_at)
+
+    def add(self, day: date, start: int, duration: int):
+        self.busy[day] = self.busy.get(day, 0) | busy_mask(start, start + duration)
+
+    def add_booking(self, day: date, starts_at: datetime, ends_at: datetime):
+        start = starts_at.hour * 60 + starts_at.minute
+        self.add(day, start, int((ends_at - starts_at).total_seconds()) // 60)
+
+    def add_recurring(self, rule):
+        """Every occurrence of a recurring task inside the window, with the rule's one precomputed mask."""
+        for day in rule.occurrences(self.first_day, self.last_day):
+            self.busy[day] = self.busy.get(day, 0) | rule.mask
+
+    def reserve(self, day: date, start_time: time, duration: int):
+        self.add(day, start_time.hour * 60 + start_time.minute, duration)
+
+    def block_before(self, now: datetime):
+        """Mark the time on now's day up to now busy, so nothing is placed in the past."""
+        self.add(now.date(), 0, now.hour * 60 + now.minute + (1 if now.second or now.microsecond else 0))
+
+    def room(self, day: date) -> int:
+        """Available minutes on day that recurring tasks leave free; bookings can't use more."""
+        return (self.availability.day_mask(day) & ~self.busy.get(day, 0)).bit_count() * SLOT_MINUTES
+
+    def slot_on(self, day: date, duration: int):
+        """First free start on day (on the SLOT_MINUTES grid) where the whole task fits, or None."""
+        free = self.availability.day_mask(day) & ~self.busy.get(day, 0)
+        start = first_run(free, max(-(-duration // SLOT_MINUTES), 1))
+        return to_time(start * SLOT_MINUTES) if start >= 0 else None
+
+    def find_slot(self, start_date: date, duration: int, days: int = SEARCH_DAYS):
+        """First free start (on the SLOT_MINUTES grid) where the whole task fits in available time."""
+        for day_offset in range(days):
+            check_date = start_date + timedelta(days=day_offset)
+            if check_date > self.last_day:
+                break
+            start_time = self.slot_on(check_date, duration)
+            if start_time is not None:
+                return check_date, start_time
+        return None, None
+
+
+def slot_bounds(day: date, start_time: time, duration: int):
+    """The (starts_at, ends_at) datetimes stored on a daily_plan row."""
+    starts_at = datetime.combine(day, start_time)
+    return starts_at, starts_at + timedelta(minutes=duration or 0)
+
+
+async def book(cur, user_id: int, task_id: int, day: date, start_time: time, duration: int, task_order: int = 1,
+               pinned: bool = False):
+    """
+    Replace the task's daily_plan row with one at day/start_time. Pinned rows
+    (chosen by the user) never reflow. Returns the days it was booked on before.
+    """
+    starts_at, ends_at = slot_bounds(day, start_time, duration)
+    removed = await day_load.remove(cur, "task_id = %s", (task_id,))
+    await cur.execute("""
+        INSERT INTO daily_plan (user_id, task_id, plan_date, scheduled_time, task_order, starts_at, ends_at, pinned)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, (user_id, task_id, day, start_time, task_order, starts_at, ends_at, pinned))
+    await day_load.adjust(cur, user_id, removed + [(day, day_load.minutes(starts_at, ends_at), 1)])
+    return day_load.days(removed)
+
+
+# Helper function to find next available time slot
+async def find_available_slot(cur, date_obj: date, duration: int, start_hour: int = 5, user_id: int = None,
+                              deadline: date = None, lightest: bool = False):
+    """
+    Find next available time slot for a task.
+    Stays inside the user's available time (by default: not during school hours,
+    Mon-Fri 8 AM - 4 PM) and avoids existing scheduled tasks.
+
+    For a user, the booked minutes of the search window come from day_load
+    first. Up to the deadline (the whole window without one), days whose
+    free time can hold the task are tried first, then the others, in case
+    their bookings overlap (a slot picked by hand outside the available
+    hours, or a recurring task added later). The days after the deadline
+    follow in the same two groups, so a day with room before the deadline
+    always wins. Days with nothing booked are searched without reading any
+    bookings. The bookings of the other days in a group are loaded with one
+    query, once one of them is reached. With lightest, the open days up to
+    the deadline are tried least booked first.
+    """
+    last_day = date_obj + timedelta(days=SEARCH_DAYS - 1)
+    if user_id is None:
+        calendar = await BusyCalendar.load(cur, date_obj, last_day, user_id)
+        return calendar.find_slot(date_obj, duration)
+
+    calendar = BusyCalendar(date_obj, last_day, await availability.load(cur, user_id))
+    for rule in await recurrence.load(cur, user_id):
+        calendar.add_recurring(rule)
+    booked = {day: minutes for day, (minutes, _) in (await day_load.read(cur, user_id, date_obj, last_day)).items()}
+
+    window = [date_obj + timedelta(days=offset) for offset in range(SEARCH_DAYS)]
+    on_time = [day for day in window if deadline is None or day <= deadline]
+    late = [day for day in window if deadline is not None and day > deadline]
+
+    def has_room(day):
+        return calendar.room(day) - booked.get(day, 0) >= duration
+
+    open_on_time = [day for day in on_time if has_room(day)]
+    if lightest:
+        open_on_time.sort(key=lambda day: (booked.get(day, 0), day))
+    groups = (
+        open_on_time,
+        [day for day in on_time if not has_room(day)],
+        [day for day in late if has_room(day)],
+        [day for day in late if not has_room(day)],
+    )
+
+    for days in groups:
+        unread = [day for day in days if booked.get(day)]
+        for day in days:
+            if booked.get(day) and unread:
+                await calendar.load_days(cur, user_id, unread)
+                unread = []
+            start_time = calendar.slot_on(day, duration)
+            if start_time is not None:
+                return day, start_time
+    return None, None
+
+
+def search_start_date(due_date: date, today: date) -> date:
+    # Start looking a week before the due date, but never in the past
+    return max(today, due_date - timedelta(days=7)) if due_date > today else today
+
+
+# Auto-schedule a task
+async def auto_schedule_task(cur, task_id: int, user_id: int, due_date_str: str, duration: int, target_date: str = None):
+    """
+    Automatically schedule a task in the next available time slot.
+
+    Runs inside the caller's transaction, which should hold the user's lock
+    (store.lock_user) and commits. Database errors propagate so the caller's
+    whole transaction rolls back.
+    """
+    try:
+        due_date = datetime.strptime(due_date_str, '%Y-%m-%d').date()
+        today = date.today()
+
+        # If target_date is provided, try to schedule on that specific date
+        if target_date:
+            try:
+                target_date_obj = datetime.strptime(target_date, '%Y-%m-%d').date()
+                schedule_date, schedule_time = await find_available_slot(cur, target_date_obj, duration, user_id=user_id)
+                if schedule_date and schedule_time:
+                    # Successfully scheduled on target date
+                    await book(cur, user_id, task_id, schedule_date, schedule_time, duration)
+                    return {
+                        "scheduled": True,
+                        "schedule_date": str(schedule_date),
+                        "schedule_time": schedule_time.strftime('%H:%M')
+                    }
+                else:
+                    # Couldn't schedule on target date, fall through to auto-schedule
+                    pass
+            except ValueError:
+                # Invalid target date, fall through to auto-schedule
+                pass
+
+        # Auto-schedule: Start looking from today, but prefer scheduling before due date
+        start_date = search_start_date(due_date, today)
+
+        schedule_date, schedule_time = await find_available_slot(
+            cur, start_date, duration, user_id=user_id, deadline=due_date, lightest=PLACEMENT == "lightest"
+        )
+
+        if schedule_date and schedule_time:
+            # Replace any existing schedule for this task
+            await book(cur, user_id, task_id, schedule_date, schedule_time, duration)
+
+            return {
+                "scheduled": True,
+                "schedule_date": str(schedule_date),
+                "schedule_time": schedule_time.strftime('%H:%M')
+            }
+        else:
+            return {"scheduled": False, "message": "No available time slot found"}
+    except ValueError as e:
+        return {"scheduled": False, "message": f"Error scheduling: {str(e)}"}
+
+
+# Auto-schedule a batch of tasks
+async def schedule_many(cur, user_id: int, tasks):
+    """
+    Place several tasks in one pass over a shared in-memory calendar.
+
+    tasks is a list of (task_id, due_date_str, duration, target_date_str or None).
+    Busy time is loaded with one query and the daily_plan rows are written with
+    one executemany; the caller commits. Returns one result per task, shaped
+    like auto_schedule_task's.
+    """
+    if not tasks:
+        return []
+
+    today = date.today()
+    wanted = []
+    for task_id, due_date_str, duration, target_date in tasks:
+        due_date = datetime.strptime(due_date_str, '%Y-%m-%d').date()
+        starts = [search_start_date(due_date, today)]
+        if target_date:
+            # Try the requested date first, then fall back to auto-schedule
+            starts.insert(0, datetime.strptime(target_date, '%Y-%m-%d').date())
+        wanted.append((task_id, duration, starts))
+
+    first_day = min(start for _, _, starts in wanted for start in starts)
+    last_day = max(start for _, _, starts in wanted for start in starts) + timedelta(days=SEARCH_DAYS - 1)
+    calendar = await BusyCalendar.load(cur, first_day, last_day, user_id)
+
+    results = []
+    rows = []
+    for task_id, duration, starts in wanted:
+        for start in starts:
+            schedule_date, schedule_time = calendar.find_slot(start, duration)
+            if schedule_date:
+                break
+        if schedule_date:
+            calendar.reserve(schedule_date, schedule_time, duration)
+            rows.append((user_id, task_id, schedule_date, schedule_time, *slot_bounds(schedule_date, schedule_time, duration)))
+            results.append({
+                "scheduled": True,
+                "schedule_date": str(schedule_date),
+                "schedule_time": schedule_time.strftime('%H:%M')
+            })
+        else:
+            results.append({"scheduled": False, "message": "No available time slot found"})
+
+    if rows:
+        await cur.executemany("""
+            INSERT INTO daily_plan (user_id, task_id, plan_date, scheduled_time, task_order, starts_at, ends_at)
+            VALUES (%s, %s, %s, %s, 1, %s, %s)
+        """, rows)
+        await day_load.adjust(cur, user_id, [(row[2], day_load.minutes(row[4], row[5]), 1) for row in rows])
+    return results
+
+
+# Build the whole week for a user in one pass
+async def plan_week(cur, user_id: int, week_start: date, today: date = None):
+    """
+    Re-plan every pending task of a user for the Monday-Sunday week starting at week_start.
+
+    Tasks are placed earliest deadline first, then highest priority, with tasks
+    of the same category kept next to each other. Each task gets the first free
+    slot on or before its deadline (school hours stay off limits). Tasks that
+    cannot make their deadline are placed afterwards in whatever time is left
+    and counted as late, so they never push out a task that could be on time.
+    Tasks already planned outside this week, and tasks with a pinned booking
+    (a slot the user picked), are left alone; pinned bookings count as busy
+    time. The new daily_plan rows are written with one executemany; the
+    caller commits.
+    """
+    today = today or date.today()
+    week_end = week_start + timedelta(days=6)
+    first_day = max(week_start, today)
+    if first_day > week_end:
+        return {"tasks_planned": 0, "late": 0, "unplanned": []}
+
+    await cur.execute("""
+        SELECT t.id, t.title, t.deadline, t.duration_minutes, t.priority, t.category
+        FROM tasks t
+        WHERE t.user_id = %s AND t.status = 'pending'
+          AND NOT EXISTS (
+              SELECT 1 FROM daily_plan d
+              WHERE d.task_id = t.id AND (d.pinned = 1 OR d.plan_date < %s OR d.plan_date > %s)
+          )
+    """, (user_id, first_day, week_end))
+    tasks = await cur.fetchall()
+    if not tasks:
+        return {"tasks_planned": 0, "late": 0, "unplanned": []}
+
+    # Clear this week's slots for the tasks being re-planned, then load what is left as busy time
+    task_ids = [task[0] for task in tasks]
+    placeholders = ", ".join(["%s"] * len(task_ids))
+    removed = await day_load.remove(
+        cur, f"plan_date >= %s AND plan_date <= %s AND task_id IN ({placeholders})", [first_day, week_end] + task_ids
+    )
+    calendar = await BusyCalendar.load(cur, first_day, week_end, user_id)
+
+    def order(task):
+        task_id, _, deadline, _, priority, category = task
+        return (deadline is None, deadline or week_end, -(priority or 1), category or "", task_id)
+
+    rows = []
+    late = []
+    unplanned = []
+
+    def place(task_id, duration, last_ok):
+        schedule_date, schedule_time = calendar.find_slot(first_day, duration, (last_ok - first_day).days + 1)
+        if schedule_date is None:
+            return False
+        calendar.reserve(schedule_date, schedule_time, duration)
+        rows.append([user_id, task_id, schedule_date, schedule_time, *slot_bounds(schedule_date, schedule_time, duration)])
+        return True
+
+    # First pass: everything that can still meet its deadline
+    for task_id, title, deadline, duration, priority, category in sorted(tasks, key=order):
+        if not duration:
+            unplanned.append({"task_id": task_id, "title": title, "reason": "Task has no duration"})
+        elif deadline is not None and deadline < first_day:
+            late.append((task_id, title, duration))
+        elif not place(task_id, duration, min(deadline or week_end, week_end)):
+            late.append((task_id, title, duration))
+
+    # Second pass: tasks that cannot make it get whatever time is left, so they don't push out on-time ones
+    late_count = 0
+    for task_id, title, duration in late:
+        if place(task_id, duration, week_end):
+            late_count += 1
+        else:
+            unplanned.append({"task_id": task_id, "title": title, "reason": "No free time left this week"})
+
+    # task_order is the position of the task within its day
+    rows.sort(key=lambda row: (row[2], row[3]))
+    for index, row in enumerate(rows):
+        same_day_before = index > 0 and rows[index - 1][2] == row[2]
+        row.append(rows[index - 1][6] + 1 if same_day_before else 1)
+
+    if rows:
+        await cur.executemany("""
+            INSERT INTO daily_plan (user_id, task_id, plan_date, scheduled_time, starts_at, ends_at, task_order, pinned)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, [(*row, False) for row in rows])
+    await day_load.adjust(cur, user_id, removed + [(row[2], day_load.minutes(row[4], row[5]), 1) for row in rows])
+
+    return {"tasks_planned": len(rows), "late": late_count, "unplanned": unplanned}
+
+
+# Pull later tasks into time that was freed up
+async def reflow(cur, user_id: int, first_day: date, horizon_days: int, max_tasks: int, now: datetime = None):
+    """
+    Move tasks booked from first_day on into earlier free time, after a
+    delete or unschedule freed some on first_day or later.
+
+    Only bookings within horizon_days of first_day are looked at, up to
+    max_tasks of them: the auto-placed (not pinned) ones of pending tasks.
+    They are taken in start order and each moves to the earliest slot that
+    fits before where it is now, no earlier than the day auto_schedule_task
+    would start searching from for its deadline, and never before now. Taking
+    them in order lets a move free time for the ones after it without any
+    task being displaced. Busy time is loaded with one query; the caller
+    holds the user's lock and commits. Returns the moves and the days they
+    touched.
+    """
+    now = now or datetime.now()
+    today = now.date()
+    first_day = max(first_day, today)
+    last_day = first_day + timedelta(days=horizon_days)
+
+    await cur.execute("""
+        SELECT d.task_id, d.plan_date, d.starts_at, d.ends_at, t.deadline
+        FROM daily_plan d
+        JOIN tasks t ON t.id = d.task_id
+        WHERE d.user_id = %s AND d.plan_date >= %s AND d.plan_date <= %s
+          AND d.starts_at IS NOT NULL AND d.pinned = 0 AND t.status = 'pending'
+        ORDER BY d.starts_at ASC
+        LIMIT %s
+    """, (user_id, first_day, last_day, max_tasks))
+    candidates = await cur.fetchall()
+    if not candidates:
+        return {"candidates": 0, "moved": [], "changed_days": []}
+
+    calendar = await BusyCalendar.load(cur, first_day, last_day, user_id, exclude={row[0] for row in candidates})
+    # Today's slots that have already passed
+    calendar.block_before(now)
+
+    moved = []
+    changed_days = set()
+    for task_id, plan_date, starts_at, ends_at, deadline in candidates:
+        duration = int((ends_at - starts_at).total_seconds()) // 60
+        earliest = max(first_day, search_start_date(deadline, today) if deadline else today)
+        new_date = new_time = None
+        if earliest <= plan_date:
+            new_date, new_time = calendar.find_slot(earliest, duration, (plan_date - earliest).days + 1)
+        if new_date is None or datetime.combine(new_date, new_time) >= starts_at:
+            calendar.add_booking(plan_date, starts_at, ends_at)
+            continue
+        calendar.reserve(new_date, new_time, duration)
+        await book(cur, user_id, task_id, new_date, new_time, duration)
+        changed_days.update((plan_date, new_date))
+        moved.append({
+            "task_id": task_id,
+            "from": starts_at.strftime('%Y-%m-%d %H:%M'),
+            "to": f"{new_date} {new_time.strftime('%H:%M')}",
+        })
+
+    return {"candidates": len(candidates), "moved": moved, "changed_days": sorted(changed_days)}
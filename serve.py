@@ -0,0 +1,61 @@
+"""
+Run the API under uvicorn with WEB_CONCURRENCY worker processes.
+
+    python serve.py                      # HOST, PORT, WEB_CONCURRENCY from the environment
+    WEB_CONCURRENCY=4 python serve.py
+
+With one worker this is `uvicorn api:app`. With more, uvicorn's supervisor
+starts that many processes on one listening socket, and the kernel hands
+each new connection to one of them. They share nothing in memory. Each
+worker opens its own database pool when it starts (db.start in the API's
+lifespan), and the per-worker caches and the change feed stay coherent
+through the shared state file (see shared.py). Unless they are set
+already, this script sets STATE_BACKEND=shared, SCHEDULE_CACHE=shared and
+IDEMPOTENCY_STORE=shared for them.
+
+Migrations run once here, before any worker starts, and the workers skip
+them (AUTO_MIGRATE=0), so several of them never race to apply one.
+
+Signals to the supervisor (several workers only):
+- SIGHUP: restart the workers one at a time. The others keep serving, so
+  new code or settings go live without dropping requests.
+- SIGTTIN / SIGTTOU: add or remove a worker.
+- SIGTERM / SIGINT: stop.
+
+A worker that is stopped or restarted stops accepting connections and
+gives the requests it has GRACEFUL_TIMEOUT seconds to finish. Open event
+streams count as requests. When they are cut, their clients reconnect to
+another worker and resume from their last event.
+"""
+import os
+
+import uvicorn
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+
+def main():
+    if WORKERS > 1:
+        os.environ.setdefault("STATE_BACKEND", "shared")
+        os.environ.setdefault("SCHEDULE_CACHE", "shared")
+        os.environ.setdefault("IDEMPOTENCY_STORE", "shared")
+
+    # Imported here so the settings above are in place first
+    from migrations import migrate_on_start
+    migrate_on_start()
+    os.environ["AUTO_MIGRATE"] = "0"
+
+    uvicorn.run(
+        "api:app",
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Cross-worker state for running several uvicorn workers (see serve.py).
+
+What the API keeps in memory is either a cache or a notification. That
+covers the availability, recurring task and user caches, the replica read
+pins, the archive watermark and the change feed. Each module keeps its own
+copy per process and sends changes to it through `bus`:
+
+    bus.on("availability.invalidate", handler)     # at import; handler(payload, seq)
+    bus.publish("availability.invalidate", user_id)
+
+STATE_BACKEND picks the bus:
+- local (default): one process. publish() calls the handlers right away.
+- shared: a SQLite file at STATE_PATH on local disk, used by every worker on
+  the host. publish() appends a message and runs the handlers in this
+  worker. Every worker polls the file every STATE_POLL_MS and runs the
+  handlers for the other workers' messages.
+
+Kinds registered with ordered=True (the change feed) are the exception. In
+every worker, the publishing one included, they are applied from the file
+in sequence order. That way a message's sequence number, which the change
+feed uses as its event id, means the same thing on every worker.
+
+Messages older than STATE_RETENTION seconds are deleted. A worker whose
+event loop was blocked for longer can't tell what it missed. It runs the
+"reset" handlers instead, which drop whole caches and make open event
+streams start over. The schedule cache has a shared backend of its own
+(SCHEDULE_CACHE=shared).
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+BACKEND = os.getenv("STATE_BACKEND", "local")
+PATH = os.getenv("STATE_PATH", "/tmp/smartplanner-state.sqlite3")
+POLL = float(os.getenv("STATE_POLL_MS", "50")) / 1000
+RETENTION = float(os.getenv("STATE_RETENTION", "300"))
+# Most messages one poll applies before yielding to requests
+POLL_BATCH = 1000
+
+logger = logging.getLogger("smartplanner.shared")
+
+
+class LocalBus:
+    """The bus for a single process: handlers run inside publish()."""
+
+    backend = "local"
+
+    def __init__(self):
+        # Changes with every start, so ids handed out by an earlier run don't match
+        self.epoch = format(int(time.time() * 1000), "x")
+        self.worker = f"{os.getpid()}-{secrets.token_hex(2)}"
+        self._handlers = {}  # kind -> [handler]
+        self._ordered = set()
+        self._seq = itertools.count(1)
+        # The last seq sent before this worker started; its handlers never saw those messages
+        self.first_seq = 0
+        self._stats = {"published": 0, "received": 0, "resets": 0}
+
+    def on(self, kind: str, handler, ordered: bool = False):
+        self._handlers.setdefault(kind, []).append(handler)
+        if ordered:
+            self._ordered.add(kind)
+
+    def _apply(self, kind: str, payload, seq: int):
+        for handler in self._handlers.get(kind, ()):
+            try:
+                handler(payload, seq)
+            except Exception:
+                logger.exception("Handler for %s failed", kind)
+
+    def publish(self, kind: str, payload=None) -> int:
+        """Send a message to every worker's handlers. Returns its sequence number."""
+        seq = next(self._seq)
+        self._stats["published"] += 1
+        self._apply(kind, payload, seq)
+        return seq
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self):
+        return {"backend": self.backend, "worker": self.worker, **self._stats}
+
+
+class SharedBus(LocalBus):
+    """The bus for several workers on one host, through a SQLite file."""
+
+    backend = "shared"
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages "
+            "(seq INTEGER PRIMARY KEY AUTOINCREMENT, worker TEXT, kind TEXT, payload TEXT, created_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_created ON messages (created_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('epoch', ?)", (self.epoch,))
+        self.epoch = self._conn.execute("SELECT value FROM meta WHERE name = 'epoch'").fetchone()[0]
+        # Start after the newest message, even if it was pruned already
+        row = self._conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'").fetchone()
+        self._last = self.first_seq = row[0] if row else 0
+        self._pruned_at = 0.0
+        self._poller = None
+
+    def publish(self, kind: str, payload=None) -> int:
+        encoded = json.dumps(payload, default=str)
+        with self._lock:
+            seq = self._conn.execute(
+                "INSERT INTO messages (worker, kind, payload, created_at) VALUES (?, ?, ?, ?)",
+                (self.worker, kind, encoded, time.time())
+            ).lastrowid
+        self._stats["published"] += 1
+        if kind not in self._ordered:
+            # The same JSON the other workers see, so handlers get the same types everywhere
+            self._apply(kind, json.loads(encoded), seq)
+        return seq
+
+    def poll(self) -> int:
+        """Apply the messages since the last poll. Returns how many were read."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, worker, kind, payload FROM messages WHERE seq > ? ORDER BY seq LIMIT ?",
+                (self._last, POLL_BATCH)
+            ).fetchall()
+            now = time.time()
+            if now - self._pruned_at > RETENTION / 10:
+                self._pruned_at = now
+                self._conn.execute("DELETE FROM messages WHERE created_at < ?", (now - RETENTION,))
+
+        # Sequence numbers have no holes, so one here means the messages were deleted before this worker saw them
+        if rows and rows[0][0] > self._last + 1:
+            logger.warning("Missed shared state messages %s-%s; resetting", self._last + 1, rows[0][0] - 1)
+            self._stats["resets"] += 1
+            self._apply("reset", None, rows[0][0] - 1)
+        for seq, worker, kind, payload in rows:
+            self._last = seq
+            if worker == self.worker and kind not in self._ordered:
+                continue
+            self._stats["received"] += 1
+            self._apply(kind, json.loads(payload), seq)
+        return len(rows)
+
+    async def work(self):
+        while True:
+            try:
+                while self.poll() == POLL_BATCH:
+                    await asyncio.sleep(0)
+            except Exception:
+                logger.exception("Polling %s failed", self.path)
+            await asyncio.sleep(POLL)
+
+    async def start(self):
+        self._poller = asyncio.create_task(self.work())
+
+    async def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+    def stats(self):
+        return {**super().stats(), "path": self.path, "last_seq": self._last}
+
+
+def create_bus():
+    if BACKEND == "shared":
+        return SharedBus(PATH)
+    return LocalBus()
+
+
+bus = create_bus()
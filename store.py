@@ -0,0 +1,758 @@
+"""
+Data access for the API endpoints.
+
+Every function is a coroutine that takes the connection handed out by
+db.run as its first argument, so the same code runs on either DB_DRIVER.
+Functions that write do all their work in one transaction and commit once at
+the end, so db.run can safely run them again after a deadlock. Requests the
+data can't satisfy (missing task, taken slot, ...) raise StoreError with the
+HTTP status the endpoint should answer with.
+
+Writes to a user's schedule first lock the user's row (lock_user), so two
+requests for the same user can't both see a slot as free and book it.
+Locking also tells db.read to keep that user's reads on the primary for a
+moment, so they see their own write even with replicas that lag.
+"""
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+
+import archive
+import availability
+import day_load
+import db
+import recurrence
+from scheduler import BusyCalendar, auto_schedule_task, book, schedule_many, plan_week, reflow, slot_bounds
+from availability import DEFAULT_TEMPLATE, to_minutes, to_time
+
+# Most items one POST /tasks/bulk may add, and the longest title it accepts
+MAX_BULK_TASKS = 500
+MAX_TITLE_LENGTH = 255
+
+
+class StoreError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+async def default_user_id(conn):
+    cur = conn.cursor()
+    await cur.execute("SELECT MIN(id) FROM users")
+    user_id = (await cur.fetchone())[0]
+    return user_id if user_id else 1
+
+
+async def lock_user(cur, user_id: int):
+    """
+    Lock the user's row until the transaction ends. Must be the transaction's
+    first read: InnoDB takes a REPEATABLE READ snapshot at the first plain
+    SELECT, and a snapshot from before the lock would miss the bookings of
+    whoever held it last.
+    """
+    await cur.execute("SELECT id FROM users WHERE id = %s FOR UPDATE", (user_id,))
+    if not await cur.fetchone():
+        raise StoreError(400, f"User with id {user_id} does not exist")
+    db.wrote(user_id)
+
+
+async def task_owner(conn, task_id: int, owner: int = None):
+    """
+    The task's user_id (None if it doesn't exist, or belongs to someone other
+    than owner when given), read outside the write transaction.
+    """
+    cur = conn.cursor()
+    await cur.execute("SELECT user_id FROM tasks WHERE id = %s", (task_id,))
+    task = await cur.fetchone()
+    # End this snapshot so the caller's lock_user starts a fresh transaction
+    await conn.commit()
+    if not task or owner is not None and task[0] != owner:
+        return None
+    return task[0]
+
+
+async def user_exists(conn, user_id: int) -> bool:
+    cur = conn.cursor()
+    await cur.execute("SELECT 1 FROM users WHERE id = %s", (user_id,))
+    return await cur.fetchone() is not None
+
+
+async def token_user(conn, token_hash: str):
+    """The user_id an API token belongs to, or None."""
+    cur = conn.cursor()
+    await cur.execute("SELECT user_id FROM api_tokens WHERE token_hash = %s", (token_hash,))
+    row = await cur.fetchone()
+    return row[0] if row else None
+
+
+async def create_user(conn, username: str, token_hash: str) -> int:
+    """Add a user with one API token. Returns the new user_id."""
+    cur = conn.cursor()
+    await cur.execute("SELECT id FROM users WHERE username = %s", (username,))
+    if await cur.fetchone():
+        raise StoreError(409, f"Username already taken: {username}")
+    # No password login; "!" is never a valid hash
+    await cur.execute("INSERT INTO users (username, password_hash) VALUES (%s, %s)", (username, "!"))
+    user_id = cur.lastrowid
+    await cur.execute("INSERT INTO api_tokens (token_hash, user_id) VALUES (%s, %s)", (token_hash, user_id))
+    await conn.commit()
+    return user_id
+
+
+async def delete_user(conn, user_id: int):
+    """Delete a user; tasks, bookings, availability, recurring tasks and tokens go with it."""
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+    await cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
+    await conn.commit()
+
+
+async def add_task(conn, user_id: int, title: str, due_date_str: str, duration: int, target_date: str = None):
+    """Insert a task and auto-schedule it in one transaction. Returns (task_id, schedule_result)."""
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+
+    await cur.execute(
+        "INSERT INTO tasks (user_id, title, deadline, duration_minutes, priority, status) VALUES (%s,%s,%s,%s,%s,%s)",
+        (user_id, title, due_date_str, duration, 1, 'pending')
+    )
+    task_id = cur.lastrowid
+
+    # Automatically schedule the task (to specific date if provided)
+    schedule_result = await auto_schedule_task(cur, task_id, user_id, due_date_str, duration, target_date)
+    await conn.commit()
+    return task_id, schedule_result
+
+
+async def add_tasks(conn, user_id: int, items):
+    """
+    Insert (title, duration, due_date_str, target_date) items in one transaction
+    and schedule them in one pass. Returns [(task_id, schedule_result)] in order.
+    """
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+    if not items:
+        return []
+
+    # One INSERT per task, so each id is its own lastrowid: a batched INSERT can be split
+    # into several statements, and ids need not be consecutive (auto_increment_increment)
+    task_ids = []
+    for title, duration, due_date_str, _ in items:
+        await cur.execute(
+            "INSERT INTO tasks (user_id, title, deadline, duration_minutes, priority, status) VALUES (%s,%s,%s,%s,%s,%s)",
+            (user_id, title, due_date_str, duration, 1, 'pending')
+        )
+        task_ids.append(cur.lastrowid)
+
+    schedule_results = await schedule_many(cur, user_id, [
+        (task_id, due_date_str, duration, target_date)
+        for task_id, (_, duration, due_date_str, target_date) in zip(task_ids, items)
+    ])
+    await conn.commit()
+    return list(zip(task_ids, schedule_results))
+
+
+async def list_tasks(conn, user_id: int = None, status: str = None, category: str = None,
+                     deadline_from: str = None, deadline_to: str = None, after=None, limit: int = 100):
+    """
+    One page of tasks ordered by (deadline, id), starting after the (deadline, id)
+    pair in `after`. Returns up to limit + 1 rows so the caller can tell whether
+    there is a next page.
+    """
+    where = []
+    params = []
+    if user_id is not None:
+        where.append("user_id = %s")
+        params.append(user_id)
+    if status:
+        where.append("status = %s")
+        params.append(status)
+    if category:
+        where.append("category = %s")
+        params.append(category)
+    if deadline_from:
+        where.append("deadline >= %s")
+        params.append(deadline_from)
+    if deadline_to:
+        where.append("deadline <= %s")
+        params.append(deadline_to)
+
+    if after:
+        after_deadline, after_id = after
+        # MySQL sorts NULL deadlines first, so a NULL cursor still has every dated task after it
+        if after_deadline is None:
+            where.append("((deadline IS NULL AND id > %s) OR deadline IS NOT NULL)")
+            params.append(after_id)
+        else:
+            where.append("(deadline > %s OR (deadline = %s AND id > %s))")
+            params.extend([after_deadline, after_deadline, after_id])
+
+    sql = "SELECT id, title, deadline, duration_minutes, status FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY deadline ASC, id ASC LIMIT %s"
+    # One extra row tells the caller whether there is a next page
+    params.append(limit + 1)
+
+    cur = conn.cursor()
+    await cur.execute(sql.format(table="tasks"), params)
+    rows = await cur.fetchall()
+    # Archived tasks are all completed; each table's page is in order, so the merged one is their first rows
+    if status in (None, "completed") and archive.state.tasks_archived:
+        await cur.execute(sql.format(table="tasks_archive"), params)
+        archived = await cur.fetchall()
+        if archived:
+            rows = sorted(rows + archived, key=lambda row: (row[2] is not None, row[2] or date.min, row[0]))[:limit + 1]
+    return rows
+
+
+async def schedule_task(conn, task_id: int, schedule_date_obj: date, start_time_obj: time, owner: int = None):
+    """Put a task at a fixed slot. Returns (end_time, user_id, changed_days)."""
+    user_id = await task_owner(conn, task_id, owner)
+    if user_id is None:
+        raise StoreError(404, "Task not found")
+
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+
+    # Check the task is still there (it may have been deleted before we got the lock) and get duration
+    await cur.execute("SELECT duration_minutes FROM tasks WHERE id = %s", (task_id,))
+    task = await cur.fetchone()
+    if not task:
+        raise StoreError(404, "Task not found")
+
+    duration = task[0]
+    starts_at, ends_at = slot_bounds(schedule_date_obj, start_time_obj, duration)
+
+    # Check for conflicts with any other booking of this user (the task's own old slot doesn't count)
+    await cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM daily_plan
+            WHERE user_id = %s AND ends_at > %s AND starts_at < %s AND task_id <> %s
+        )
+    """, (user_id, starts_at, ends_at, task_id))
+    if (await cur.fetchone())[0]:
+        raise StoreError(400, "Time slot conflicts with existing schedule")
+    start = to_minutes(start_time_obj)
+    rule = recurrence.conflicts(await recurrence.load(cur, user_id), schedule_date_obj, start, start + (duration or 0))
+    if rule is not None:
+        raise StoreError(400, f"Time slot conflicts with recurring task: {rule.title}")
+
+    # Replace the existing schedule for this task if any
+    changed_days = await book(cur, user_id, task_id, schedule_date_obj, start_time_obj, duration, pinned=True)
+
+    await conn.commit()
+    return ends_at.time(), user_id, changed_days + [schedule_date_obj]
+
+
+def _clock_range(starts_at, ends_at):
+    return starts_at.strftime('%H:%M'), ends_at.strftime('%H:%M')
+
+
+async def plan_rows(cur, user_id: int, first_day: date, last_day: date):
+    """
+    The user's bookings from first_day to last_day by date and start time, as
+    (plan_date, task_id, title, starts_at, ends_at, duration, priority,
+    deadline, category), including archived ones when the range reaches back
+    far enough (see archive.py).
+    """
+    await cur.execute("""
+        SELECT d.plan_date, t.id, t.title, d.starts_at, d.ends_at, t.duration_minutes, t.priority, t.deadline, t.category
+        FROM daily_plan d
+        JOIN tasks t ON t.id = d.task_id
+        WHERE d.user_id = %s AND d.plan_date >= %s AND d.plan_date <= %s AND d.scheduled_time IS NOT NULL
+        ORDER BY d.plan_date ASC, d.scheduled_time ASC
+    """, (user_id, first_day, last_day))
+    rows = await cur.fetchall()
+    if archive.state.covers(first_day):
+        archived = await archived_plan_rows(cur, user_id, first_day, last_day)
+        if archived:
+            rows = sorted(rows + archived, key=lambda row: (row[0], row[3]))
+    return rows
+
+
+async def archived_plan_rows(cur, user_id: int, first_day: date, last_day: date):
+    """plan_rows from daily_plan_archive only."""
+    await cur.execute("""
+        SELECT plan_date, task_id, title, starts_at, ends_at, duration_minutes, priority, deadline, category
+        FROM daily_plan_archive
+        WHERE user_id = %s AND plan_date >= %s AND plan_date <= %s AND scheduled_time IS NOT NULL
+        ORDER BY plan_date ASC, starts_at ASC
+    """, (user_id, first_day, last_day))
+    return await cur.fetchall()
+
+
+async def day_schedule(conn, user_id: int, schedule_date_obj: date):
+    cur = conn.cursor()
+    result = []
+    for _, task_id, title, starts_at, ends_at, duration, _, deadline, _ in await plan_rows(cur, user_id, schedule_date_obj, schedule_date_obj):
+        start, end = _clock_range(starts_at, ends_at)
+        result.append({
+            "task_id": task_id,
+            "title": title,
+            "start_time": start,
+            "end_time": end,
+            "duration": duration,
+            "due_date": str(deadline)
+        })
+
+    occurrences = [rule.entry(schedule_date_obj) for rule in recurrence.on_day(await recurrence.load(cur, user_id), schedule_date_obj)]
+    if occurrences:
+        result = sorted(result + occurrences, key=lambda entry: entry["start_time"])
+    return result
+
+
+async def week_schedule(conn, user_id: int, monday: date):
+    week_end = monday + timedelta(days=6)
+
+    cur = conn.cursor()
+    rows = await plan_rows(cur, user_id, monday, week_end)
+
+    # Organize by day
+    week_schedule = {}
+    for offset in range(7):
+        week_schedule[str(monday + timedelta(days=offset))] = []
+
+    for plan_date, task_id, title, starts_at, ends_at, duration, _, deadline, _ in rows:
+        date_str = str(plan_date)
+        if date_str in week_schedule:
+            start, end = _clock_range(starts_at, ends_at)
+            week_schedule[date_str].append({
+                "task_id": task_id,
+                "title": title,
+                "start_time": start,
+                "end_time": end,
+                "duration": duration,
+                "due_date": str(deadline)
+            })
+
+    merged = set()
+    for rule in await recurrence.load(cur, user_id):
+        for day in rule.occurrences(monday, week_end):
+            week_schedule[str(day)].append(rule.entry(day))
+            merged.add(str(day))
+    for date_str in merged:
+        week_schedule[date_str].sort(key=lambda entry: entry["start_time"])
+    return week_schedule
+
+
+async def export_schedule(conn, user_id: int, first_day: date, last_day: date, batch_size: int = 500):
+    """
+    The user's bookings from first_day to last_day, oldest first, yielded in
+    lists of about batch_size rows of (plan_date, task_id, title, starts_at,
+    ends_at, duration, deadline, category, recurring_id). Run it with
+    db.stream: the cursor is unbuffered and the ORDER BY follows
+    idx_daily_plan_user_date_time, so MySQL sends rows as it reads them and
+    neither side holds the whole range. Archived bookings come first; they are
+    older than the live ones, except for a day the archive job is part way
+    through.
+
+    Occurrences of recurring tasks are merged in by start time, expanded from
+    the rules like the schedule reads do, with task_id None and the rule's id
+    as recurring_id. Task bookings have recurring_id None.
+    """
+    cur = conn.cursor(unbuffered=True)
+    # Loaded before the export query starts: on a cache miss it runs one of its own
+    occurrences = _occurrence_rows(await recurrence.load(cur, user_id), first_day, last_day)
+    pending = next(occurrences, None)
+
+    def merge(rows):
+        nonlocal pending
+        merged = []
+        for row in rows:
+            while pending is not None and pending[3] <= row[3]:
+                merged.append(pending)
+                pending = next(occurrences, None)
+            merged.append(row)
+        return merged
+
+    if archive.state.covers(first_day):
+        await cur.execute("""
+            SELECT plan_date, task_id, title, starts_at, ends_at, duration_minutes, deadline, category, NULL
+            FROM daily_plan_archive
+            WHERE user_id = %s AND plan_date >= %s AND plan_date <= %s AND scheduled_time IS NOT NULL
+            ORDER BY plan_date ASC, starts_at ASC
+        """, (user_id, first_day, last_day))
+        while True:
+            rows = await cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield merge(rows)
+    await cur.execute("""
+        SELECT d.plan_date, t.id, t.title, d.starts_at, d.ends_at, t.duration_minutes, t.deadline, t.category, NULL
+        FROM daily_plan d
+        JOIN tasks t ON t.id = d.task_id
+        WHERE d.user_id = %s AND d.plan_date >= %s AND d.plan_date <= %s AND d.scheduled_time IS NOT NULL
+        ORDER BY d.plan_date ASC, d.scheduled_time ASC
+    """, (user_id, first_day, last_day))
+    while True:
+        rows = await cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield merge(rows)
+    rows = [pending, *islice(occurrences, batch_size - 1)] if pending is not None else []
+    while rows:
+        yield rows
+        rows = list(islice(occurrences, batch_size))
+
+
+def _occurrence_rows(rules, first_day: date, last_day: date):
+    """Export rows for the rules' occurrences in the range, by start, lazily."""
+    for day, rule in recurrence.in_range(rules, first_day, last_day):
+        starts_at, ends_at = slot_bounds(day, to_time(rule.start), rule.duration)
+        yield day, None, rule.title, starts_at, ends_at, rule.duration, day, rule.category, rule.id
+
+
+async def generate_plan(conn, user_id: int, monday: date):
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+    result = await plan_week(cur, user_id, monday)
+    await conn.commit()
+    return result
+
+
+async def reflow_user(conn, user_id: int, dirty_days, horizon_days: int, max_tasks: int):
+    """Move the user's later tasks into time freed on dirty_days (see scheduler.reflow)."""
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+    result = await reflow(cur, user_id, min(dirty_days), horizon_days, max_tasks)
+    await conn.commit()
+    return result
+
+
+async def week_plan(conn, user_id: int, monday: date):
+    """The week as a list of days, the shape schedule.html reads."""
+    cur = conn.cursor()
+    rows = await plan_rows(cur, user_id, monday, monday + timedelta(days=6))
+
+    days = {}
+    for offset in range(7):
+        day = monday + timedelta(days=offset)
+        days[day] = {"date": str(day), "day_name": day.strftime('%A'), "tasks": [], "total_minutes": 0}
+
+    for plan_date, task_id, title, starts_at, ends_at, duration, priority, deadline, category in rows:
+        day = days.get(plan_date)
+        if day is None:
+            continue
+        start, end = _clock_range(starts_at, ends_at)
+        day["tasks"].append({
+            "task_id": task_id,
+            "title": title,
+            "start_time": start,
+            "end_time": end,
+            "duration": duration,
+            "priority": priority,
+            "deadline": str(deadline),
+            "category": category
+        })
+        day["total_minutes"] += duration or 0
+
+    merged = set()
+    for rule in await recurrence.load(cur, user_id):
+        for occurrence in rule.occurrences(monday, monday + timedelta(days=6)):
+            day = days[occurrence]
+            entry = rule.entry(occurrence)
+            del entry["due_date"]
+            day["tasks"].append({**entry, "priority": None, "deadline": None})
+            day["total_minutes"] += rule.duration
+            merged.add(occurrence)
+    for occurrence in merged:
+        days[occurrence]["tasks"].sort(key=lambda task: task["start_time"])
+
+    return list(days.values())
+
+
+async def day_loads(conn, user_id: int, first_day: date, last_day: date):
+    """
+    Booked minutes and bookings for every day in the range, from day_load,
+    next to the minutes the user's availability leaves free of recurring tasks.
+    """
+    cur = conn.cursor()
+    loads = await day_load.read(cur, user_id, first_day, last_day)
+    calendar = BusyCalendar(first_day, last_day, await availability.load(cur, user_id))
+    for rule in await recurrence.load(cur, user_id):
+        calendar.add_recurring(rule)
+
+    result = []
+    day = first_day
+    while day <= last_day:
+        booked, count = loads.get(day, (0, 0))
+        result.append({"date": str(day), "booked_minutes": booked, "bookings": count,
+                       "available_minutes": calendar.room(day)})
+        day += timedelta(days=1)
+    return result
+
+
+async def delete_task(conn, task_id: int, owner: int = None):
+    """Delete a task and its schedule. Returns (user_id, changed_days)."""
+    user_id = await task_owner(conn, task_id, owner)
+    if user_id is None:
+        raise StoreError(404, "Task not found")
+
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+
+    removed = await day_load.remove(cur, "task_id = %s", (task_id,))
+    archived = await day_load.remove(cur, "task_id = %s", (task_id,), table="daily_plan_archive")
+    await cur.execute("DELETE FROM tasks WHERE id = %s", (task_id,))
+    if cur.rowcount == 0:
+        raise StoreError(404, "Task not found")
+    await day_load.adjust(cur, user_id, removed + archived)
+    await conn.commit()
+    return user_id, day_load.days(removed)
+
+
+async def unschedule_task(conn, task_id: int, owner: int = None):
+    """Remove a task from the schedule. Returns (user_id, changed_days)."""
+    user_id = await task_owner(conn, task_id, owner)
+    if user_id is None:
+        raise StoreError(404, "Task not found in schedule")
+
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+
+    removed = await day_load.remove(cur, "task_id = %s", (task_id,))
+    if not removed:
+        raise StoreError(404, "Task not found in schedule")
+    await day_load.adjust(cur, user_id, removed)
+    await conn.commit()
+    return user_id, day_load.days(removed)
+
+
+async def complete_task(conn, task_id: int, now: datetime, owner: int = None):
+    """
+    Mark a task completed at now and drop its bookings that haven't started,
+    freeing that time. Completing a completed task changes nothing. Returns
+    (user_id, completed_at, changed_days).
+    """
+    user_id = await task_owner(conn, task_id, owner)
+    if user_id is None:
+        raise StoreError(404, "Task not found")
+
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+
+    await cur.execute("SELECT status, completed_at FROM tasks WHERE id = %s", (task_id,))
+    task = await cur.fetchone()
+    if not task:
+        raise StoreError(404, "Task not found")
+    if task[0] == "completed":
+        await conn.commit()
+        return user_id, task[1], []
+
+    removed = await day_load.remove(cur, "task_id = %s AND starts_at > %s", (task_id, now))
+    await day_load.adjust(cur, user_id, removed)
+    await cur.execute("UPDATE tasks SET status = 'completed', completed_at = %s WHERE id = %s", (now, task_id))
+    await conn.commit()
+    return user_id, now, day_load.days(removed)
+
+
+async def archive_state(conn):
+    """(newest archived plan_date or None, whether any task is archived), for archive.state."""
+    cur = conn.cursor()
+    await cur.execute("SELECT plan_date FROM daily_plan_archive ORDER BY plan_date DESC LIMIT 1")
+    row = await cur.fetchone()
+    archived_through = row[0] if row else None
+    await cur.execute("SELECT EXISTS (SELECT 1 FROM tasks_archive)")
+    tasks_archived = bool((await cur.fetchone())[0])
+    return archived_through, tasks_archived
+
+
+def _marks(values) -> str:
+    return ", ".join(["%s"] * len(values))
+
+
+async def archive_batch(conn, cutoff: date, now: datetime, limit: int):
+    """
+    Move up to limit bookings dated before cutoff, then up to limit tasks
+    completed before it that have no bookings left, into the archive tables,
+    in one short transaction. Only the rows moved are locked. Returns
+    {"bookings", "tasks", "archived_through"}.
+
+    Only bookings of completed tasks (or of none) move. A pending task's
+    booking stays live however old it is: plan_week tells booked tasks from
+    daily_plan alone, and would plan the task a second time.
+    """
+    cur = conn.cursor()
+    await cur.execute("""
+        SELECT d.id, d.plan_date FROM daily_plan d
+        WHERE d.plan_date < %s
+          AND NOT EXISTS (SELECT 1 FROM tasks t WHERE t.id = d.task_id AND t.status <> 'completed')
+        ORDER BY d.plan_date ASC, d.id ASC LIMIT %s FOR UPDATE
+    """, (cutoff, limit))
+    bookings = await cur.fetchall()
+    if bookings:
+        ids = [row[0] for row in bookings]
+        await cur.execute(f"""
+            INSERT INTO daily_plan_archive (id, user_id, task_id, plan_date, scheduled_time, starts_at, ends_at, pinned,
+                                            title, duration_minutes, priority, deadline, category, archived_at)
+            SELECT d.id, d.user_id, d.task_id, d.plan_date, d.scheduled_time, d.starts_at, d.ends_at, d.pinned,
+                   t.title, t.duration_minutes, t.priority, t.deadline, t.category, %s
+            FROM daily_plan d
+            LEFT JOIN tasks t ON t.id = d.task_id
+            WHERE d.id IN ({_marks(ids)})
+        """, (now, *ids))
+        await cur.execute(f"DELETE FROM daily_plan WHERE id IN ({_marks(ids)})", ids)
+
+    await cur.execute("""
+        SELECT t.id FROM tasks t
+        WHERE t.status = 'completed' AND t.completed_at < %s
+          AND NOT EXISTS (SELECT 1 FROM daily_plan d WHERE d.task_id = t.id)
+        ORDER BY t.completed_at ASC, t.id ASC LIMIT %s FOR UPDATE
+    """, (datetime.combine(cutoff, time()), limit))
+    task_ids = [row[0] for row in await cur.fetchall()]
+    if task_ids:
+        await cur.execute(f"""
+            INSERT INTO tasks_archive (id, user_id, title, deadline, duration_minutes, priority, status, created_at,
+                                       category, completed_at, archived_at)
+            SELECT id, user_id, title, deadline, duration_minutes, priority, status, created_at, category, completed_at, %s
+            FROM tasks WHERE id IN ({_marks(task_ids)})
+        """, (now, *task_ids))
+        await cur.execute(f"DELETE FROM tasks WHERE id IN ({_marks(task_ids)})", task_ids)
+
+    await conn.commit()
+    return {
+        "bookings": len(bookings),
+        "tasks": len(task_ids),
+        "archived_through": bookings[-1][1] if bookings else None,
+    }
+
+
+def _clock(minutes: int) -> str:
+    """Minutes after midnight as HH:MM (24:00 for midnight at the end of the day)."""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+async def get_availability(conn, user_id: int):
+    cur = conn.cursor()
+    await cur.execute(
+        "SELECT weekday, start_time, end_time FROM availability_templates WHERE user_id = %s ORDER BY weekday, start_time",
+        (user_id,)
+    )
+    template = [(weekday, to_minutes(start), to_minutes(end)) for weekday, start, end in await cur.fetchall()]
+    uses_default = not template
+    if uses_default:
+        template = [(weekday, start, end) for weekday, windows in DEFAULT_TEMPLATE.items() for start, end in windows]
+
+    await cur.execute("""
+        SELECT id, exception_date, start_time, end_time, available FROM availability_exceptions
+        WHERE user_id = %s ORDER BY exception_date, start_time
+    """, (user_id,))
+    exceptions = [{
+        "id": exception_id,
+        "date": str(exception_date),
+        "start_time": _clock(to_minutes(start)),
+        "end_time": _clock(to_minutes(end)),
+        "available": bool(available)
+    } for exception_id, exception_date, start, end, available in await cur.fetchall()]
+
+    await cur.execute(
+        "SELECT blackout_date, reason FROM blackout_dates WHERE user_id = %s ORDER BY blackout_date",
+        (user_id,)
+    )
+    blackouts = [{"date": str(blackout_date), "reason": reason} for blackout_date, reason in await cur.fetchall()]
+
+    return {
+        "uses_default": uses_default,
+        "template": [
+            {"weekday": weekday, "start_time": _clock(start), "end_time": _clock(end)}
+            for weekday, start, end in template
+        ],
+        "exceptions": exceptions,
+        "blackouts": blackouts
+    }
+
+
+async def set_availability_template(conn, user_id: int, windows):
+    """Replace the weekly template with (weekday, start_minute, end_minute) windows; none means the default."""
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+    await cur.execute("DELETE FROM availability_templates WHERE user_id = %s", (user_id,))
+    if windows:
+        await cur.executemany(
+            "INSERT INTO availability_templates (user_id, weekday, start_time, end_time) VALUES (%s, %s, %s, %s)",
+            [(user_id, weekday, _clock(start) + ":00", _clock(end) + ":00") for weekday, start, end in windows]
+        )
+    await conn.commit()
+
+
+async def add_availability_exception(conn, user_id: int, exception_date: date, start: int, end: int, available: bool):
+    """Returns the new exception's id."""
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+    await cur.execute("""
+        INSERT INTO availability_exceptions (user_id, exception_date, start_time, end_time, available)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (user_id, exception_date, _clock(start) + ":00", _clock(end) + ":00", available))
+    exception_id = cur.lastrowid
+    await conn.commit()
+    return exception_id
+
+
+async def delete_availability_exception(conn, exception_id: int, owner: int = None):
+    """Returns the user_id the exception belonged to."""
+    cur = conn.cursor()
+    await cur.execute("SELECT user_id FROM availability_exceptions WHERE id = %s", (exception_id,))
+    row = await cur.fetchone()
+    if not row or owner is not None and row[0] != owner:
+        raise StoreError(404, "Availability exception not found")
+    db.wrote(row[0])
+    await cur.execute("DELETE FROM availability_exceptions WHERE id = %s", (exception_id,))
+    await conn.commit()
+    return row[0]
+
+
+async def add_blackout(conn, user_id: int, blackout_date: date, reason: str = None):
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+    await cur.execute("DELETE FROM blackout_dates WHERE user_id = %s AND blackout_date = %s", (user_id, blackout_date))
+    await cur.execute(
+        "INSERT INTO blackout_dates (user_id, blackout_date, reason) VALUES (%s, %s, %s)",
+        (user_id, blackout_date, reason)
+    )
+    await conn.commit()
+
+
+async def delete_blackout(conn, user_id: int, blackout_date: date):
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+    await cur.execute("DELETE FROM blackout_dates WHERE user_id = %s AND blackout_date = %s", (user_id, blackout_date))
+    await conn.commit()
+    if cur.rowcount == 0:
+        raise StoreError(404, "Blackout date not found")
+
+
+async def add_recurring_task(conn, user_id: int, title: str, start: int, duration: int, freq: str, every: int,
+                             weekdays: int, start_date: date, until: date = None, count: int = None,
+                             category: str = None):
+    """Store a recurrence rule (start is minutes after midnight). Returns the rule."""
+    cur = conn.cursor()
+    await lock_user(cur, user_id)
+    await cur.execute("""
+        INSERT INTO recurring_tasks
+            (user_id, title, start_time, duration_minutes, freq, repeat_every, weekdays,
+             start_date, until_date, occurrence_count, category)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (user_id, title, _clock(start) + ":00", duration, freq, every, weekdays,
+          start_date, until, count, category or 'General'))
+    rule_id = cur.lastrowid
+    await conn.commit()
+    return recurrence.Recurrence(rule_id, title, start, duration, freq, every, weekdays, start_date, until, count,
+                                 category or 'General')
+
+
+async def list_recurring_tasks(conn, user_id: int):
+    return [rule.describe() for rule in await recurrence.fetch(conn.cursor(), user_id)]
+
+
+async def delete_recurring_task(conn, rule_id: int, owner: int = None):
+    """Delete a recurrence rule and with it every occurrence. Returns the owner's user_id."""
+    cur = conn.cursor()
+    await cur.execute("SELECT user_id FROM recurring_tasks WHERE id = %s", (rule_id,))
+    row = await cur.fetchone()
+    if row is None or owner is not None and row[0] != owner:
+        raise StoreError(404, "Recurring task not found")
+    db.wrote(row[0])
+    await cur.execute("DELETE FROM recurring_tasks WHERE id = %s", (rule_id,))
+    await conn.commit()
+    return row[0]
@@ -0,0 +1,59 @@
+"""
+Fixtures for the tests: each test gets its own in-memory database on the
+DB_DRIVER=sqlite backend (db_sqlite.Database(":memory:")), with the schema
+db_sqlite.SCHEMA and the default user 1.
+
+Store operations run on it with database.run_blocking(op, *args), the way
+db.run does. The per-user caches (availability, recurrence rules, users)
+are module level, so every database starts with a bus "reset" to clear them.
+
+    python -m pytest -q
+"""
+import os
+
+# Read at import by db.py and db_sqlite.py
+os.environ.setdefault("DB_DRIVER", "sqlite")
+os.environ.setdefault("SQLITE_PATH", ":memory:")
+
+import pytest  # noqa: E402
+
+import db_sqlite  # noqa: E402
+import store  # noqa: E402
+from cache import schedule_cache  # noqa: E402
+from shared import bus  # noqa: E402
+
+
+@pytest.fixture
+def database():
+    bus.publish("reset")
+    schedule_cache.clear()
+    return db_sqlite.Database(":memory:")
+
+
+@pytest.fixture
+def user(database):
+    """A new user with no availability template, so DEFAULT_TEMPLATE applies."""
+    return database.run_blocking(store.create_user, "tester", "token-hash")
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    """The API on the test's database."""
+    from fastapi.testclient import TestClient
+    import api
+
+    monkeypatch.setattr(db_sqlite, "_database", database)
+    with TestClient(api.app) as test_client:
+        yield test_client
+
+
+def new_task(database, user_id: int, duration: int = 30, deadline=None, title: str = "task",
+             status: str = "pending") -> int:
+    """Insert a task without scheduling it. Returns its id."""
+    with database.checkout() as raw:
+        cur = raw.execute(
+            "INSERT INTO tasks (user_id, title, deadline, duration_minutes, priority, status) VALUES (?, ?, ?, ?, 1, ?)",
+            (user_id, title, deadline, duration, status)
+        )
+        raw.commit()
+        return cur.lastrowid
@@ -0,0 +1,111 @@
+import random
+from datetime import date, timedelta
+
+import availability
+import store
+from db import drive
+from availability import SLOT_MINUTES, SLOTS_PER_DAY, Availability, busy_mask, first_run, window_mask
+from per_user_cache import PerUserCache
+
+MONDAY = date(2030, 1, 7)
+
+
+def slots(mask):
+    return [index for index in range(SLOTS_PER_DAY) if mask >> index & 1]
+
+
+def naive_first_run(free, length):
+    run = 0
+    for index in range(SLOTS_PER_DAY):
+        run = run + 1 if free >> index & 1 else 0
+        if length > 0 and run == length:
+            return index - length + 1
+    return -1
+
+
+def test_window_mask_keeps_whole_slots_only():
+    # Of minutes 7-20 only 10-15 and 15-20 are whole slots
+    assert slots(window_mask(7, 20)) == [2, 3]
+    assert window_mask(7, 9) == 0
+
+
+def test_busy_mask_blocks_every_slot_touched():
+    assert slots(busy_mask(7, 20)) == [1, 2, 3]
+    assert slots(busy_mask(24 * 60 - 1, 24 * 60 + 30)) == [SLOTS_PER_DAY - 1]
+
+
+def test_first_run_examples():
+    assert first_run(0b1110111, 3) == 0
+    assert first_run(0b1110110, 3) == 4
+    assert first_run(0b1110110, 4) == -1
+    assert first_run(0b1, 0) == -1
+    assert first_run(0, 1) == -1
+
+
+def test_first_run_matches_a_linear_scan():
+    rng = random.Random(11)
+    for _ in range(300):
+        # Long free stretches with a few holes, like a real day
+        free = window_mask(rng.randrange(0, 600), rng.randrange(600, 24 * 60))
+        for _ in range(rng.randrange(4)):
+            start = rng.randrange(24 * 60)
+            free &= ~busy_mask(start, start + rng.randrange(5, 120))
+        length = rng.randrange(1, 80)
+        assert first_run(free, length) == naive_first_run(free, length), (bin(free), length)
+
+
+def test_default_template():
+    assert slots(availability.DEFAULT.day_mask(MONDAY)) == (
+        list(range(5 * 60 // SLOT_MINUTES, 8 * 60 // SLOT_MINUTES))
+        + list(range(16 * 60 // SLOT_MINUTES, SLOTS_PER_DAY))
+    )
+    saturday = MONDAY + timedelta(days=5)
+    assert availability.DEFAULT.day_mask(saturday) == window_mask(5 * 60, 24 * 60)
+
+
+def test_time_taken_away_wins_over_time_added():
+    user = Availability(exceptions={MONDAY: [(9 * 60, 11 * 60, True), (10 * 60, 10 * 60 + 1, False)]})
+    mask = user.day_mask(MONDAY)
+    assert mask & window_mask(9 * 60, 10 * 60) == window_mask(9 * 60, 10 * 60)
+    # The minute taken away blocks its whole slot
+    assert mask & busy_mask(10 * 60, 10 * 60 + 5) == 0
+    assert mask & window_mask(10 * 60 + 5, 11 * 60) == window_mask(10 * 60 + 5, 11 * 60)
+
+
+def test_blackout_day_is_empty():
+    assert Availability(blackouts=[MONDAY]).day_mask(MONDAY) == 0
+
+
+def test_template_leaves_missing_weekdays_empty(database, user):
+    database.run_blocking(store.set_availability_template, user, [(0, 9 * 60, 12 * 60)])
+    loaded = database.run_blocking(lambda conn: availability.load(conn.cursor(), user))
+    assert loaded.day_mask(MONDAY) == window_mask(9 * 60, 12 * 60)
+    assert loaded.day_mask(MONDAY + timedelta(days=1)) == 0
+
+
+def test_invalidate_reloads(database, user):
+    async def load(conn):
+        return await availability.load(conn.cursor(), user)
+
+    database.run_blocking(load)
+    database.run_blocking(store.add_blackout, user, MONDAY)
+    # Still cached until the write's caller invalidates
+    assert database.run_blocking(load).day_mask(MONDAY) != 0
+    availability.invalidate(user)
+    assert database.run_blocking(load).day_mask(MONDAY) == 0
+
+
+def test_cache_drops_a_load_that_raced_an_invalidate():
+    loads = []
+
+    async def loader(cur, user_id):
+        loads.append(user_id)
+        if len(loads) == 1:
+            # A write lands while the first load is reading
+            cache.invalidate(user_id)
+        return len(loads)
+
+    cache = PerUserCache("racetest", loader, size=4, ttl=60)
+    assert drive(cache.load(None, 1)) == 1
+    assert drive(cache.load(None, 1)) == 2
+    assert drive(cache.load(None, 1)) == 2
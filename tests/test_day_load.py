@@ -0,0 +1,120 @@
+from datetime import date, datetime, time, timedelta
+
+import archive
+import store
+from scheduler import find_available_slot
+from tests.conftest import new_task
+
+MONDAY = date(2030, 1, 7)
+
+
+def day_load_rows(database, user_id):
+    with database.checkout() as raw:
+        rows = raw.execute(
+            "SELECT plan_date, booked_minutes, bookings FROM day_load WHERE user_id = ? AND bookings <> 0",
+            (user_id,)
+        )
+        return {plan_date: (booked, count) for plan_date, booked, count in rows}
+
+
+def counted_bookings(database, user_id):
+    """What day_load should hold: live and archived bookings per day."""
+    totals = {}
+    with database.checkout() as raw:
+        for table in ("daily_plan", "daily_plan_archive"):
+            for plan_date, starts_at, ends_at in raw.execute(
+                f"SELECT plan_date, starts_at, ends_at FROM {table} WHERE user_id = ?", (user_id,)
+            ):
+                booked, count = totals.get(plan_date, (0, 0))
+                totals[plan_date] = (booked + int((ends_at - starts_at).total_seconds()) // 60, count + 1)
+    return totals
+
+
+def assert_in_step(database, user_id):
+    assert day_load_rows(database, user_id) == counted_bookings(database, user_id)
+
+
+def test_book_move_unschedule_delete(database, user):
+    first = new_task(database, user, 30, deadline=MONDAY)
+    second = new_task(database, user, 90, deadline=MONDAY)
+    database.run_blocking(store.schedule_task, first, MONDAY, time(5, 0))
+    database.run_blocking(store.schedule_task, second, MONDAY, time(16, 0))
+    assert day_load_rows(database, user) == {MONDAY: (120, 2)}
+
+    # Within the day, then to the next day
+    database.run_blocking(store.schedule_task, first, MONDAY, time(6, 0))
+    assert_in_step(database, user)
+    database.run_blocking(store.schedule_task, first, MONDAY + timedelta(days=1), time(6, 0))
+    assert day_load_rows(database, user) == {MONDAY: (90, 1), MONDAY + timedelta(days=1): (30, 1)}
+
+    database.run_blocking(store.unschedule_task, second)
+    assert_in_step(database, user)
+    database.run_blocking(store.delete_task, first)
+    assert day_load_rows(database, user) == {}
+
+
+def test_complete_drops_only_bookings_not_started(database, user):
+    task_id = new_task(database, user, 60, deadline=MONDAY)
+    database.run_blocking(store.schedule_task, task_id, MONDAY, time(16, 0))
+    database.run_blocking(store.complete_task, task_id, datetime.combine(MONDAY, time(17, 0)))
+    assert day_load_rows(database, user) == {MONDAY: (60, 1)}
+
+    other = new_task(database, user, 60, deadline=MONDAY)
+    database.run_blocking(store.schedule_task, other, MONDAY, time(18, 0))
+    database.run_blocking(store.complete_task, other, datetime.combine(MONDAY, time(17, 0)))
+    assert day_load_rows(database, user) == {MONDAY: (60, 1)}
+
+
+def test_bulk_add_plan_week_and_reflow(database, user):
+    database.run_blocking(store.add_tasks, user, [
+        (f"bulk {index}", 45, str(MONDAY + timedelta(days=index % 5)), None) for index in range(12)
+    ])
+    assert_in_step(database, user)
+
+    for index in range(6):
+        new_task(database, user, 30 + index * 15, deadline=MONDAY + timedelta(days=index))
+    database.run_blocking(store.generate_plan, user, MONDAY)
+    assert_in_step(database, user)
+    assert sum(count for _, count in day_load_rows(database, user).values()) == 18
+
+    with database.checkout() as raw:
+        task_id, plan_date = raw.execute("SELECT task_id, plan_date FROM daily_plan ORDER BY plan_date LIMIT 1").fetchone()
+    database.run_blocking(store.delete_task, task_id)
+    database.run_blocking(store.reflow_user, user, [plan_date], 14, 50)
+    assert_in_step(database, user)
+
+
+def test_archived_bookings_stay_counted_until_deleted(database, user):
+    old = date.today() - timedelta(days=archive.RETENTION_DAYS + 30)
+    task_id = new_task(database, user, 30, deadline=old)
+    database.run_blocking(store.schedule_task, task_id, old, time(5, 0))
+    database.run_blocking(store.complete_task, task_id, datetime.now())
+
+    moved = database.run_blocking(store.archive_batch, archive.cutoff(), datetime.now(), 100)
+    assert moved["bookings"] == 1
+    assert day_load_rows(database, user) == {old: (30, 1)}
+
+    database.run_blocking(store.delete_task, task_id)
+    assert day_load_rows(database, user) == {}
+
+
+def test_day_loads_read(database, user):
+    task_id = new_task(database, user, 45, deadline=MONDAY)
+    database.run_blocking(store.schedule_task, task_id, MONDAY, time(5, 0))
+    loads = database.run_blocking(store.day_loads, user, MONDAY, MONDAY + timedelta(days=1))
+    assert loads[0] == {"date": str(MONDAY), "booked_minutes": 45, "bookings": 1, "available_minutes": 11 * 60}
+    assert loads[1]["bookings"] == 0
+
+
+def test_lightest_placement_prefers_the_least_booked_day(database, user):
+    for start in (time(5, 0), time(16, 0)):
+        database.run_blocking(store.schedule_task, new_task(database, user, 60, deadline=MONDAY), MONDAY, start)
+    database.run_blocking(store.schedule_task, new_task(database, user, 60, deadline=MONDAY), MONDAY + timedelta(days=1),
+                          time(5, 0))
+
+    async def slot(conn, lightest):
+        return await find_available_slot(conn.cursor(), MONDAY, 30, user_id=user, deadline=MONDAY + timedelta(days=2),
+                                         lightest=lightest)
+
+    assert database.run_blocking(slot, False) == (MONDAY, time(6, 0))
+    assert database.run_blocking(slot, True) == (MONDAY + timedelta(days=2), time(5, 0))
@@ -0,0 +1,155 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+import idempotency
+import store
+from idempotency import IdempotencyStore, KeyReused
+
+
+def ok(body):
+    return {"status": 200, "headers": [], "body": body}
+
+
+def test_repeat_while_running_joins_the_first_request():
+    async def scenario():
+        keys = IdempotencyStore()
+        release = asyncio.Event()
+        calls = []
+
+        async def execute():
+            calls.append(1)
+            await release.wait()
+            return ok(b"first")
+
+        first = asyncio.ensure_future(keys.run("key", "request", execute))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(keys.run("key", "request", execute))
+        await asyncio.sleep(0)
+        release.set()
+        return await first, await second, calls, keys.stats()
+
+    first, second, calls, stats = asyncio.run(scenario())
+    assert first == (ok(b"first"), False)
+    assert second == (ok(b"first"), True)
+    assert calls == [1]
+    assert (stats["executed"], stats["joined"]) == (1, 1)
+
+
+def test_first_request_finishes_for_its_waiters_when_cancelled():
+    async def scenario():
+        keys = IdempotencyStore()
+        release = asyncio.Event()
+
+        async def execute():
+            await release.wait()
+            return ok(b"done")
+
+        first = asyncio.ensure_future(keys.run("key", "request", execute))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(keys.run("key", "request", execute))
+        await asyncio.sleep(0)
+        # The first client goes away; the request still runs, and its answer is kept
+        first.cancel()
+        release.set()
+        joined = await second
+        replayed = await keys.run("key", "request", execute)
+        return joined, replayed
+
+    joined, replayed = asyncio.run(scenario())
+    assert joined == (ok(b"done"), True)
+    assert replayed == (ok(b"done"), True)
+
+
+def test_stored_response_is_replayed_and_other_requests_rejected():
+    async def scenario():
+        keys = IdempotencyStore()
+        calls = []
+
+        async def execute():
+            calls.append(1)
+            return ok(b"once")
+
+        first = await keys.run("key", "request", execute)
+        again = await keys.run("key", "request", execute)
+        with pytest.raises(KeyReused):
+            await keys.run("key", "another request", execute)
+        return first, again, calls
+
+    first, again, calls = asyncio.run(scenario())
+    assert first == (ok(b"once"), False)
+    assert again == (ok(b"once"), True)
+    assert calls == [1]
+
+
+def test_errors_are_not_kept():
+    async def scenario():
+        keys = IdempotencyStore()
+        statuses = iter((503, 201))
+
+        async def execute():
+            return {"status": next(statuses), "headers": [], "body": b""}
+
+        return [(await keys.run("key", "request", execute))[0]["status"] for _ in range(3)]
+
+    # The 503 frees the key; the 201 is then kept
+    assert asyncio.run(scenario()) == [503, 201, 201]
+
+
+def test_least_recently_used_keys_go_first():
+    async def scenario():
+        keys = IdempotencyStore(max_keys=2)
+
+        async def execute():
+            return ok(b"")
+
+        for key in ("a", "b", "a", "c"):
+            await keys.run(key, "request", execute)
+        return [(await keys.run(key, "request", execute))[1] for key in ("a", "c", "b")]
+
+    # "b" was used least recently when "c" came in
+    assert asyncio.run(scenario()) == [True, True, False]
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    fresh = IdempotencyStore()
+    monkeypatch.setattr(idempotency, "store", fresh)
+    return fresh
+
+
+def add_task(client, user_id, key, title="write report"):
+    due = date.today() + timedelta(days=3)
+    return client.post("/tasks", params={"title": title, "duration": 30, "due_date": str(due)},
+                       headers={"X-User-Id": str(user_id), "Idempotency-Key": key})
+
+
+def count_tasks(database, user_id):
+    with database.checkout() as raw:
+        return raw.execute("SELECT COUNT(*) FROM tasks WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def test_retried_post_adds_one_task(client, database, user, keys):
+    first = add_task(client, user, "retry-1")
+    again = add_task(client, user, "retry-1")
+    assert first.status_code == 200
+    assert again.json() == first.json()
+    assert "idempotent-replayed" not in first.headers
+    assert again.headers["idempotent-replayed"] == "true"
+    assert count_tasks(database, user) == 1
+
+
+def test_reused_key_with_another_body_is_rejected(client, database, user, keys):
+    add_task(client, user, "retry-2")
+    assert add_task(client, user, "retry-2", title="something else").status_code == 422
+    assert count_tasks(database, user) == 1
+
+
+def test_keys_are_per_caller(client, database, user, keys):
+    # The user context is resolved before the key is looked up, so another user's key is another key
+    other = database.run_blocking(store.create_user, "other", "other-token-hash")
+    add_task(client, user, "shared-key")
+    response = add_task(client, other, "shared-key")
+    assert "idempotent-replayed" not in response.headers
+    assert (count_tasks(database, user), count_tasks(database, other)) == (1, 1)
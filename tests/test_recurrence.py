@@ -0,0 +1,143 @@
+import random
+from datetime import date, time, timedelta
+
+import pytest
+
+import recurrence
+import store
+from recurrence import Recurrence, format_weekdays, parse_weekdays
+from scheduler import find_available_slot
+from store import StoreError
+from tests.conftest import new_task
+
+MONDAY = date(2030, 1, 7)
+
+
+def naive_occurrences(rule, first_day, last_day):
+    """Every date from dtstart, checked one by one."""
+    found = []
+    day = rule.dtstart
+    while day <= last_day and (rule.until is None or day <= rule.until):
+        if rule.count is not None and len(found) >= rule.count:
+            break
+        if rule.freq == "daily":
+            matches = (day - rule.dtstart).days % rule.every == 0
+        else:
+            weeks = (day - timedelta(days=day.weekday()) - (rule.dtstart - timedelta(days=rule.dtstart.weekday()))).days // 7
+            matches = rule.weekdays >> day.weekday() & 1 and weeks % rule.every == 0
+        if matches:
+            found.append(day)
+        day += timedelta(days=1)
+    return [day for day in found if day >= first_day]
+
+
+def rule(freq="daily", every=1, weekdays=0, dtstart=MONDAY, until=None, count=None, start=9 * 60, duration=60):
+    return Recurrence(1, "rule", start, duration, freq, every, weekdays, dtstart, until, count)
+
+
+def test_parse_and_format_weekdays():
+    assert parse_weekdays("mo, we,FR") == 0b10101
+    assert format_weekdays(0b10101) == "MO,WE,FR"
+    with pytest.raises(ValueError):
+        parse_weekdays("MO,XX")
+
+
+def test_daily_every_other_day():
+    assert list(rule(every=2).occurrences(MONDAY, MONDAY + timedelta(days=6))) == [
+        MONDAY, MONDAY + timedelta(days=2), MONDAY + timedelta(days=4), MONDAY + timedelta(days=6)
+    ]
+
+
+def test_weekly_defaults_to_the_start_weekday():
+    wednesday = MONDAY + timedelta(days=2)
+    assert list(rule(freq="weekly", dtstart=wednesday).occurrences(MONDAY, MONDAY + timedelta(days=20))) == [
+        wednesday, wednesday + timedelta(weeks=1), wednesday + timedelta(weeks=2)
+    ]
+
+
+def test_count_is_counted_from_the_start():
+    # Five occurrences from MONDAY: a window from the fourth day sees the last two
+    daily = rule(count=5)
+    assert list(daily.occurrences(MONDAY + timedelta(days=3), MONDAY + timedelta(days=30))) == [
+        MONDAY + timedelta(days=3), MONDAY + timedelta(days=4)
+    ]
+
+
+def test_window_before_the_start_or_after_until_is_empty():
+    assert list(rule().occurrences(MONDAY - timedelta(days=10), MONDAY - timedelta(days=1))) == []
+    assert list(rule(until=MONDAY + timedelta(days=2)).occurrences(MONDAY + timedelta(days=3), MONDAY + timedelta(days=9))) == []
+
+
+def test_open_ended_rule_far_ahead():
+    far = MONDAY + timedelta(days=3650)
+    weekly = rule(freq="weekly", every=3, weekdays=parse_weekdays("TU,SA"))
+    assert list(weekly.occurrences(far, far + timedelta(days=30))) == naive_occurrences(weekly, far, far + timedelta(days=30))
+
+
+def test_occurrences_match_a_day_by_day_walk():
+    rng = random.Random(16)
+    for _ in range(300):
+        candidate = rule(
+            freq=rng.choice(("daily", "weekly")),
+            every=rng.randrange(1, 4),
+            weekdays=rng.randrange(1, 128),
+            dtstart=MONDAY + timedelta(days=rng.randrange(14)),
+            until=rng.choice((None, MONDAY + timedelta(days=rng.randrange(10, 120)))),
+            count=rng.choice((None, rng.randrange(1, 30))),
+        )
+        first_day = MONDAY + timedelta(days=rng.randrange(-7, 60))
+        last_day = first_day + timedelta(days=rng.randrange(0, 60))
+        assert list(candidate.occurrences(first_day, last_day)) == naive_occurrences(candidate, first_day, last_day)
+
+
+def test_in_range_orders_by_date_then_start():
+    late = Recurrence(1, "late", 18 * 60, 30, "daily", 1, 0, MONDAY)
+    early = Recurrence(2, "early", 6 * 60, 30, "weekly", 1, parse_weekdays("TU"), MONDAY)
+    pairs = [(day, found.title) for day, found in recurrence.in_range([late, early], MONDAY, MONDAY + timedelta(days=2))]
+    assert pairs == [(MONDAY, "late"), (MONDAY + timedelta(days=1), "early"),
+                     (MONDAY + timedelta(days=1), "late"), (MONDAY + timedelta(days=2), "late")]
+
+
+@pytest.fixture
+def daily_rule(database, user):
+    """A daily 05:00-06:00 recurring task for user from MONDAY."""
+    added = database.run_blocking(store.add_recurring_task, user, "gym", 5 * 60, 60, "daily", 1, 0, MONDAY)
+    recurrence.invalidate(user)
+    return added
+
+
+def test_schedule_shows_occurrences(database, user, daily_rule):
+    task_id = new_task(database, user, 30, deadline=MONDAY)
+    database.run_blocking(store.schedule_task, task_id, MONDAY, time(6, 0))
+    entries = database.run_blocking(store.day_schedule, user, MONDAY)
+    assert [(entry["title"], entry["start_time"], entry.get("recurring_id"))
+            for entry in entries] == [("gym", "05:00", daily_rule.id), ("task", "06:00", None)]
+    week = database.run_blocking(store.week_schedule, user, MONDAY)
+    assert all(day[0]["title"] == "gym" for day in week.values())
+
+
+def test_slot_finder_and_schedule_task_avoid_occurrences(database, user, daily_rule):
+    async def slot(conn):
+        return await find_available_slot(conn.cursor(), MONDAY, 30, user_id=user)
+
+    assert database.run_blocking(slot) == (MONDAY, time(6, 0))
+    task_id = new_task(database, user, 30, deadline=MONDAY)
+    with pytest.raises(StoreError):
+        database.run_blocking(store.schedule_task, task_id, MONDAY, time(5, 30))
+
+
+def test_export_includes_occurrences(database, user, daily_rule):
+    task_id = new_task(database, user, 30, deadline=MONDAY)
+    database.run_blocking(store.schedule_task, task_id, MONDAY + timedelta(days=1), time(6, 0))
+
+    async def export(conn):
+        return [row async for rows in store.export_schedule(conn, user, MONDAY, MONDAY + timedelta(days=2), 1)
+                for row in rows]
+
+    rows = database.run_blocking(export)
+    assert [(row[0], row[1], row[8]) for row in rows] == [
+        (MONDAY, None, daily_rule.id),
+        (MONDAY + timedelta(days=1), None, daily_rule.id),
+        (MONDAY + timedelta(days=1), task_id, None),
+        (MONDAY + timedelta(days=2), None, daily_rule.id),
+    ]
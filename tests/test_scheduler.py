@@ -0,0 +1,76 @@
+from datetime import date, time, timedelta
+
+import pytest
+
+import store
+from scheduler import BusyCalendar, find_available_slot
+from store import StoreError
+from tests.conftest import new_task
+
+MONDAY = date(2030, 1, 7)
+SATURDAY = MONDAY + timedelta(days=5)
+
+
+async def slot(conn, day, duration, user_id=None):
+    return await find_available_slot(conn.cursor(), day, duration, user_id=user_id)
+
+
+def book(database, user_id, day, start, duration):
+    task_id = new_task(database, user_id, duration, deadline=day)
+    database.run_blocking(store.schedule_task, task_id, day, start)
+    return task_id
+
+
+def test_empty_weekday_starts_at_five(database, user):
+    assert database.run_blocking(slot, MONDAY, 30, user) == (MONDAY, time(5, 0))
+
+
+def test_weekday_skips_school_hours(database, user):
+    book(database, user, MONDAY, time(5, 0), 180)
+    assert database.run_blocking(slot, MONDAY, 30, user) == (MONDAY, time(16, 0))
+
+
+def test_task_fits_in_a_gap_between_bookings(database, user):
+    book(database, user, MONDAY, time(5, 0), 60)
+    book(database, user, MONDAY, time(6, 30), 90)
+    assert database.run_blocking(slot, MONDAY, 30, user) == (MONDAY, time(6, 0))
+    assert database.run_blocking(slot, MONDAY, 45, user) == (MONDAY, time(16, 0))
+
+
+def test_full_day_moves_to_the_next(database, user):
+    book(database, user, SATURDAY, time(5, 0), 19 * 60)
+    assert database.run_blocking(slot, SATURDAY, 30, user) == (SATURDAY + timedelta(days=1), time(5, 0))
+
+
+def test_user_and_all_users_paths_agree(database, user):
+    for start in (time(5, 0), time(6, 0), time(16, 0), time(17, 30)):
+        book(database, user, MONDAY, start, 45)
+    assert database.run_blocking(slot, MONDAY, 45, user) == database.run_blocking(slot, MONDAY, 45)
+
+
+def test_other_users_bookings_dont_block(database, user):
+    book(database, 1, MONDAY, time(5, 0), 180)
+    assert database.run_blocking(slot, MONDAY, 30, user) == (MONDAY, time(5, 0))
+
+
+def test_schedule_task_rejects_an_overlap(database, user):
+    book(database, user, MONDAY, time(16, 0), 60)
+    task_id = new_task(database, user, 30, deadline=MONDAY)
+    with pytest.raises(StoreError) as error:
+        database.run_blocking(store.schedule_task, task_id, MONDAY, time(16, 30))
+    assert error.value.status_code == 400
+    # Back to back is not an overlap
+    database.run_blocking(store.schedule_task, task_id, MONDAY, time(17, 0))
+
+
+def test_rescheduling_ignores_the_tasks_own_slot(database, user):
+    task_id = book(database, user, MONDAY, time(16, 0), 60)
+    database.run_blocking(store.schedule_task, task_id, MONDAY, time(16, 30))
+    assert [entry["start_time"] for entry in database.run_blocking(store.day_schedule, user, MONDAY)] == ["16:30"]
+
+
+def test_busy_calendar_marks_off_grid_bookings():
+    calendar = BusyCalendar(MONDAY, MONDAY)
+    # 05:02-05:32 touches the 05:00 and 05:30 slots, so 30 minutes first fit at 05:35
+    calendar.add(MONDAY, 5 * 60 + 2, 30)
+    assert calendar.find_slot(MONDAY, 30) == (MONDAY, time(5, 35))
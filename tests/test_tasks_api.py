@@ -0,0 +1,56 @@
+from datetime import date, timedelta
+
+import pytest
+
+import responses
+from tests.conftest import new_task
+
+DAY = date(2030, 1, 7)
+
+
+@pytest.fixture
+def tasks(database, user):
+    """Tasks with and without deadlines, several on the same date, inserted out of order."""
+    deadlines = [DAY + timedelta(days=2), None, DAY, DAY + timedelta(days=2), None, DAY, DAY + timedelta(days=1), None]
+    return [(new_task(database, user, deadline=deadline, title=f"task {index}"), deadline)
+            for index, deadline in enumerate(deadlines)]
+
+
+def expected_order(tasks):
+    # NULL deadlines first, as MySQL sorts them, then by deadline and id
+    return [task_id for task_id, deadline in sorted(tasks, key=lambda task: (task[1] is not None, task[1] or date.min, task[0]))]
+
+
+def pages(client, user, limit):
+    headers = {"X-User-Id": str(user)}
+    params = {"limit": limit}
+    bodies = []
+    while True:
+        response = client.get("/tasks", params=params, headers=headers)
+        assert response.status_code == 200
+        bodies.append(response.json())
+        if "X-Next-Cursor" not in response.headers:
+            return bodies
+        params["cursor"] = response.headers["X-Next-Cursor"]
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 100])
+def test_pages_cover_every_task_once_in_order(client, user, tasks, limit):
+    ids = [task["id"] for body in pages(client, user, limit) for task in body]
+    assert ids == expected_order(tasks)
+
+
+def test_fast_path_returns_the_same_pages(client, user, tasks, monkeypatch):
+    slow = pages(client, user, 3)
+    monkeypatch.setattr(responses, "FAST_JSON", True)
+    assert pages(client, user, 3) == slow
+
+
+def test_null_deadline_is_null_in_the_body(client, user, tasks):
+    first = pages(client, user, 1)[0][0]
+    assert first["due_date"] is None
+
+
+def test_invalid_cursor_is_rejected(client, user):
+    response = client.get("/tasks", params={"cursor": "not-a-cursor"}, headers={"X-User-Id": str(user)})
+    assert response.status_code == 400
@@ -0,0 +1,245 @@
+"""
+Which user a request is for, resolved once per request and cached across them.
+
+UserContextMiddleware copies the caller's credentials off the request into
+a context variable, without any database work:
+
+- Authorization: Bearer <token>  an API token from POST /users
+- X-User-Id: <id>                a user id, for trusted callers and tools
+
+Handlers call `await resolve(user_id)` with the endpoint's optional
+user_id parameter. A token wins. Naming another user alongside it is
+rejected. Then comes user_id, then X-User-Id. With none of them the
+request is anonymous and gets the default user (the lowest id), as before.
+A named user is checked against the database once. The answer is kept on
+the request context, so later calls in the same request are free. It is
+also kept in bounded caches for USER_CACHE_TTL seconds: known user ids,
+token -> user id, and the default user. A hot write path like POST /tasks
+then runs no user lookup of its own. store.lock_user still checks the user
+inside the write transaction, since that is also the lock.
+
+invalidate(user_id) drops a user from every cache, in every worker (see
+shared.py). The API calls it when it creates or deletes a user.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+import db
+import store
+from shared import bus
+from store import StoreError
+
+CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+
+class UserContext:
+    """Credentials of the current request and what they resolved to."""
+
+    def __init__(self, token=None, header_user_id=None):
+        self.token = token
+        self.header_user_id = header_user_id
+        self.resolved = {}  # explicit user_id -> resolved user_id
+
+    @property
+    def anonymous(self) -> bool:
+        return self.token is None and self.header_user_id is None
+
+
+current = ContextVar("user_context", default=None)
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class UserCache:
+    """Bounded TTL caches of known user ids, token hashes and the default user."""
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._known = OrderedDict()  # user_id -> checked_at
+        self._tokens = OrderedDict()  # token hash -> (user_id, checked_at)
+        self._default = None  # (user_id, checked_at)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _fresh(self, checked_at) -> bool:
+        return time.monotonic() - checked_at < self.ttl
+
+    def _count(self, hit: bool):
+        self._stats["hits" if hit else "misses"] += 1
+
+    def _put(self, entries, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def known(self, user_id: int) -> bool:
+        with self._lock:
+            checked_at = self._known.get(user_id)
+            hit = checked_at is not None and self._fresh(checked_at)
+            if hit:
+                self._known.move_to_end(user_id)
+            self._count(hit)
+            return hit
+
+    def remember(self, user_id: int):
+        with self._lock:
+            self._put(self._known, user_id, time.monotonic())
+
+    def token_user(self, token_hash: str):
+        with self._lock:
+            entry = self._tokens.get(token_hash)
+            hit = entry is not None and self._fresh(entry[1])
+            if hit:
+                self._tokens.move_to_end(token_hash)
+            self._count(hit)
+            return entry[0] if hit else None
+
+    def remember_token(self, token_hash: str, user_id: int):
+        with self._lock:
+            self._put(self._tokens, token_hash, (user_id, time.monotonic()))
+            self._put(self._known, user_id, time.monotonic())
+
+    def default_user(self):
+        with self._lock:
+            hit = self._default is not None and self._fresh(self._default[1])
+            self._count(hit)
+            return self._default[0] if hit else None
+
+    def remember_default(self, user_id: int):
+        with self._lock:
+            self._default = (user_id, time.monotonic())
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._known.pop(user_id, None)
+            for token_hash in [key for key, (owner, _) in self._tokens.items() if owner == user_id]:
+                del self._tokens[token_hash]
+            # A new or deleted user can change which one is lowest
+            self._default = None
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._known.clear()
+            self._tokens.clear()
+            self._default = None
+
+    def stats(self):
+        with self._lock:
+            return {"user_ids": len(self._known), "tokens": len(self._tokens), **self._stats}
+
+
+user_cache = UserCache()
+
+
+async def _check_user(user_id: int) -> int:
+    if not user_cache.known(user_id):
+        if not await db.run(store.user_exists, user_id):
+            raise StoreError(404, f"User with id {user_id} does not exist")
+        user_cache.remember(user_id)
+    return user_id
+
+
+async def _token_user(token: str) -> int:
+    token_hash = hash_token(token)
+    user_id = user_cache.token_user(token_hash)
+    if user_id is None:
+        user_id = await db.run(store.token_user, token_hash)
+        if user_id is None:
+            raise StoreError(401, "Invalid API token")
+        user_cache.remember_token(token_hash, user_id)
+    return user_id
+
+
+async def _default_user() -> int:
+    user_id = user_cache.default_user()
+    if user_id is None:
+        try:
+            user_id = await db.run(store.default_user_id)
+        except Exception:
+            # As before: an unreachable database still lets the request try user 1
+            return 1
+        user_cache.remember_default(user_id)
+    return user_id
+
+
+async def _resolve(context, user_id):
+    if context.token is not None:
+        token_user_id = await _token_user(context.token)
+        if user_id is not None and user_id != token_user_id:
+            raise StoreError(403, "The API token belongs to another user")
+        return token_user_id
+    if user_id is None and context.header_user_id is not None:
+        try:
+            user_id = int(context.header_user_id)
+        except ValueError:
+            raise StoreError(400, f"Invalid X-User-Id header: {context.header_user_id}")
+    if user_id is not None:
+        return await _check_user(user_id)
+    return await _default_user()
+
+
+async def resolve(user_id: int = None) -> int:
+    """The user the current request is for; user_id is the endpoint's optional parameter."""
+    context = current.get()
+    if context is None:
+        # Outside a request (scripts, background jobs)
+        return await _resolve(UserContext(), user_id)
+    if user_id not in context.resolved:
+        context.resolved[user_id] = await _resolve(context, user_id)
+    return context.resolved[user_id]
+
+
+async def owner() -> int:
+    """The user named by the request's credentials, or None for an anonymous request."""
+    context = current.get()
+    if context is None or context.anonymous:
+        return None
+    return await resolve()
+
+
+def invalidate(user_id: int):
+    bus.publish("users.invalidate", user_id)
+
+
+bus.on("users.invalidate", lambda user_id, seq: user_cache.invalidate(user_id))
+bus.on("reset", lambda payload, seq: user_cache.clear())
+
+
+def context_from_headers(headers) -> UserContext:
+    """headers: the ASGI scope's list of (name, value) byte pairs."""
+    token = header_user_id = None
+    for name, value in headers:
+        if name == b"authorization":
+            scheme, _, credentials = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and credentials.strip():
+                token = credentials.strip()
+        elif name == b"x-user-id":
+            header_user_id = value.decode("latin-1").strip()
+    return UserContext(token, header_user_id)
+
+
+class UserContextMiddleware:
+    """ASGI middleware: puts the request's credentials in `current` for resolve()."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current.set(context_from_headers(scope["headers"]))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current.reset(token)